@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Search ranking benchmark for the Summer School Chatbot knowledge base
+
+Compares the per-entry Python scorer ('heuristic') with the vectorized
+sparse-matrix scorer ('vector') over synthetic corpora of growing size and
+reports the corpus size at which the vectorized scorer becomes faster.
+
+Usage:
+    python benchmarks/search_benchmark.py [--sizes 100 1000 5000] [--repeat 20]
+"""
+
+import argparse
+import logging
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the src directory to the path
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from knowledge_base import KnowledgeBase
+
+QUERIES = [
+    '书院的地址在哪里？',
+    '我需要准备什么床上用品？',
+    '晚间活动是强制参加的吗？',
+    '如何邮寄物品到学校？',
+    '报到几点开始',
+    'Where is the campus?',
+]
+
+VOCABULARY = list('唯理书院暑期项目上海浦东校园报到时间住宿活动规则行为参与讨论分享学生老师课程') + [
+    '地址', '晚间活动', '床上用品', '床垫', '门卫', '签到', '邮寄', '快递', '不当行为', '时间安排',
+]
+
+
+def build_knowledge_base(size: int, directory: Path, seed: int = 0) -> KnowledgeBase:
+    """Build a knowledge base with `size` synthetic documents, saved in `directory`."""
+    rnd = random.Random(seed)
+    path = directory / f'knowledge_base_{size}.json'
+    # Without the search cache every timed query is ranked, not looked up
+    kb = KnowledgeBase(str(path), cache_size=0)
+    
+    documents = {}
+    for i in range(size):
+        sentences = [
+            ''.join(rnd.choice(VOCABULARY) for _ in range(rnd.randint(5, 30)))
+            for _ in range(rnd.randint(1, 8))
+        ]
+        documents[f'文档{i}'] = '。'.join(sentences)
+    # Published as one new snapshot, as a Drive update would be
+    kb.update_from_drive_documents(documents)
+    return kb
+
+
+def time_search(kb: KnowledgeBase, mode: str, repeat: int) -> float:
+    """Return the mean time per query in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in QUERIES:
+            kb.search(query, max_results=3, mode=mode)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(QUERIES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark knowledge base ranking modes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5, 10, 30, 100, 300, 1000, 3000, 10000])
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    
+    logging.disable(logging.INFO)
+    
+    print(f"{'entries':>8} {'heuristic ms':>13} {'vector ms':>10} {'matrix build ms':>16}")
+    crossover = None
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            kb = build_knowledge_base(size, Path(directory))
+            
+            start = time.perf_counter()
+            kb.search(QUERIES[0], max_results=3, mode='vector')
+            build_ms = (time.perf_counter() - start) * 1000
+            
+            heuristic_ms = time_search(kb, 'heuristic', args.repeat)
+            vector_ms = time_search(kb, 'vector', args.repeat)
+            print(f"{size:>8} {heuristic_ms:>13.3f} {vector_ms:>10.3f} {build_ms:>16.1f}")
+            
+            if crossover is None and vector_ms < heuristic_ms:
+                crossover = size
+    
+    if crossover is None:
+        print("\nThe vectorized scorer was not faster at any tested size")
+    else:
+        print(f"\nThe vectorized scorer is faster from about {crossover} entries")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,9 @@
 启动唯理书院智能助手Web API服务器
 
 Simple server runner for the chatbot web API
+
+    python run_server.py               # Flask development server
+    python run_server.py --production  # gunicorn workers (or API_SERVER=production)
 """
 
 import os
@@ -17,6 +20,8 @@ sys.path.insert(0, str(current_dir.parent))
 
 def main():
     """启动Web API服务器"""
+    production = '--production' in sys.argv[1:] or os.getenv('API_SERVER', '').lower() == 'production'
+    
     print("🚀 启动唯理书院智能助手Web API")
     print("=" * 60)
     
@@ -25,7 +30,10 @@ def main():
         os.chdir(src_dir)
         
         # Import and run the web API
-        from web_api import main as web_main
+        if production:
+            from production_server import main as web_main
+        else:
+            from web_api import main as web_main
         web_main()
         
     except ImportError as e:
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+唯理书院聊天机器人 Web API 公共部分
+
+Limits, request validation and the test page shared by the Flask API
+(web_api) and the ASGI API (asgi_api); it imports neither web framework.
+"""
+
+import os
+import re
+
+# Most questions accepted by one /api/chat/batch request
+MAX_BATCH_SIZE = int(os.getenv('BATCH_MAX_QUESTIONS', '500'))
+
+# Longest a /api/chat/result request may wait for a background answer (seconds)
+MAX_RESULT_WAIT = 30
+
+# Session ids are chosen by the client and are the only key to its
+# conversation history, so they must be hard to guess, e.g. a UUID
+SESSION_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{16,128}')
+
+def parse_session_id(value):
+    """校验会话ID，返回 (会话ID, 错误信息)；未提供会话ID时两者均为None"""
+    if value is None or value == '':
+        return None, None
+    session_id = str(value)
+    if not SESSION_ID_PATTERN.fullmatch(session_id):
+        return None, ('无效的会话ID', 'session_id must be 16-128 letters, digits, "-" or "_", e.g. a UUID')
+    return session_id, None
+
+def parse_batch_messages(data):
+    """校验批量请求中的消息列表，返回 (消息列表, 错误信息)"""
+    messages = data.get('messages') if isinstance(data, dict) else None
+    if not isinstance(messages, list) or not all(isinstance(m, str) and m.strip() for m in messages):
+        return None, ('无效的请求格式', 'messages must be a list of non-empty strings')
+    if not messages:
+        return None, ('消息不能为空', 'messages cannot be empty')
+    if len(messages) > MAX_BATCH_SIZE:
+        return None, ('消息数量过多', f'At most {MAX_BATCH_SIZE} messages per request')
+    return [m.strip() for m in messages], None
+
+# HTML template for testing the API
+TEST_PAGE_HTML = """
+<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>唯理书院智能助手 - 测试页面</title>
+    <style>
+        body {
+            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+            background-color: #f5f5f5;
+        }
+        .container {
+            background: white;
+            border-radius: 10px;
+            padding: 30px;
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
+        }
+        .header {
+            text-align: center;
+            margin-bottom: 30px;
+            color: #333;
+        }
+        .chat-container {
+            border: 1px solid #ddd;
+            border-radius: 8px;
+            height: 400px;
+            overflow-y: auto;
+            padding: 15px;
+            margin-bottom: 20px;
+            background-color: #fafafa;
+        }
+        .message {
+            margin-bottom: 15px;
+            padding: 10px;
+            border-radius: 8px;
+        }
+        .user-message {
+            background-color: #007bff;
+            color: white;
+            text-align: right;
+            margin-left: 20%;
+        }
+        .bot-message {
+            background-color: #e9ecef;
+            color: #333;
+            margin-right: 20%;
+        }
+        .input-group {
+            display: flex;
+            gap: 10px;
+        }
+        .input-field {
+            flex: 1;
+            padding: 12px;
+            border: 1px solid #ddd;
+            border-radius: 6px;
+            font-size: 14px;
+        }
+        .send-button {
+            padding: 12px 20px;
+            background-color: #007bff;
+            color: white;
+            border: none;
+            border-radius: 6px;
+            cursor: pointer;
+            font-size: 14px;
+        }
+        .send-button:hover {
+            background-color: #0056b3;
+        }
+        .send-button:disabled {
+            background-color: #6c757d;
+            cursor: not-allowed;
+        }
+        .status {
+            text-align: center;
+            padding: 10px;
+            margin-bottom: 20px;
+            border-radius: 6px;
+        }
+        .status.online {
+            background-color: #d4edda;
+            color: #155724;
+            border: 1px solid #c3e6cb;
+        }
+        .status.offline {
+            background-color: #f8d7da;
+            color: #721c24;
+            border: 1px solid #f5c6cb;
+        }
+        .api-info {
+            background-color: #e3f2fd;
+            padding: 15px;
+            border-radius: 6px;
+            margin-top: 20px;
+            font-size: 12px;
+            color: #1565c0;
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🎓 唯理书院智能助手</h1>
+            <p>测试页面 - Web API接口演示</p>
+        </div>
+        
+        <div id="status" class="status offline">
+            🔄 正在连接聊天机器人...
+        </div>
+        
+        <div id="chatContainer" class="chat-container">
+            <div class="message bot-message">
+                <strong>🤖 助手:</strong> 你好！我是唯理书院智能助手。有什么可以帮助你的吗？
+            </div>
+        </div>
+        
+        <div class="input-group">
+            <input type="text" id="messageInput" class="input-field" 
+                   placeholder="请输入你的问题..." 
+                   onkeypress="handleKeyPress(event)">
+            <button id="sendButton" class="send-button" onclick="sendMessage()">
+                发送
+            </button>
+        </div>
+        
+        <div class="api-info">
+            <strong>📡 API接口信息:</strong><br>
+            • POST /api/chat - 发送消息到聊天机器人<br>
+            • POST /api/chat/stream - 流式发送消息 (Server-Sent Events)<br>
+            • GET /api/chat/result/&lt;response_id&gt; - 获取后台生成的回答 (refine模式)<br>
+            • POST /api/chat/batch - 批量发送消息<br>
+            • GET /api/status - 检查聊天机器人状态<br>
+            • GET/DELETE /api/history - 获取或清除会话记录<br>
+            • GET /api/stats - 获取统计信息<br>
+            • GET / - 此测试页面
+        </div>
+    </div>
+
+    <script>
+        let isOnline = false;
+        const sessionId = getSessionId();
+        
+        // Identify this browser's conversation so its history is kept separately
+        function getSessionId() {
+            let id = localStorage.getItem('chatbotSessionId');
+            if (!id) {
+                id = (window.crypto && crypto.randomUUID)
+                    ? crypto.randomUUID()
+                    : Date.now().toString(36) + Math.random().toString(36).slice(2);
+                localStorage.setItem('chatbotSessionId', id);
+            }
+            return id;
+        }
+        
+        // Check chatbot status on page load
+        window.onload = function() {
+            checkStatus();
+        };
+        
+        function checkStatus() {
+            fetch('/api/status')
+                .then(response => response.json())
+                .then(data => {
+                    const statusDiv = document.getElementById('status');
+                    if (data.status === 'online') {
+                        statusDiv.className = 'status online';
+                        statusDiv.innerHTML = '✅ 聊天机器人在线';
+                        isOnline = true;
+                    } else {
+                        statusDiv.className = 'status offline';
+                        statusDiv.innerHTML = '❌ 聊天机器人离线';
+                        isOnline = false;
+                    }
+                })
+                .catch(error => {
+                    console.error('Error:', error);
+                    const statusDiv = document.getElementById('status');
+                    statusDiv.className = 'status offline';
+                    statusDiv.innerHTML = '❌ 连接失败';
+                });
+        }
+        
+        function handleKeyPress(event) {
+            if (event.key === 'Enter') {
+                sendMessage();
+            }
+        }
+        
+        function sendMessage() {
+            if (!isOnline) {
+                alert('聊天机器人当前离线，请稍后再试。');
+                return;
+            }
+            
+            const input = document.getElementById('messageInput');
+            const message = input.value.trim();
+            
+            if (!message) return;
+            
+            // Add user message to chat
+            addMessage(message, 'user');
+            
+            // Clear input and disable button
+            input.value = '';
+            const sendButton = document.getElementById('sendButton');
+            sendButton.disabled = true;
+            sendButton.textContent = '发送中...';
+            
+            // Stream the answer into a new bot message as it arrives
+            const botText = addStreamingMessage();
+            const chatContainer = document.getElementById('chatContainer');
+            
+            streamChat('/api/chat/stream', {
+                message: message,
+                session_id: sessionId,
+                use_llm: false  // Set to true if you want LLM responses
+            }, delta => {
+                botText.textContent += delta;
+                chatContainer.scrollTop = chatContainer.scrollHeight;
+            })
+            .then(data => {
+                botText.textContent = data.response;
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                if (!botText.textContent) {
+                    botText.textContent = '抱歉，处理您的消息时出现错误。';
+                }
+            })
+            .finally(() => {
+                sendButton.disabled = false;
+                sendButton.textContent = '发送';
+            });
+        }
+        
+        // POST to an SSE endpoint and call onDelta for every chunk;
+        // resolves with the final 'done' event, rejects on 'error'
+        function streamChat(url, payload, onDelta) {
+            return fetch(url, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify(payload)
+            }).then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP ${response.status}`);
+                }
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                
+                function pump() {
+                    return reader.read().then(({ done, value }) => {
+                        if (done) {
+                            throw new Error('Stream ended without a response');
+                        }
+                        buffer += decoder.decode(value, { stream: true });
+                        let boundary;
+                        while ((boundary = buffer.indexOf('\\n\\n')) >= 0) {
+                            const block = buffer.slice(0, boundary);
+                            buffer = buffer.slice(boundary + 2);
+                            let event = 'message';
+                            let data = '';
+                            block.split('\\n').forEach(line => {
+                                if (line.startsWith('event:')) event = line.slice(6).trim();
+                                else if (line.startsWith('data:')) data += line.slice(5).trim();
+                            });
+                            const payload = data ? JSON.parse(data) : {};
+                            if (event === 'delta') {
+                                onDelta(payload.delta);
+                            } else if (event === 'done') {
+                                reader.cancel();
+                                return payload;
+                            } else if (event === 'error') {
+                                throw new Error(payload.message || payload.error);
+                            }
+                        }
+                        return pump();
+                    });
+                }
+                return pump();
+            });
+        }
+        
+        function addStreamingMessage() {
+            const chatContainer = document.getElementById('chatContainer');
+            const messageDiv = document.createElement('div');
+            messageDiv.className = 'message bot-message';
+            messageDiv.innerHTML = '<strong>🤖 助手:</strong> ';
+            
+            const textSpan = document.createElement('span');
+            messageDiv.appendChild(textSpan);
+            chatContainer.appendChild(messageDiv);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+            return textSpan;
+        }
+        
+        function addMessage(message, sender) {
+            const chatContainer = document.getElementById('chatContainer');
+            const messageDiv = document.createElement('div');
+            
+            if (sender === 'user') {
+                messageDiv.className = 'message user-message';
+                messageDiv.innerHTML = `<strong>👤 你:</strong> ${message}`;
+            } else {
+                messageDiv.className = 'message bot-message';
+                messageDiv.innerHTML = `<strong>🤖 助手:</strong> ${message}`;
+            }
+            
+            chatContainer.appendChild(messageDiv);
+            chatContainer.scrollTop = chatContainer.scrollHeight;
+        }
+    </script>
+</body>
+</html>
+"""
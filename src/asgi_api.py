@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+唯理书院聊天机器人 ASGI Web API
+
+web_api 的异步版本：聊天请求通过 SummerSchoolChatbot.aask 处理，
+等待LLM响应时不占用线程，单个进程即可同时处理大量请求。
+
+Run with: uvicorn asgi_api:app --host 0.0.0.0 --port 5000
+"""
+
+import os
+import sys
+import json
+import logging
+from contextlib import asynccontextmanager
+from pathlib import Path
+from datetime import datetime
+
+try:
+    from starlette.applications import Starlette
+    from starlette.concurrency import run_in_threadpool
+    from starlette.middleware import Middleware
+    from starlette.middleware.cors import CORSMiddleware
+    from starlette.requests import Request
+    from starlette.responses import HTMLResponse, JSONResponse, StreamingResponse
+    from starlette.routing import Route
+except ImportError:
+    print("Warning: ASGI dependencies not installed.")
+    print("Run: pip install starlette uvicorn")
+    raise
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parent))
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from chatbot_engine import SummerSchoolChatbot
+from api_common import MAX_RESULT_WAIT, TEST_PAGE_HTML, parse_batch_messages, parse_session_id
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Global chatbot instance
+chatbot = None
+
+def initialize_chatbot():
+    """初始化聊天机器人"""
+    global chatbot
+    try:
+        chatbot = SummerSchoolChatbot()
+        logger.info("✅ 聊天机器人初始化成功")
+        return True
+    except Exception as e:
+        logger.error(f"❌ 聊天机器人初始化失败: {e}")
+        return False
+
+def _not_initialized() -> JSONResponse:
+    return JSONResponse({
+        'success': False,
+        'error': '聊天机器人未初始化',
+        'message': 'Chatbot not initialized'
+    }, status_code=500)
+
+async def _parse_chat_request(request: Request):
+    """解析聊天请求，返回 (消息, use_llm, 会话ID, 错误响应)"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    
+    if not isinstance(data, dict) or 'message' not in data:
+        return None, False, None, JSONResponse({
+            'success': False,
+            'error': '无效的请求格式',
+            'message': 'Invalid request format'
+        }, status_code=400)
+    
+    user_message = str(data['message']).strip()
+    if not user_message:
+        return None, False, None, JSONResponse({
+            'success': False,
+            'error': '消息不能为空',
+            'message': 'Message cannot be empty'
+        }, status_code=400)
+    
+    session_id, error = get_session_id(request, data)
+    if error:
+        return None, False, None, error
+    
+    return user_message, data.get('use_llm', False), session_id, None
+
+def get_session_id(request: Request, data=None):
+    """从请求体或X-Session-ID请求头获取会话ID，返回 (会话ID, 错误响应)"""
+    session_id, error = parse_session_id((data or {}).get('session_id') or request.headers.get('x-session-id'))
+    if error:
+        return None, JSONResponse({
+            'success': False,
+            'error': error[0],
+            'message': error[1]
+        }, status_code=400)
+    return session_id, None
+
+async def test_page(request: Request):
+    """测试页面"""
+    return HTMLResponse(TEST_PAGE_HTML)
+
+async def get_status(request: Request):
+    """获取聊天机器人状态"""
+    return JSONResponse({
+        'status': 'online' if chatbot else 'offline',
+        'timestamp': datetime.now().isoformat(),
+        'message': '聊天机器人运行正常' if chatbot else '聊天机器人未初始化'
+    })
+
+async def chat(request: Request):
+    """聊天接口"""
+    if not chatbot:
+        return _not_initialized()
+    
+    user_message, use_llm, session_id, error = await _parse_chat_request(request)
+    if error:
+        return error
+    
+    try:
+        if (await request.json()).get('refine', False):
+            # Answer now; the LLM answer is fetched from /api/chat/result/{response_id}
+            result = await run_in_threadpool(
+                chatbot.ask_fast, user_message, use_llm=use_llm, session_id=session_id
+            )
+            return JSONResponse({
+                'success': True,
+                'response': result['response'],
+                'response_id': result['response_id'],
+                'refining': result['refining'],
+                'timestamp': datetime.now().isoformat(),
+                'user_message': user_message,
+                'used_llm': use_llm
+            })
+        
+        response = await chatbot.aask(user_message, use_llm=use_llm, session_id=session_id)
+        return JSONResponse({
+            'success': True,
+            'response': response,
+            'timestamp': datetime.now().isoformat(),
+            'user_message': user_message,
+            'used_llm': use_llm
+        })
+    except Exception as e:
+        logger.error(f"Chat API error: {e}")
+        return JSONResponse({
+            'success': False,
+            'error': '处理消息时出现错误',
+            'message': str(e)
+        }, status_code=500)
+
+async def chat_batch(request: Request):
+    """批量聊天接口"""
+    if not chatbot:
+        return _not_initialized()
+    
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    
+    messages, error = parse_batch_messages(data)
+    if error:
+        return JSONResponse({
+            'success': False,
+            'error': error[0],
+            'message': error[1]
+        }, status_code=400)
+    
+    session_id, error = get_session_id(request, data)
+    if error:
+        return error
+    
+    use_llm = data.get('use_llm', False)
+    
+    try:
+        results = await run_in_threadpool(
+            chatbot.ask_many, messages, use_llm=use_llm, session_id=session_id
+        )
+        return JSONResponse({
+            'success': True,
+            'results': results,
+            'count': len(results),
+            'timestamp': datetime.now().isoformat(),
+            'used_llm': use_llm
+        })
+    except Exception as e:
+        logger.error(f"Chat batch API error: {e}")
+        return JSONResponse({
+            'success': False,
+            'error': '处理消息时出现错误',
+            'message': str(e)
+        }, status_code=500)
+
+async def chat_result(request: Request):
+    """获取后台生成的LLM回答（可用wait参数长轮询）"""
+    if not chatbot:
+        return _not_initialized()
+    
+    try:
+        wait = float(request.query_params.get('wait', 0))
+    except ValueError:
+        wait = 0.0
+    wait = min(max(wait, 0.0), MAX_RESULT_WAIT)
+    
+    result = await chatbot.aget_refined_response(request.path_params['response_id'], wait=wait)
+    if result is None:
+        return JSONResponse({
+            'success': False,
+            'error': '回答不存在或已过期',
+            'message': 'Unknown or expired response_id'
+        }, status_code=404)
+    
+    return JSONResponse({
+        'success': True,
+        **result,
+        'timestamp': datetime.now().isoformat()
+    })
+
+def _sse_event(event: str, data: dict) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def chat_stream(request: Request):
+    """流式聊天接口（Server-Sent Events）"""
+    if not chatbot:
+        return _not_initialized()
+    
+    user_message, use_llm, session_id, error = await _parse_chat_request(request)
+    if error:
+        return error
+    
+    # ask_stream is a blocking generator; Starlette iterates it in a worker thread
+    def generate():
+        chunks = []
+        try:
+            for chunk in chatbot.ask_stream(user_message, use_llm=use_llm, session_id=session_id):
+                chunks.append(chunk)
+                yield _sse_event('delta', {'delta': chunk})
+            
+            yield _sse_event('done', {
+                'success': True,
+                'response': ''.join(chunks),
+                'timestamp': datetime.now().isoformat(),
+                'user_message': user_message,
+                'used_llm': use_llm
+            })
+        except Exception as e:
+            logger.error(f"Chat stream API error: {e}")
+            yield _sse_event('error', {
+                'success': False,
+                'error': '处理消息时出现错误',
+                'message': str(e)
+            })
+    
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+        }
+    )
+
+async def conversation_history(request: Request):
+    """获取或清除当前会话的对话记录"""
+    if not chatbot:
+        return _not_initialized()
+    
+    # Only from the header: query strings end up in access logs
+    session_id, error = get_session_id(request)
+    if error:
+        return error
+    if not session_id:
+        return JSONResponse({
+            'success': False,
+            'error': '缺少会话ID',
+            'message': 'session_id is required'
+        }, status_code=400)
+    
+    if request.method == 'DELETE':
+        await run_in_threadpool(chatbot.clear_conversation_history, session_id)
+        return JSONResponse({
+            'success': True,
+            'message': '对话记录已清除',
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return JSONResponse({
+        'success': True,
+        'history': await run_in_threadpool(chatbot.get_conversation_history, session_id),
+        'timestamp': datetime.now().isoformat()
+    })
+
+async def get_stats(request: Request):
+    """获取统计信息"""
+    if not chatbot:
+        return _not_initialized()
+    
+    try:
+        return JSONResponse({
+            'success': True,
+            'stats': await run_in_threadpool(chatbot.get_statistics),
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Stats API error: {e}")
+        return JSONResponse({
+            'success': False,
+            'error': '获取统计信息时出现错误',
+            'message': str(e)
+        }, status_code=500)
+
+async def update_knowledge(request: Request):
+    """更新知识库"""
+    if not chatbot:
+        return _not_initialized()
+    
+    try:
+        success = await run_in_threadpool(chatbot.update_from_drive)
+        return JSONResponse({
+            'success': success,
+            'message': '知识库更新成功' if success else '知识库更新失败',
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Update API error: {e}")
+        return JSONResponse({
+            'success': False,
+            'error': '更新知识库时出现错误',
+            'message': str(e)
+        }, status_code=500)
+
+async def health_check(request: Request):
+    """健康检查"""
+    return JSONResponse({
+        'status': 'healthy',
+        'timestamp': datetime.now().isoformat(),
+        'service': '唯理书院智能助手 API',
+        'version': '1.0'
+    })
+
+async def not_found(request: Request, exc):
+    """404错误处理"""
+    return JSONResponse({
+        'success': False,
+        'error': '接口不存在',
+        'message': 'API endpoint not found'
+    }, status_code=404)
+
+async def internal_error(request: Request, exc):
+    """500错误处理"""
+    return JSONResponse({
+        'success': False,
+        'error': '服务器内部错误',
+        'message': 'Internal server error'
+    }, status_code=500)
+
+@asynccontextmanager
+async def lifespan(app):
+    """在服务器启动时初始化聊天机器人"""
+    if chatbot is None:
+        initialize_chatbot()
+    yield
+
+app = Starlette(
+    routes=[
+        Route('/', test_page),
+        Route('/api/status', get_status, methods=['GET']),
+        Route('/api/chat', chat, methods=['POST']),
+        Route('/api/chat/stream', chat_stream, methods=['POST']),
+        Route('/api/chat/batch', chat_batch, methods=['POST']),
+        Route('/api/chat/result/{response_id}', chat_result, methods=['GET']),
+        Route('/api/history', conversation_history, methods=['GET', 'DELETE']),
+        Route('/api/stats', get_stats, methods=['GET']),
+        Route('/api/update', update_knowledge, methods=['POST']),
+        Route('/api/health', health_check, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    exception_handlers={404: not_found, 500: internal_error},
+    lifespan=lifespan
+)
+
+def main():
+    """主函数"""
+    try:
+        import uvicorn
+    except ImportError:
+        print("❌ 无法启动：未安装uvicorn (pip install uvicorn)")
+        return
+    
+    print("🚀 启动唯理书院智能助手 ASGI Web API")
+    print("=" * 50)
+    
+    if not initialize_chatbot():
+        print("❌ 无法启动：聊天机器人初始化失败")
+        return
+    
+    host = os.getenv('API_HOST', '0.0.0.0')
+    port = int(os.getenv('API_PORT', 5000))
+    
+    print(f"🌐 服务器地址: http://{host}:{port}")
+    print(f"📱 测试页面: http://{host}:{port}/")
+    print("=" * 50)
+    
+    try:
+        uvicorn.run(app, host=host, port=port)
+    except KeyboardInterrupt:
+        print("\n👋 服务器已停止")
+    except Exception as e:
+        print(f"❌ 服务器启动失败: {e}")
+
+if __name__ == '__main__':
+    main()
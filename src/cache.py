@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+"""
+Caching Utilities for Summer School Chatbot
+
+This module provides a thread-safe, size-bounded LRU cache with an
+optional time-to-live, used to memoize knowledge base searches and
+chatbot responses, a variant persisted to SQLite, a SQLite store shared
+by processes, and single-flight coalescing of concurrent identical calls.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Least-recently-used cache with optional per-entry expiry.
+
+    Entries beyond max_size evict the least recently used one; entries
+    older than ttl seconds are treated as missing. Hit, miss and eviction
+    counters are kept for monitoring.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size: Maximum number of entries; 0 disables caching
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self._on_remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key, evicting the least recently used entries."""
+        if self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            self._on_store(key, value)
+            while len(self._data) > self.max_size:
+                evicted, _ = self._data.popitem(last=False)
+                self._on_remove(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Remove all entries; counters are kept."""
+        with self._lock:
+            self._data.clear()
+            self._on_clear()
+
+    # Storage hooks for subclasses, called with the lock held
+    def _on_store(self, key: Hashable, value: Any) -> None:
+        pass
+
+    def _on_remove(self, key: Hashable) -> None:
+        pass
+
+    def _on_clear(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss/eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class DiskCache(LRUCache):
+    """
+    LRU cache that writes through to a SQLite file so entries survive restarts.
+
+    The in-memory LRU serves every lookup; the file mirrors its contents
+    and is read back on start-up. Keys and values must be JSON-serializable
+    (tuple keys are accepted and stored as JSON arrays).
+    """
+
+    def __init__(self, path: str, max_size: int = 1000, ttl: Optional[float] = None):
+        """
+        Initialize the cache and load the unexpired entries saved in path.
+
+        Args:
+            path: SQLite database file, created if missing
+            max_size: Maximum number of entries
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        super().__init__(max_size, ttl)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, stored REAL NOT NULL)'
+        )
+        self._load()
+
+    def reopen(self) -> None:
+        """Open a new database connection, e.g. in a process forked after start-up."""
+        with self._lock:
+            # SQLite connections must not be used, nor closed, across fork()
+            self._inherited_db = self._db
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+
+    def _load(self) -> None:
+        """Read unexpired entries back, oldest first, up to max_size."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (now,))
+            rows = self._db.execute(
+                'SELECT key, value, expires FROM cache ORDER BY stored DESC LIMIT ?', (max(self.max_size, 0),)
+            ).fetchall()
+            self._db.execute(
+                'DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY stored DESC LIMIT ?)',
+                (max(self.max_size, 0),)
+            )
+            for key, value, expires in reversed(rows):
+                # Wall-clock expiry from the file, converted to this process's monotonic clock
+                remaining = time.monotonic() + (expires - now) if expires is not None else None
+                self._data[key] = (json.loads(value), remaining)
+        logger.info(f"Loaded {len(rows)} cached entries from {self.path}")
+
+    @staticmethod
+    def _encode(key: Hashable) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        return super().get(self._encode(key), default)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        super().set(self._encode(key), value)
+
+    def _on_store(self, key: str, value: Any) -> None:
+        now = time.time()
+        expires = now + self.ttl if self.ttl else None
+        try:
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO cache (key, value, expires, stored) VALUES (?, ?, ?, ?)',
+                    (key, json.dumps(value, ensure_ascii=False), expires, now)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Error writing cache entry to {self.path}: {e}")
+
+    def _on_remove(self, key: str) -> None:
+        try:
+            with self._db:
+                self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            logger.warning(f"Error removing cache entry from {self.path}: {e}")
+
+    def _on_clear(self) -> None:
+        with self._db:
+            self._db.execute('DELETE FROM cache')
+
+
+class SharedCache:
+    """
+    Key-value store in a SQLite file that every process reads directly.
+
+    Unlike DiskCache, nothing is served from memory, so a value stored by
+    one worker process of a server is seen by all the others. Entries
+    expire ttl seconds after they were last stored. Keys and values must
+    be JSON-serializable; several stores can share a file, one table each.
+    """
+
+    # Seconds between purges of expired rows
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self, path: str, table: str = 'shared_cache', ttl: Optional[float] = None):
+        """
+        Initialize the store.
+
+        Args:
+            path: SQLite database file, created if missing
+            table: Table holding this store's entries
+            ttl: Seconds an entry stays valid, or None for no expiry
+        """
+        if not table.isidentifier():
+            raise ValueError(f"Invalid table name: {table}")
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._db = self._connect()
+        with self._transaction() as db:
+            db.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Transactions are begun explicitly; readers do not block the writer
+        db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def reopen(self) -> None:
+        """Open a new database connection, e.g. in a process forked after start-up."""
+        with self._lock:
+            # SQLite connections must not be used, nor closed, across fork()
+            self._inherited_db = self._db
+            self._db = self._connect()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run a block as one write transaction, excluding other processes' writers."""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    @staticmethod
+    def _encode(key: Hashable) -> str:
+        return json.dumps(key, ensure_ascii=False)
+
+    def _read(self, db: sqlite3.Connection, key: str) -> Any:
+        row = db.execute(
+            f'SELECT value FROM {self.table} WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time())
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _write(self, db: sqlite3.Connection, key: str, value: Any) -> None:
+        now = time.time()
+        db.execute(
+            f'INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)',
+            (key, json.dumps(value, ensure_ascii=False), now + self.ttl if self.ttl else None)
+        )
+        if self.ttl and now >= self._next_purge:
+            self._next_purge = now + self.PURGE_INTERVAL
+            db.execute(f'DELETE FROM {self.table} WHERE expires <= ?', (now,))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the stored value for key, or default if missing or expired."""
+        with self._lock:
+            value = self._read(self._db, self._encode(key))
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store value under key."""
+        with self._transaction() as db:
+            self._write(db, self._encode(key), value)
+
+    def update(self, key: Hashable, fn: Callable[[Any], Any]) -> Any:
+        """
+        Replace the value under key by fn(value), atomically across processes.
+
+        Args:
+            key: Entry key
+            fn: Called with the current value (None if missing or expired);
+                returns the new value, or None to leave the entry unchanged
+
+        Returns:
+            The new value, or None if fn returned None
+        """
+        encoded = self._encode(key)
+        with self._transaction() as db:
+            value = fn(self._read(db, encoded))
+            if value is not None:
+                self._write(db, encoded, value)
+            return value
+
+    def delete(self, key: Hashable) -> None:
+        """Remove the entry under key, if any."""
+        with self._transaction() as db:
+            db.execute(f'DELETE FROM {self.table} WHERE key = ?', (self._encode(key),))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                f'SELECT COUNT(*) FROM {self.table} WHERE expires IS NULL OR expires > ?', (time.time(),)
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit/miss counters."""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self),
+            'path': str(self.path),
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class _Flight:
+    """A call in progress, shared by every caller with the same key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _AsyncFlight:
+    """A coroutine call in progress, run as its own task and awaited by every caller."""
+
+    def __init__(self, task: "asyncio.Task"):
+        self.task = task
+        self.waiters = 0
+        self.abandoned = False
+
+
+# Marks the end of a coalesced stream
+_END_OF_STREAM = object()
+
+
+class _StreamFlight:
+    """A streamed call in progress; its chunks are kept for every reader."""
+
+    def __init__(self, fn: Callable[[], Iterable[Any]]):
+        self.fn = fn
+        self.iterator: Optional[Iterator[Any]] = None
+        self.chunks: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.fetching = False
+        self.readers = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and receive the same result (or exception). Nothing is
+    kept once the call returns; pair with a cache to reuse results.
+    Coroutines are coalesced the same way, per event loop, by ado(), and
+    streams, chunk by chunk, by stream().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._async_flights: Dict[Hashable, _AsyncFlight] = {}
+        self._stream_flights: Dict[Hashable, _StreamFlight] = {}
+        self._stream_changed = threading.Condition(self._lock)
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn, or wait for the call already running under key.
+
+        Args:
+            key: Identity of the call
+            fn: Zero-argument function to run
+
+        Returns:
+            The result of fn
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn(), or the same call already running under key.
+
+        fn() runs as a task of its own, which every caller awaits through
+        a shield: cancelling one caller, the first included, does not
+        cancel the call for the others. The call is cancelled only once
+        every caller waiting for it has been cancelled.
+
+        Args:
+            key: Identity of the call
+            fn: Zero-argument coroutine function to run
+
+        Returns:
+            The result of fn()
+        """
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            flight = self._async_flights.get(flight_key)
+            if flight is None or flight.abandoned:
+                flight = self._async_flights[flight_key] = _AsyncFlight(loop.create_task(fn()))
+                flight.task.add_done_callback(lambda _: self._end_async_flight(flight_key, flight))
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                flight.abandoned = flight.waiters == 0 and not flight.task.done()
+            if flight.abandoned:
+                # Nobody is left to use the result
+                flight.task.cancel()
+
+    def _end_async_flight(self, flight_key: Hashable, flight: _AsyncFlight) -> None:
+        with self._lock:
+            if self._async_flights.get(flight_key) is flight:
+                del self._async_flights[flight_key]
+        if not flight.task.cancelled():
+            flight.task.exception()  # Retrieved here; waiters re-raise it
+
+    def stream(self, key: Hashable, fn: Callable[[], Iterable[Any]]) -> Iterator[Any]:
+        """
+        Iterate fn(), or the same stream already running under key.
+
+        Every chunk is kept for the stream's readers, so a caller arriving
+        late first receives the chunks produced so far. Whichever reader
+        needs the next chunk fetches it, so the stream goes on while anyone
+        reads it; it is closed once every reader has stopped.
+
+        Args:
+            key: Identity of the call
+            fn: Zero-argument function returning the chunks
+
+        Yields:
+            The chunks of fn(); an exception it raises is raised to every
+            reader after the chunks before it
+        """
+        with self._lock:
+            flight = self._stream_flights.get(key)
+            if flight is None:
+                flight = self._stream_flights[key] = _StreamFlight(fn)
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            flight.readers += 1
+
+        position = 0
+        try:
+            while True:
+                with self._stream_changed:
+                    while position >= len(flight.chunks) and not flight.done and flight.fetching:
+                        self._stream_changed.wait()
+                    if position < len(flight.chunks):
+                        chunk = flight.chunks[position]
+                    elif flight.done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    else:
+                        flight.fetching = True
+                        chunk = _END_OF_STREAM
+                if chunk is _END_OF_STREAM:
+                    chunk = self._fetch(key, flight)
+                    if chunk is _END_OF_STREAM:
+                        continue
+                position += 1
+                yield chunk
+        finally:
+            with self._lock:
+                flight.readers -= 1
+                abandoned = flight.readers == 0 and not flight.done
+                if abandoned:
+                    flight.done = True
+                    if self._stream_flights.get(key) is flight:
+                        del self._stream_flights[key]
+            if abandoned and hasattr(flight.iterator, 'close'):
+                # Nobody is left to read the rest
+                flight.iterator.close()
+
+    def _fetch(self, key: Hashable, flight: _StreamFlight) -> Any:
+        """Fetch a stream's next chunk for its readers, or _END_OF_STREAM once it has ended."""
+        chunk = _END_OF_STREAM
+        try:
+            if flight.iterator is None:
+                flight.iterator = iter(flight.fn())
+            chunk = next(flight.iterator)
+        except StopIteration:
+            pass
+        except BaseException as e:
+            flight.error = e
+        with self._stream_changed:
+            flight.fetching = False
+            if chunk is _END_OF_STREAM:
+                flight.done = True
+                if self._stream_flights.get(key) is flight:
+                    del self._stream_flights[key]
+            else:
+                flight.chunks.append(chunk)
+            self._stream_changed.notify_all()
+        return chunk
+
+    def stats(self) -> Dict[str, int]:
+        """Return the number of calls run and of calls coalesced into them."""
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._flights) + len(self._async_flights) + len(self._stream_flights)
+        }
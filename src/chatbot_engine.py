@@ -7,27 +7,41 @@ LLM responses with knowledge base and Google Drive information.
 """
 
 import os
+import asyncio
+import functools
+import hashlib
 import logging
 import json
-from typing import Dict, List, Optional, Any
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterator, List, Optional, Any, Tuple
 from pathlib import Path
 import sys
 
 # Add the parent directory to the path to import tools
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
+from cache import DiskCache, LRUCache, SharedCache, SingleFlight
+from context_builder import ContextBuilder, estimate_tokens
 from drive_connector import GoogleDriveConnector
 from knowledge_base import KnowledgeBase
+from llm_client import ClientPool, LLMClient, provider_supported
+from llm_router import ProviderRouter
+from session_store import SessionStore, SharedSessionStore
 
-# Import LLM tools from existing tools directory
+# Providers without an SDK client in llm_client go through the tools directory
 try:
     from tools.llm_api import query_llm
 except ImportError:
-    print("Warning: LLM API tools not available. Install dependencies first.")
     query_llm = None
 
 logger = logging.getLogger(__name__)
 
+# Seconds between checks of a background answer refined by another process
+REFINED_POLL_INTERVAL = 0.1
+
 class SummerSchoolChatbot:
     """Main chatbot class that integrates all components."""
     
@@ -35,7 +49,8 @@ class SummerSchoolChatbot:
                  llm_provider: str = None,
                  knowledge_base_path: str = None,
                  drive_credentials: str = None,
-                 drive_folder_id: str = None):
+                 drive_folder_id: str = None,
+                 llm_router: Optional[ProviderRouter] = None):
         """
         Initialize the summer school chatbot.
         
@@ -44,12 +59,100 @@ class SummerSchoolChatbot:
             knowledge_base_path: Path to knowledge base data
             drive_credentials: Path to Google Drive credentials
             drive_folder_id: Google Drive folder ID
+            llm_router: Router over LLM providers; by default built from
+                LLM_PROVIDERS (or the single llm_provider) using llm_client
         """
         self.llm_provider = llm_provider or os.getenv('DEFAULT_LLM_PROVIDER', 'openai')
         kb_path = knowledge_base_path or os.getenv('KNOWLEDGE_BASE_PATH', 'data/knowledge_base.json')
-        self.knowledge_base = KnowledgeBase(kb_path)
+        self.knowledge_base = KnowledgeBase(
+            kb_path,
+            semantic_mappings_path=os.getenv('SEMANTIC_MAPPINGS_PATH'),
+            ranking_mode=os.getenv('SEARCH_RANKING_MODE'),
+            cache_size=int(os.getenv('SEARCH_CACHE_SIZE', '256')),
+            cache_ttl=float(os.getenv('CACHE_DURATION', '3600')),
+            # Picks up updates saved by other worker processes
+            reload_interval=float(os.getenv('KB_RELOAD_INTERVAL', '5'))
+        )
         self.drive_connector = None
-        self.conversation_history = []
+        
+        # SHARED_STATE_PATH keeps conversations and background answers in a
+        # SQLite file shared by all worker processes of a server
+        shared_state_path = os.getenv('SHARED_STATE_PATH')
+        
+        # Conversation history per session, bounded in length, age and memory
+        if shared_state_path:
+            self.sessions = SharedSessionStore(
+                shared_state_path,
+                max_messages=int(os.getenv('HISTORY_MAX_MESSAGES', '50')),
+                ttl=float(os.getenv('HISTORY_SESSION_TTL', '86400'))
+            )
+        else:
+            self.sessions = SessionStore(
+                max_messages=int(os.getenv('HISTORY_MAX_MESSAGES', '50')),
+                ttl=float(os.getenv('HISTORY_SESSION_TTL', '86400')),
+                max_bytes=int(os.getenv('HISTORY_MAX_BYTES', str(16 * 1024 * 1024))),
+                spill_path=os.getenv('HISTORY_SPILL_PATH')
+            )
+        
+        # Minimum cosine similarity for answering from dense retrieval when
+        # keyword search finds nothing confident; unset disables the fallback
+        dense_threshold = os.getenv('DENSE_MATCH_THRESHOLD')
+        self.dense_match_threshold = float(dense_threshold) if dense_threshold else None
+        
+        # Response cache for repeat questions; RESPONSE_CACHE_PATH keeps it on disk
+        self.response_cache = None
+        if os.getenv('CACHE_RESPONSES', 'true').lower() == 'true':
+            cache_size = int(os.getenv('RESPONSE_CACHE_SIZE', '1000'))
+            cache_ttl = float(os.getenv('CACHE_DURATION', '3600'))
+            cache_path = os.getenv('RESPONSE_CACHE_PATH')
+            if cache_path:
+                try:
+                    self.response_cache = DiskCache(cache_path, max_size=cache_size, ttl=cache_ttl)
+                except Exception as e:
+                    logger.warning(f"Failed to open response cache at {cache_path}: {e}")
+            if self.response_cache is None:
+                self.response_cache = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        
+        # One long-lived client per provider keeps HTTP connections alive
+        self.llm_clients = ClientPool(LLMClient, timeout=float(os.getenv('LLM_TIMEOUT', '30')))
+        
+        # LLM requests go to the fastest provider, hedged to the next one
+        self.llm_router = llm_router or self._create_llm_router()
+        
+        # Concurrent requests with an identical prompt share one LLM call
+        self.llm_flights = SingleFlight()
+        
+        # ask_many() asks the LLM about this many questions of a batch at a time
+        self.batch_max_workers = int(os.getenv('BATCH_MAX_WORKERS', '8'))
+        
+        # ask_fast() computes LLM answers in the background, kept by response id:
+        # at most refine_max_pending queued or running, whose futures move
+        # to the refinements cache when done
+        self.refine_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('LLM_REFINE_WORKERS', '8')), thread_name_prefix='refine'
+        )
+        self.refine_max_pending = int(os.getenv('REFINE_MAX_PENDING', '100'))
+        self._refine_slots = threading.Semaphore(self.refine_max_pending)
+        self.pending_refinements: Dict[str, Future] = {}
+        self.refinements_declined = 0
+        self._refine_lock = threading.Lock()
+        self.refinements = LRUCache(
+            max_size=int(os.getenv('REFINE_MAX_RESULTS', '1000')),
+            ttl=float(os.getenv('REFINE_RESULT_TTL', '600'))
+        )
+        # Their status, for requests served by other worker processes
+        self.shared_refinements = None
+        if shared_state_path:
+            self.shared_refinements = SharedCache(
+                shared_state_path, table='refinements', ttl=float(os.getenv('REFINE_RESULT_TTL', '600'))
+            )
+        
+        # Knowledge base context of LLM prompts is capped at a token budget
+        self.context_builder = ContextBuilder(
+            token_budget=int(os.getenv('LLM_CONTEXT_TOKEN_BUDGET', '1500'))
+        )
+        self._prompt_stats = {'requests': 0, 'prompt_tokens': 0, 'context_tokens': 0, 'utilisation': 0.0}
+        self._prompt_stats_lock = threading.Lock()
         
         # Initialize Google Drive connector if credentials are available
         if drive_credentials or os.getenv('GOOGLE_DRIVE_CREDENTIALS_FILE'):
@@ -84,55 +187,497 @@ class SummerSchoolChatbot:
                 "抱歉，我还不太确定这个问题。你可以换个方式问问吗？",
                 "我暂时没有这方面的信息。你可以询问关于课程安排、地点或住宿等问题。",
                 "我还在学习这个话题。有其他我可以帮助你的吗？"
+            ],
+            'pending': [
+                "正在为你查找更详细的答案，请稍候……"
             ]
         }
     
-    def ask(self, question: str, use_llm: bool = True) -> str:
+    def ask(self, question: str, use_llm: bool = True, session_id: Optional[str] = None) -> str:
         """
         处理用户问题并返回响应。
         
         Args:
             question: 用户问题
             use_llm: 是否使用LLM生成响应
+            session_id: 会话ID，用于区分不同用户的对话记录
             
         Returns:
             生成的响应
         """
         # Add to conversation history
-        self.conversation_history.append({
-            'role': 'user',
-            'content': question,
-            'timestamp': self._get_timestamp()
-        })
+        self._add_to_history(session_id, 'user', question)
         
         # Check for greetings and farewells
         if self._is_greeting(question):
             response = self._get_random_response('greeting')
         elif self._is_farewell(question):
             response = self._get_random_response('farewell')
+        elif self.response_cache is not None:
+            cache_key = self._response_cache_key(question, use_llm)
+            response = self.response_cache.get(cache_key)
+            if response is None:
+                response = self._answer(question, use_llm)
+                # Canned fallbacks are randomized and may hide a transient LLM failure
+                if not self._is_default_response(response):
+                    self.response_cache.set(cache_key, response)
         else:
-            # Search knowledge base
-            kb_results = self.knowledge_base.search(question, max_results=3)
+            response = self._answer(question, use_llm)
+        
+        # Add response to conversation history
+        self._add_to_history(session_id, 'assistant', response)
+        
+        return response
+    
+    def _answer(self, question: str, use_llm: bool) -> str:
+        """Answer a question from the knowledge base, falling back to the LLM."""
+        kb_results, kb_confident = self._retrieve(question)
+        
+        if kb_confident:
+            # Use knowledge base result
+            response = self._format_kb_response(kb_results[0])
+        elif self._llm_available(use_llm):
+            # Try LLM response with context
+            response = self._generate_llm_response(question, kb_results)
+        else:
+            # Default fallback
+            response = self._get_random_response('unknown')
+        
+        return response
+    
+    def ask_fast(self, question: str, use_llm: bool = True,
+                 session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        处理用户问题并立即返回响应，LLM回答在后台生成。
+        
+        Answers that need no LLM are returned as ask() would. When the LLM
+        is needed, the best knowledge base candidate (or a holding answer)
+        is returned at once with a response_id, and the LLM answer is
+        computed in the background; fetch it with get_refined_response().
+        While refine_max_pending answers are being computed, the fast
+        answer is final and has no response_id.
+        
+        Args:
+            question: 用户问题
+            use_llm: 是否使用LLM生成响应
+            session_id: 会话ID，用于区分不同用户的对话记录
             
-            if kb_results and kb_results[0]['score'] > 0.5:
-                # Use knowledge base result
+        Returns:
+            Dict with the 'response', its 'response_id' (None when the
+            response is final) and whether it is 'refining'
+        """
+        self._add_to_history(session_id, 'user', question)
+        
+        cache_key = self._response_cache_key(question, use_llm)
+        response = None
+        if self._is_greeting(question):
+            response = self._get_random_response('greeting')
+        elif self._is_farewell(question):
+            response = self._get_random_response('farewell')
+        elif self.response_cache is not None:
+            response = self.response_cache.get(cache_key)
+        
+        if response is None:
+            kb_results, kb_confident = self._retrieve(question)
+            if kb_confident:
                 response = self._format_kb_response(kb_results[0])
-            elif use_llm and query_llm:
-                # Try LLM response with context
-                response = self._generate_llm_response(question, kb_results)
-            else:
-                # Default fallback
+                if self.response_cache is not None:
+                    self.response_cache.set(cache_key, response)
+            elif not self._llm_available(use_llm):
                 response = self._get_random_response('unknown')
         
-        # Add response to conversation history
-        self.conversation_history.append({
-            'role': 'assistant',
-            'content': response,
-            'timestamp': self._get_timestamp()
-        })
+        if response is not None:
+            self._add_to_history(session_id, 'assistant', response)
+            return {'response': response, 'response_id': None, 'refining': False}
+        
+        # Answer now with the best candidate; the LLM answer follows
+        if kb_results:
+            response = self._format_kb_response(kb_results[0])
+        else:
+            response = self._get_random_response('pending')
+        if not self._refine_slots.acquire(blocking=False):
+            # Too many answers being refined: the fast answer is final
+            with self._refine_lock:
+                self.refinements_declined += 1
+            logger.warning("Too many pending refinements; returning the fast answer only")
+            self._add_to_history(session_id, 'assistant', response)
+            return {'response': response, 'response_id': None, 'refining': False}
+        
+        response_id = uuid.uuid4().hex
+        # Added first, so that _refine() finds the entry to replace
+        self._add_to_history(session_id, 'assistant', response, response_id=response_id)
+        if self.shared_refinements is not None:
+            self.shared_refinements.set(response_id, {'status': 'pending', 'response': None})
+        try:
+            future = self.refine_executor.submit(self._refine, question, kb_results, cache_key, session_id,
+                                                 response_id, response)
+        except BaseException:
+            self._refine_slots.release()
+            raise
+        with self._refine_lock:
+            self.pending_refinements[response_id] = future
+        future.add_done_callback(functools.partial(self._refinement_done, response_id))
+        
+        return {'response': response, 'response_id': response_id, 'refining': True}
+    
+    def _refinement_done(self, response_id: str, future: Future) -> None:
+        """Move a finished refinement from the pending ones to the refinements cache."""
+        # Cached before it leaves pending_refinements, so lookups always find it
+        self.refinements.set(response_id, future)
+        with self._refine_lock:
+            self.pending_refinements.pop(response_id, None)
+        self._refine_slots.release()
+    
+    def _refine(self, question: str, kb_results: List[Dict[str, Any]], cache_key: Tuple,
+                session_id: Optional[str], response_id: str, fast_response: str) -> str:
+        """
+        Background LLM answer of ask_fast().
+        
+        The LLM answer replaces the fast answer in the conversation history;
+        when the LLM fails, the fast answer stands.
+        """
+        response = self._query_llm(question, kb_results)
+        if response is None:
+            response = fast_response
+        else:
+            if self.response_cache is not None:
+                self.response_cache.set(cache_key, response)
+            if session_id:
+                self.sessions.replace(session_id, response_id, {
+                    'role': 'assistant',
+                    'content': response,
+                    'timestamp': self._get_timestamp(),
+                    'response_id': response_id
+                })
+        if self.shared_refinements is not None:
+            self.shared_refinements.set(response_id, {'status': 'done', 'response': response})
+        return response
+    
+    def get_refined_response(self, response_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Get the background LLM answer of an ask_fast() response.
+        
+        Args:
+            response_id: Response id returned by ask_fast()
+            wait: Seconds to wait for the answer if it is not ready yet
+            
+        Returns:
+            Dict with the 'status' ('pending' or 'done') and the 'response'
+            once done (the ask_fast() response if the LLM failed), or None
+            for an unknown or expired response id
+        """
+        future = self._get_refinement(response_id)
+        if future is None:
+            return self._get_shared_refined_response(response_id, wait)
+        try:
+            response = future.result(timeout=wait)
+        except FutureTimeoutError:
+            return {'response_id': response_id, 'status': 'pending', 'response': None}
+        return {'response_id': response_id, 'status': 'done', 'response': response}
+    
+    def _get_refinement(self, response_id: str) -> Optional[Future]:
+        """The future of a refinement started by this process, pending or done."""
+        with self._refine_lock:
+            future = self.pending_refinements.get(response_id)
+        return future if future is not None else self.refinements.get(response_id)
+    
+    def _get_shared_refined_response(self, response_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """get_refined_response() of an answer refined by another worker process."""
+        if self.shared_refinements is None:
+            return None
+        deadline = time.monotonic() + wait
+        while True:
+            result = self.shared_refinements.get(response_id)
+            if result is None:
+                return None
+            if result['status'] == 'done' or time.monotonic() >= deadline:
+                return {'response_id': response_id, **result}
+            time.sleep(REFINED_POLL_INTERVAL)
+    
+    async def aget_refined_response(self, response_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Asynchronous version of get_refined_response(); waiting holds no thread."""
+        future = self._get_refinement(response_id)
+        if future is None:
+            return await self._aget_shared_refined_response(response_id, wait)
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+        return self.get_refined_response(response_id)
+    
+    async def _aget_shared_refined_response(self, response_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """Asynchronous version of _get_shared_refined_response()."""
+        if self.shared_refinements is None:
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + wait
+        while True:
+            result = await loop.run_in_executor(None, self.shared_refinements.get, response_id)
+            if result is None:
+                return None
+            if result['status'] == 'done' or time.monotonic() >= deadline:
+                return {'response_id': response_id, **result}
+            await asyncio.sleep(REFINED_POLL_INTERVAL)
+    
+    async def aask(self, question: str, use_llm: bool = True,
+                   session_id: Optional[str] = None) -> str:
+        """
+        处理用户问题并返回响应（异步版本）。
+        
+        Knowledge base search runs in the event loop's default executor and
+        the LLM is awaited through the providers' async SDK clients, so a
+        slow LLM call does not hold a thread for its whole duration. The
+        response cache and the conversation history, which may be SQLite
+        files, are read and written in worker threads too.
+        
+        Args:
+            question: 用户问题
+            use_llm: 是否使用LLM生成响应
+            session_id: 会话ID，用于区分不同用户的对话记录
+            
+        Returns:
+            生成的响应
+        """
+        await asyncio.to_thread(self._add_to_history, session_id, 'user', question)
+        
+        if self._is_greeting(question):
+            response = self._get_random_response('greeting')
+        elif self._is_farewell(question):
+            response = self._get_random_response('farewell')
+        elif self.response_cache is not None:
+            cache_key = self._response_cache_key(question, use_llm)
+            response = await asyncio.to_thread(self.response_cache.get, cache_key)
+            if response is None:
+                response = await self._aanswer(question, use_llm)
+                if not self._is_default_response(response):
+                    await asyncio.to_thread(self.response_cache.set, cache_key, response)
+        else:
+            response = await self._aanswer(question, use_llm)
+        
+        await asyncio.to_thread(self._add_to_history, session_id, 'assistant', response)
         
         return response
     
+    async def _aanswer(self, question: str, use_llm: bool) -> str:
+        """Asynchronous version of _answer()."""
+        loop = asyncio.get_running_loop()
+        kb_results, kb_confident = await loop.run_in_executor(None, self._retrieve, question)
+        
+        if kb_confident:
+            response = self._format_kb_response(kb_results[0])
+        elif self._llm_available(use_llm):
+            response = await self._agenerate_llm_response(question, kb_results)
+        else:
+            response = self._get_random_response('unknown')
+        
+        return response
+    
+    def _llm_available(self, use_llm: bool) -> bool:
+        """Check whether an LLM answer should be tried; not while every provider's circuit is open."""
+        return bool(use_llm and self.llm_router and self.llm_router.available())
+    
+    def _retrieve(self, question: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Search the knowledge base for a question.
+        
+        Returns:
+            The results and whether the best one is confident enough to
+            answer from directly
+        """
+        return self._check_confidence(question, self.knowledge_base.search(question, max_results=3))
+    
+    def _retrieve_many(self, questions: List[str]) -> List[Tuple[List[Dict[str, Any]], bool]]:
+        """Batch version of _retrieve(), in input order."""
+        return [
+            self._check_confidence(question, kb_results)
+            for question, kb_results in zip(questions, self.knowledge_base.search_many(questions, max_results=3))
+        ]
+    
+    def _check_confidence(self, question: str,
+                          kb_results: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Decide whether search results answer a question, trying dense retrieval if not."""
+        kb_confident = bool(kb_results) and kb_results[0]['score'] > 0.5
+        
+        if not kb_confident and self.dense_match_threshold is not None:
+            # Paraphrased questions may share no keywords with the answer
+            dense_results = self._search_dense(question)
+            if dense_results and dense_results[0]['score'] >= self.dense_match_threshold:
+                kb_results, kb_confident = dense_results, True
+        
+        return kb_results, kb_confident
+    
+    def ask_many(self, questions: List[str], use_llm: bool = True,
+                 session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        批量处理用户问题。
+        
+        Identical questions (ignoring case and outer whitespace) are
+        answered once. Knowledge base search runs for all questions
+        together, then the questions it cannot answer go to the LLM
+        concurrently, at most BATCH_MAX_WORKERS at a time.
+        
+        Args:
+            questions: 用户问题列表
+            use_llm: 是否使用LLM生成响应
+            session_id: 会话ID；提供时问答按顺序记入该会话的对话记录
+            
+        Returns:
+            One dict per question, in input order, with the 'question', its
+            'response' and 'latency_ms' from the start of the batch until
+            the response was ready
+        """
+        started = time.monotonic()
+        answers: Dict[str, Tuple[str, float]] = {}
+        
+        def done(key: str, response: str) -> None:
+            answers[key] = (response, (time.monotonic() - started) * 1000)
+        
+        # Greetings, farewells and cached answers need no search
+        unique: Dict[str, str] = {}
+        for question in questions:
+            key = question.strip().lower()
+            if key in unique or key in answers:
+                continue
+            if self._is_greeting(question):
+                done(key, self._get_random_response('greeting'))
+            elif self._is_farewell(question):
+                done(key, self._get_random_response('farewell'))
+            else:
+                cached = None
+                if self.response_cache is not None:
+                    cached = self.response_cache.get(self._response_cache_key(question, use_llm))
+                if cached is not None:
+                    done(key, cached)
+                else:
+                    unique[key] = question
+        
+        pending = list(unique.items())
+        retrieved = self._retrieve_many([question for _, question in pending])
+        needs_llm = []
+        for (key, question), (kb_results, kb_confident) in zip(pending, retrieved):
+            if kb_confident:
+                done(key, self._format_kb_response(kb_results[0]))
+            elif self._llm_available(use_llm):
+                needs_llm.append((key, question, kb_results))
+            else:
+                done(key, self._get_random_response('unknown'))
+        
+        if needs_llm:
+            workers = min(self.batch_max_workers, len(needs_llm))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch') as executor:
+                futures = {
+                    executor.submit(self._generate_llm_response, question, kb_results): key
+                    for key, question, kb_results in needs_llm
+                }
+                for future in as_completed(futures):
+                    done(futures[future], future.result())
+        
+        if self.response_cache is not None:
+            for key, question in pending:
+                response = answers[key][0]
+                if not self._is_default_response(response):
+                    self.response_cache.set(self._response_cache_key(question, use_llm), response)
+        
+        results = []
+        for question in questions:
+            response, latency_ms = answers[question.strip().lower()]
+            if session_id:
+                self._add_to_history(session_id, 'user', question)
+                self._add_to_history(session_id, 'assistant', response)
+            results.append({'question': question, 'response': response, 'latency_ms': round(latency_ms, 1)})
+        
+        return results
+    
+    def ask_stream(self, question: str, use_llm: bool = True,
+                   session_id: Optional[str] = None) -> Iterator[str]:
+        """
+        处理用户问题并逐段返回响应。
+        
+        LLM answers are yielded as the provider produces them; answers from
+        the knowledge base or the cache, and greetings, arrive in one chunk.
+        
+        Args:
+            question: 用户问题
+            use_llm: 是否使用LLM生成响应
+            session_id: 会话ID，用于区分不同用户的对话记录
+            
+        Yields:
+            响应片段，拼接后即完整响应
+        """
+        self._add_to_history(session_id, 'user', question)
+        
+        chunks = []
+        try:
+            for chunk in self._answer_stream(question, use_llm):
+                chunks.append(chunk)
+                yield chunk
+        finally:
+            # Also runs when the client disconnects mid-answer
+            self._add_to_history(session_id, 'assistant', ''.join(chunks))
+    
+    def _answer_stream(self, question: str, use_llm: bool) -> Iterator[str]:
+        """Streaming counterpart of the answer logic in ask()."""
+        if self._is_greeting(question):
+            yield self._get_random_response('greeting')
+            return
+        if self._is_farewell(question):
+            yield self._get_random_response('farewell')
+            return
+        
+        cache_key = self._response_cache_key(question, use_llm)
+        if self.response_cache is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        kb_results, kb_confident = self._retrieve(question)
+        if kb_confident:
+            response = self._format_kb_response(kb_results[0])
+            yield response
+        elif self._llm_available(use_llm):
+            chunks = []
+            for chunk in self._stream_llm_response(question, kb_results):
+                chunks.append(chunk)
+                yield chunk
+            response = ''.join(chunks)
+        else:
+            response = self._get_random_response('unknown')
+            yield response
+        
+        # Only reached when the whole answer was consumed
+        if self.response_cache is not None and not self._is_default_response(response):
+            self.response_cache.set(cache_key, response)
+    
+    def _response_cache_key(self, question: str, use_llm: bool) -> Tuple:
+        """
+        Build the response cache key for a question.
+        
+        The knowledge base version changes with every update in this
+        process; its last-updated stamp tells apart knowledge bases after a
+        restart, when a disk-backed cache is reloaded.
+        """
+        kb = self.knowledge_base
+        return (
+            question.strip().lower(),
+            use_llm,
+            kb.version,
+            kb.last_updated
+        )
+    
+    def _is_default_response(self, response: str) -> bool:
+        """Check whether a response is one of the canned default responses."""
+        return any(response in responses for responses in self.default_responses.values())
+    
+    def _search_dense(self, question: str) -> List[Dict[str, Any]]:
+        """Search the knowledge base by embedding similarity."""
+        try:
+            return self.knowledge_base.search(question, max_results=3, mode='dense')
+        except ImportError as e:
+            logger.warning(f"Dense retrieval unavailable: {e}")
+            self.dense_match_threshold = None
+            return []
+    
     def _is_greeting(self, text: str) -> bool:
         """检查文本是否为问候语。"""
         greetings = [
@@ -170,18 +715,27 @@ class SummerSchoolChatbot:
     
     def _generate_llm_response(self, question: str, kb_results: List[Dict[str, Any]]) -> str:
         """Generate response using LLM with context from knowledge base."""
+        return self._query_llm(question, kb_results) or self._get_random_response('unknown')
+    
+    def _query_llm(self, question: str, kb_results: List[Dict[str, Any]]) -> Optional[str]:
+        """Get the LLM answer to a question, or None when the LLM fails."""
         try:
-            # Build context from knowledge base results
-            context = self._build_context(kb_results)
-            
-            # Create prompt for LLM
-            prompt = self._create_llm_prompt(question, context)
+            # Build the prompt with context from knowledge base results
+            prompt = self._prepare_prompt(question, kb_results)
             
-            # Query LLM
-            response = query_llm(
-                prompt=prompt,
-                provider=self.llm_provider
-            )
+            # Query LLM, joining an identical request already in flight
+            response = self.llm_flights.do(self._prompt_key(prompt), lambda: self.llm_router.query(prompt))
+            return response or None
+                
+        except Exception as e:
+            logger.error(f"Error generating LLM response: {e}")
+            return None
+    
+    async def _agenerate_llm_response(self, question: str, kb_results: List[Dict[str, Any]]) -> str:
+        """Asynchronous version of _generate_llm_response()."""
+        try:
+            prompt = self._prepare_prompt(question, kb_results)
+            response = await self.llm_flights.ado(self._prompt_key(prompt), lambda: self.llm_router.aquery(prompt))
             
             if response:
                 return response
@@ -192,23 +746,99 @@ class SummerSchoolChatbot:
             logger.error(f"Error generating LLM response: {e}")
             return self._get_random_response('unknown')
     
-    def _build_context(self, kb_results: List[Dict[str, Any]]) -> str:
-        """Build context string from knowledge base results."""
-        if not kb_results:
-            return "No specific information found in the knowledge base."
+    def _create_llm_router(self) -> Optional[ProviderRouter]:
+        """Build the provider router from the environment, if any provider can be called."""
+        names = [name.strip() for name in os.getenv('LLM_PROVIDERS', '').split(',') if name.strip()]
+        if not names:
+            names = [self.llm_provider]
+        # Providers without an installed SDK fall back to tools.llm_api, blocking
+        names = [name for name in names if provider_supported(name) or query_llm]
+        if not names:
+            logger.warning("No LLM provider available. Install the provider SDKs first.")
+            return None
+        providers = {name: functools.partial(self._query_provider, name) for name in names}
+        async_providers = {name: functools.partial(self._aquery_provider, name)
+                           for name in names if provider_supported(name)}
+        stream_providers = {name: functools.partial(self._stream_provider, name)
+                            for name in names if provider_supported(name)}
+        
+        return ProviderRouter(
+            providers,
+            async_providers=async_providers,
+            stream_providers=stream_providers,
+            timeout=float(os.getenv('LLM_TIMEOUT', '30')),
+            min_hedge_delay=float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.5')),
+            failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', '5')),
+            reset_timeout=float(os.getenv('LLM_BREAKER_RESET', '30')),
+            on_open=self._on_provider_down
+        )
+    
+    def _query_provider(self, provider: str, prompt: str, timeout: Optional[float] = None) -> Optional[str]:
+        if provider_supported(provider):
+            return self.llm_clients.get(provider).complete(prompt, timeout=timeout)
+        # query_llm takes no timeout; the router stops waiting at the deadline
+        return query_llm(prompt=prompt, provider=provider)
+    
+    async def _aquery_provider(self, provider: str, prompt: str, timeout: Optional[float] = None) -> Optional[str]:
+        return await self.llm_clients.get(provider).acomplete(prompt, timeout=timeout)
+    
+    def _stream_provider(self, provider: str, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        return self.llm_clients.get(provider).stream(prompt, timeout=timeout)
+    
+    def _on_provider_down(self, provider: str) -> None:
+        """Called when a provider's circuit opens."""
+        logger.warning(f"LLM provider {provider} is failing; circuit opened")
+        # Its connections may be broken; the trial request starts afresh
+        self.llm_clients.reset(provider)
+    
+    def _prompt_key(self, prompt: str) -> str:
+        """Identify an LLM request by its prompt."""
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    
+    def _stream_llm_response(self, question: str, kb_results: List[Dict[str, Any]]) -> Iterator[str]:
+        """Stream an LLM response with context from knowledge base."""
+        prompt = self._prepare_prompt(question, kb_results)
         
-        context_parts = []
-        for result in kb_results:
-            if result['type'] == 'faq':
-                context_parts.append(f"FAQ: {result['question']} - {result['answer']}")
-            elif result['type'] == 'location':
-                context_parts.append(f"Location: {result['name']} at {result['address']}")
-            elif result['type'] == 'schedule':
-                context_parts.append(f"Schedule: {result['name']} on {result['date']} at {result['time']}")
-            elif result['type'] == 'document':
-                context_parts.append(f"Document '{result['name']}': {result['content']}")
+        # Readers of an identical prompt share one stream through the router
+        chunks = self.llm_flights.stream(self._prompt_key(prompt), lambda: self.llm_router.stream(prompt))
+        produced = False
+        try:
+            for chunk in chunks:
+                if chunk:
+                    produced = True
+                    yield chunk
+        except Exception as e:
+            # A partial answer cannot be taken back; let the caller report it
+            if produced:
+                raise
+            logger.error(f"Error streaming LLM response: {e}")
+        finally:
+            # Also stops reading when the client disconnects mid-answer
+            chunks.close()
         
-        return "\n".join(context_parts)
+        if not produced:
+            yield self._get_random_response('unknown')
+    
+    def _prepare_prompt(self, question: str, kb_results: List[Dict[str, Any]]) -> str:
+        """Create the LLM prompt for a question and record its size."""
+        report = self.context_builder.build(question, kb_results)
+        context = report.text or "No specific information found in the knowledge base."
+        prompt = self._create_llm_prompt(question, context)
+        prompt_tokens = estimate_tokens(prompt)
+        
+        logger.info(
+            f"LLM prompt: ~{prompt_tokens} tokens, context ~{report.tokens}/{report.budget} tokens "
+            f"({report.utilisation:.0%}), {report.pieces_used}/{report.pieces_total} passages, "
+            f"{report.duplicates} duplicates dropped"
+        )
+        with self._prompt_stats_lock:
+            stats = self._prompt_stats
+            stats['requests'] += 1
+            stats['prompt_tokens'] += prompt_tokens
+            stats['context_tokens'] += report.tokens
+            stats['utilisation'] += report.utilisation
+        
+        return prompt
     
     def _create_llm_prompt(self, question: str, context: str) -> str:
         """Create a prompt for the LLM."""
@@ -268,22 +898,92 @@ Response:"""
         """Add schedule information to the knowledge base."""
         self.knowledge_base.add_schedule(event_name, date, time, details)
     
-    def get_conversation_history(self) -> List[Dict[str, Any]]:
-        """Get the conversation history."""
-        return self.conversation_history
+    def _add_to_history(self, session_id: Optional[str], role: str, content: str,
+                        response_id: Optional[str] = None) -> None:
+        """
+        Append a message to a session's conversation history.
+        
+        Requests without a session id keep no history: a shared fallback
+        session would hand one client's conversation to every other.
+        """
+        if not session_id:
+            return
+        message = {
+            'role': role,
+            'content': content,
+            'timestamp': self._get_timestamp()
+        }
+        if response_id:
+            # Lets a refined answer replace this one
+            message['response_id'] = response_id
+        self.sessions.append(session_id, message)
+    
+    def get_conversation_history(self, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get the conversation history of a session."""
+        if not session_id:
+            return []
+        return self.sessions.get(session_id)
     
-    def clear_conversation_history(self) -> None:
-        """Clear the conversation history."""
-        self.conversation_history = []
+    def warm_up(self) -> None:
+        """Build the search indexes that are otherwise built on first use."""
+        modes = [self.knowledge_base.ranking_mode]
+        if self.dense_match_threshold is not None:
+            modes.append('dense')
+        try:
+            self.knowledge_base.warm_up(modes)
+        except ImportError as e:
+            logger.warning(f"Could not build search indexes ahead of time: {e}")
+    
+    def after_fork(self) -> None:
+        """Prepare a chatbot created before fork() for use in the child process."""
+        if isinstance(self.response_cache, DiskCache):
+            self.response_cache.reopen()
+        self.sessions.reopen()
+        if self.shared_refinements is not None:
+            self.shared_refinements.reopen()
+        # The parent loaded the knowledge base when it started; a graceful
+        # restart forks again from that copy, so take the file's latest
+        self.knowledge_base.reload()
+    
+    def clear_conversation_history(self, session_id: Optional[str] = None) -> None:
+        """Clear the conversation history of a session."""
+        if session_id:
+            self.sessions.clear(session_id)
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get chatbot statistics."""
         kb_stats = self.knowledge_base.get_statistics()
         return {
             'knowledge_base': kb_stats,
-            'conversation_history_length': len(self.conversation_history),
+            'sessions': self.sessions.stats(),
             'llm_provider': self.llm_provider,
-            'drive_connected': self.drive_connector is not None
+            'drive_connected': self.drive_connector is not None,
+            'response_cache': self.response_cache.stats() if self.response_cache is not None else None,
+            'llm_requests': self.llm_flights.stats(),
+            'llm_router': self.llm_router.stats() if self.llm_router else None,
+            'llm_available': bool(self.llm_router and self.llm_router.available()),
+            'llm_clients': self.llm_clients.stats(),
+            'llm_prompts': self._get_prompt_statistics(),
+            'refinements': {
+                **self.refinements.stats(),
+                'pending': len(self.pending_refinements),
+                'max_pending': self.refine_max_pending,
+                'declined': self.refinements_declined
+            },
+            'shared_refinements': self.shared_refinements.stats() if self.shared_refinements is not None else None
+        }
+    
+    def _get_prompt_statistics(self) -> Dict[str, Any]:
+        """Average prompt size and context budget utilisation."""
+        with self._prompt_stats_lock:
+            stats = dict(self._prompt_stats)
+        requests = stats['requests'] or 1
+        return {
+            'requests': stats['requests'],
+            'context_token_budget': self.context_builder.token_budget,
+            'avg_prompt_tokens': stats['prompt_tokens'] / requests,
+            'avg_context_tokens': stats['context_tokens'] / requests,
+            'avg_budget_utilisation': stats['utilisation'] / requests
         }
 
 def main():
@@ -310,14 +1010,14 @@ def main():
     
     for question in test_questions:
         print(f"\nUser: {question}")
-        response = chatbot.ask(question)
+        response = chatbot.ask(question, session_id='test')
         print(f"Bot: {response}")
     
     # Show statistics
     stats = chatbot.get_statistics()
     print(f"\n📊 Chatbot Statistics:")
     print(f"  Knowledge Base: {stats['knowledge_base']['total_documents']} documents")
-    print(f"  Conversation History: {stats['conversation_history_length']} messages")
+    print(f"  Conversation History: {len(chatbot.get_conversation_history('test'))} messages")
     print(f"  LLM Provider: {stats['llm_provider']}")
     print(f"  Drive Connected: {stats['drive_connected']}")
 
@@ -17,6 +17,9 @@ sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from chatbot_engine import SummerSchoolChatbot
 
+# The command line serves a single conversation
+CLI_SESSION = 'cli'
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -126,7 +129,7 @@ def show_statistics(chatbot):
 
 def show_history(chatbot):
     """显示对话历史。"""
-    history = chatbot.get_conversation_history()
+    history = chatbot.get_conversation_history(CLI_SESSION)
     
     if not history:
         print("\n📝 暂无对话历史")
@@ -178,7 +181,7 @@ def main():
         
         for question in test_questions:
             print(f"\n👤 用户: {question}")
-            response = chatbot.ask(question, use_llm=not args.no_llm)
+            response = chatbot.ask(question, use_llm=not args.no_llm, session_id=CLI_SESSION)
             print(f"🤖 助手: {response}")
         
         show_statistics(chatbot)
@@ -209,7 +212,7 @@ def main():
                 show_history(chatbot)
                 continue
             elif user_input.lower() in ['clear', '清除']:
-                chatbot.clear_conversation_history()
+                chatbot.clear_conversation_history(CLI_SESSION)
                 print("✅ 对话历史已清除！")
                 continue
             elif user_input.lower() in ['update', '更新']:
@@ -232,7 +235,7 @@ def main():
             
             # Process regular question
             print("🤖 助手: ", end="")
-            response = chatbot.ask(user_input, use_llm=not args.no_llm)
+            response = chatbot.ask(user_input, use_llm=not args.no_llm, session_id=CLI_SESSION)
             print(response)
             
         except KeyboardInterrupt:
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+LLM Context Builder for Summer School Chatbot
+
+This module assembles the knowledge base context of an LLM prompt within a
+token budget: results are split into passages, ranked, deduplicated and
+added best first until the budget is filled.
+"""
+
+import math
+import re
+from typing import Any, Dict, List, NamedTuple, Set, Tuple
+
+_HAN_RE = re.compile(r'[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]')
+_PASSAGE_RE = re.compile(r'[^。！？!?\n]+[。！？!?]?')
+_WORD_RE = re.compile(r'[\u4e00-\u9fff]|[a-z0-9]+')
+
+# Non-CJK text averages about four characters per token
+CHARS_PER_TOKEN = 4
+
+# Passages sharing this fraction of their character bigrams are duplicates
+DUPLICATE_OVERLAP = 0.8
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of LLM tokens in text.
+
+    CJK characters and full-width punctuation are counted as one token
+    each; other characters as one token per CHARS_PER_TOKEN.
+    """
+    cjk = len(_HAN_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / CHARS_PER_TOKEN)
+
+
+def _bigrams(text: str) -> Set[str]:
+    compact = ''.join(text.lower().split())
+    return {compact[i:i + 2] for i in range(len(compact) - 1)}
+
+
+class ContextPiece(NamedTuple):
+    """A unit of context: one passage of one result."""
+    result_index: int
+    position: int
+    text: str
+    score: float
+    tokens: int
+
+
+class ContextReport(NamedTuple):
+    """The assembled context and how much of the budget it used."""
+    text: str
+    tokens: int
+    budget: int
+    pieces_used: int
+    pieces_total: int
+    duplicates: int
+
+    @property
+    def utilisation(self) -> float:
+        return self.tokens / self.budget if self.budget else 0.0
+
+
+class ContextBuilder:
+    """
+    Token-budgeted context assembler.
+
+    Each result is split into passages (documents sentence by sentence,
+    other results as one line). Passages are ranked by their result's score,
+    then by how many query terms they contain; near-duplicates are dropped
+    and the rest added until the token budget is spent. The chosen passages
+    are rendered in result order so each source reads contiguously.
+    """
+
+    def __init__(self, token_budget: int = 1500, min_piece_tokens: int = 20):
+        """
+        Initialize the builder.
+
+        Args:
+            token_budget: Maximum estimated tokens of context
+            min_piece_tokens: Smallest remainder worth filling with a
+                truncated passage
+        """
+        self.token_budget = token_budget
+        self.min_piece_tokens = min_piece_tokens
+
+    def build(self, question: str, kb_results: List[Dict[str, Any]]) -> ContextReport:
+        """
+        Assemble the context for a question.
+
+        Args:
+            question: User question, used to rank passages within a result
+            kb_results: Knowledge base search results, best first
+
+        Returns:
+            ContextReport with the context text and its token usage
+        """
+        pieces = self._split(kb_results)
+        question_terms = set(_WORD_RE.findall(question.lower()))
+
+        def priority(piece: ContextPiece) -> Tuple:
+            overlap = sum(1 for term in question_terms if term in piece.text.lower())
+            return (-piece.score, -overlap, piece.result_index, piece.position)
+
+        chosen: List[ContextPiece] = []
+        chosen_bigrams: List[Set[str]] = []
+        used_results: Set[int] = set()
+        duplicates = 0
+        remaining = self.token_budget
+
+        for piece in sorted(pieces, key=priority):
+            if remaining <= 0:
+                break
+            bigrams = _bigrams(piece.text)
+            if any(self._overlaps(bigrams, other) for other in chosen_bigrams):
+                duplicates += 1
+                continue
+
+            # The first passage of a document also pays for its header, and
+            # every passage but the first for the line break or gap mark
+            # before it, so the rendered text stays within the budget
+            overhead = 1 if chosen else 0
+            if piece.result_index not in used_results:
+                overhead += estimate_tokens(self._header(kb_results[piece.result_index]))
+            if overhead + piece.tokens > remaining:
+                if remaining - overhead < self.min_piece_tokens:
+                    continue
+                piece = self._truncate(piece, remaining - overhead)
+            chosen.append(piece)
+            chosen_bigrams.append(bigrams)
+            used_results.add(piece.result_index)
+            remaining -= overhead + piece.tokens
+
+        text = self._render(kb_results, chosen)
+        return ContextReport(
+            text=text,
+            tokens=estimate_tokens(text),
+            budget=self.token_budget,
+            pieces_used=len(chosen),
+            pieces_total=len(pieces),
+            duplicates=duplicates
+        )
+
+    @staticmethod
+    def _overlaps(bigrams: Set[str], other: Set[str]) -> bool:
+        """Check whether the smaller of two passages is mostly contained in the other."""
+        smaller = min(len(bigrams), len(other))
+        if smaller == 0:
+            return False
+        return len(bigrams & other) / smaller >= DUPLICATE_OVERLAP
+
+    def _split(self, kb_results: List[Dict[str, Any]]) -> List[ContextPiece]:
+        """Split every result into scored passages."""
+        pieces = []
+        for index, result in enumerate(kb_results):
+            score = result.get('score', 0.0)
+            if result['type'] == 'document':
+                passages = [p.strip() for p in _PASSAGE_RE.findall(result['content']) if p.strip()]
+            else:
+                passages = [self._format_result(result)]
+            for position, text in enumerate(passages):
+                pieces.append(ContextPiece(index, position, text, score, estimate_tokens(text)))
+        return pieces
+
+    @staticmethod
+    def _truncate(piece: ContextPiece, tokens: int) -> ContextPiece:
+        """Cut a passage down to about the given number of tokens."""
+        text = piece.text
+        # Shrink proportionally, then trim until the estimate fits
+        text = text[:max(1, len(text) * tokens // max(piece.tokens, 1))]
+        while text and estimate_tokens(text + '…') > tokens:
+            text = text[:-1]
+        text += '…'
+        return piece._replace(text=text, tokens=estimate_tokens(text))
+
+    @staticmethod
+    def _header(result: Dict[str, Any]) -> str:
+        """Prefix rendered before a document's passages."""
+        return f"Document '{result['name']}': " if result['type'] == 'document' else ''
+
+    @staticmethod
+    def _format_result(result: Dict[str, Any]) -> str:
+        """Render a non-document result as one context line."""
+        if result['type'] == 'faq':
+            return f"FAQ: {result['question']} - {result['answer']}"
+        elif result['type'] == 'location':
+            return f"Location: {result['name']} at {result['address']}"
+        elif result['type'] == 'schedule':
+            return f"Schedule: {result['name']} on {result['date']} at {result['time']}"
+        return str(result.get('content', ''))
+
+    @staticmethod
+    def _render(kb_results: List[Dict[str, Any]], chosen: List[ContextPiece]) -> str:
+        """Join the chosen passages, grouped by result and in their original order."""
+        by_result: Dict[int, List[ContextPiece]] = {}
+        for piece in chosen:
+            by_result.setdefault(piece.result_index, []).append(piece)
+
+        lines = []
+        for index in sorted(by_result):
+            result = kb_results[index]
+            passages = sorted(by_result[index], key=lambda piece: piece.position)
+            if result['type'] == 'document':
+                # Mark gaps where passages of the excerpt were left out
+                parts = [passages[0].text]
+                for previous, piece in zip(passages, passages[1:]):
+                    parts.append(' … ' if piece.position > previous.position + 1 else '')
+                    parts.append(piece.text)
+                lines.append(ContextBuilder._header(result) + ''.join(parts))
+            else:
+                lines.append(passages[0].text)
+        return "\n".join(lines)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Dense Retrieval for Summer School Chatbot
+
+This module provides an offline, dependency-light embedding (hashed
+character n-gram TF-IDF) and a random-projection LSH index over it, so
+paraphrased questions can be matched to knowledge base entries that share
+few literal keywords with them.
+"""
+
+import logging
+import re
+import zlib
+from typing import Dict, Hashable, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+_RUN_RE = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+
+
+def char_ngrams(text: str, n_min: int = 1, n_max: int = 3) -> List[str]:
+    """Return the character n-grams of every Han or alphanumeric run in text."""
+    ngrams = []
+    for run in _RUN_RE.findall(text.lower()):
+        for n in range(n_min, n_max + 1):
+            ngrams.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return ngrams
+
+
+class HashedNgramEmbedder:
+    """
+    Hashed character n-gram TF-IDF embedding.
+
+    N-grams are hashed into a fixed number of signed buckets (the hashing
+    trick), weighted by sublinear term frequency and inverse document
+    frequency, and L2-normalized so a dot product is the cosine similarity.
+    """
+
+    def __init__(self, dim: int = 512, n_min: int = 1, n_max: int = 3):
+        if np is None:
+            raise ImportError("NumPy is required for dense retrieval. Run: pip install numpy")
+        self.dim = dim
+        self.n_min = n_min
+        self.n_max = n_max
+        self.idf = np.ones(dim, dtype=np.float32)
+
+    def _hashed_counts(self, text: str) -> Dict[int, float]:
+        """Return signed n-gram counts per bucket."""
+        counts: Dict[int, float] = {}
+        for ngram in char_ngrams(text, self.n_min, self.n_max):
+            h = zlib.crc32(ngram.encode('utf-8'))
+            bucket = h % self.dim
+            counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+        return counts
+
+    def fit(self, texts: Sequence[str]) -> None:
+        """Compute bucket document frequencies over a corpus."""
+        df = np.zeros(self.dim, dtype=np.float32)
+        for text in texts:
+            buckets = [b for b, c in self._hashed_counts(text).items() if c]
+            df[buckets] += 1
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+
+    def transform(self, texts: Sequence[str]) -> "np.ndarray":
+        """Embed texts into a C-contiguous float32 matrix of unit rows."""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, count in self._hashed_counts(text).items():
+                if count:
+                    matrix[row, bucket] = np.sign(count) * (1 + np.log(abs(count)))
+        matrix *= self.idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return np.ascontiguousarray(matrix / norms)
+
+
+class LSHIndex:
+    """
+    Random-projection (sign of random hyperplanes) LSH over unit vectors.
+
+    Each of n_tables hashes a vector to an n_bits code; vectors at a small
+    angle tend to share codes. Queries probe their own bucket and every
+    bucket one bit away in each table, then rank the candidates exactly.
+    """
+
+    def __init__(self, dim: int, n_bits: int = 12, n_tables: int = 4, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.n_bits = n_bits
+        self.planes = rng.standard_normal((n_tables, n_bits, dim)).astype(np.float32)
+        self._weights = (1 << np.arange(n_bits)).astype(np.int64)
+        self._tables: List[Dict[int, "np.ndarray"]] = []
+
+    def _codes(self, vectors: "np.ndarray") -> "np.ndarray":
+        """Return the (n_tables, n_vectors) bucket codes of vectors."""
+        bits = np.einsum('tbd,nd->tnb', self.planes, vectors) > 0
+        return bits.astype(np.int64) @ self._weights
+
+    def build(self, matrix: "np.ndarray") -> None:
+        """Bucket every row of matrix."""
+        self._tables = []
+        for codes in self._codes(matrix):
+            order = np.argsort(codes, kind='stable')
+            unique, starts = np.unique(codes[order], return_index=True)
+            self._tables.append(dict(zip(unique.tolist(), np.split(order, starts[1:]))))
+
+    def candidates(self, vector: "np.ndarray") -> "np.ndarray":
+        """Return the row ids sharing a bucket, or a one-bit neighbour, with vector."""
+        found = []
+        for table, code in zip(self._tables, self._codes(vector[None, :])[:, 0].tolist()):
+            for probe in [code] + [code ^ (1 << bit) for bit in range(self.n_bits)]:
+                rows = table.get(probe)
+                if rows is not None:
+                    found.append(rows)
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+
+class DenseIndex:
+    """
+    Dense-vector retrieval index over knowledge base entries.
+
+    Small corpora are ranked by one exact matrix-vector product; above
+    brute_force_limit rows, the LSH index narrows the candidates first.
+    """
+
+    def __init__(self, entries: Sequence[Tuple[Hashable, str]], dim: int = 512,
+                 brute_force_limit: int = 2000, seed: int = 0):
+        """
+        Build the index.
+
+        Args:
+            entries: (key, text) pairs in result order
+            dim: Embedding dimension
+            brute_force_limit: Largest corpus ranked without LSH
+            seed: Seed of the random hyperplanes
+        """
+        self.keys: List[Hashable] = [key for key, _ in entries]
+        texts = [text for _, text in entries]
+        self.embedder = HashedNgramEmbedder(dim)
+        self.embedder.fit(texts)
+        self.matrix = self.embedder.transform(texts)
+        self.brute_force_limit = brute_force_limit
+        self.lsh = None
+        if len(self.keys) > brute_force_limit:
+            self.lsh = LSHIndex(dim, seed=seed)
+            self.lsh.build(self.matrix)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.matrix.shape
+
+    def search(self, query: str, k: int) -> List[Tuple[Hashable, float]]:
+        """
+        Find the entries most similar to query.
+
+        Returns:
+            (key, cosine similarity) pairs with positive similarity, best
+            first, ties in build order
+        """
+        if k <= 0 or not self.keys:
+            return []
+        vector = self.embedder.transform([query])[0]
+
+        if self.lsh is None:
+            rows = np.arange(len(self.keys))
+        else:
+            rows = self.lsh.candidates(vector)
+        if rows.size == 0:
+            return []
+
+        similarities = self.matrix[rows] @ vector
+        keep = similarities > 0
+        rows, similarities = rows[keep], similarities[keep]
+        if rows.size > k:
+            # Keep every row tied with the k-th best, so the stable sort
+            # below, not argpartition, decides which of them make the cut
+            kth = np.partition(similarities, rows.size - k)[rows.size - k]
+            keep = similarities >= kth
+            rows, similarities = rows[keep], similarities[keep]
+
+        order = np.lexsort((rows, -similarities))[:k]
+        return [(self.keys[rows[i]], float(similarities[i])) for i in order]
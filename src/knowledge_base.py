@@ -7,23 +7,217 @@ summer school program information from various sources.
 """
 
 import hashlib
+import heapq
 import json
 import logging
+import os
 import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Set, Tuple
+
+from cache import LRUCache
+from dense_retrieval import DenseIndex
+from ranking import BM25Index
+from search_index import InvertedIndex, Passage, QueryPlan, SearchEntry
+from text_matcher import AhoCorasick, QuestionClassifier
+from vector_scoring import SparseTermMatrix
+
+# Not available on Windows, where updates are serialized per process only
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+# Sentence boundaries used to split documents into passages
+PASSAGE_RE = re.compile(r'[^。！？\n]+')
+
+class _Lexicon:
+    """
+    Lexicon automaton and expansion tables compiled from the semantic
+    mappings, intent keywords and answer patterns; not modified once built.
+    """
+    
+    def __init__(self, semantic_mappings: Dict[str, List[str]], intent_expansions: Dict[str, str],
+                 intent_keywords: Dict[str, List[str]], answer_patterns: List[str]):
+        # Reverse table: word -> every word sharing a mapping with it
+        word_expansions: Dict[str, Set[str]] = {}
+        for words in semantic_mappings.values():
+            for word in words:
+                word_expansions.setdefault(word, set()).update(words)
+        self.word_expansions = {word: frozenset(related) for word, related in word_expansions.items()}
+        self.intent_expansion_words = {
+            intent: frozenset(semantic_mappings.get(concept, []))
+            for intent, concept in intent_expansions.items()
+        }
+        self.expand = lru_cache(maxsize=4096)(self._expand)
+        
+        terms = set(answer_patterns)
+        for words in semantic_mappings.values():
+            terms.update(words)
+        for words in intent_keywords.values():
+            terms.update(words)
+        
+        self.terms = frozenset(term.lower() for term in terms)
+        self.matcher = AhoCorasick(self.terms)
+    
+    def _expand(self, keywords: FrozenSet[str], intent: str) -> FrozenSet[str]:
+        """Expand a keyword set using the precomputed reverse mapping table."""
+        expanded = set(keywords)
+        
+        for keyword in keywords:
+            related_words = self.word_expansions.get(keyword)
+            if related_words:
+                expanded.update(related_words)
+        
+        # Add intent-specific keywords
+        expanded.update(self.intent_expansion_words.get(intent, ()))
+        
+        return frozenset(expanded)
+
+class _Snapshot:
+    """
+    One version of the knowledge base data and its search indexes.
+    
+    A search reads a single snapshot from start to end, without locking.
+    Writers copy the current snapshot, change the copy and publish it by
+    replacing KnowledgeBase._snapshot, so a published snapshot is never
+    modified; only its term matrix and dense index, derived from the rest,
+    are filled in lazily.
+    """
+    
+    def __init__(self, data: Dict[str, Any], lexicon: _Lexicon):
+        self.data = data
+        self.lexicon = lexicon
+        self.search_entries: Dict[Tuple, SearchEntry] = {}
+        self.index = InvertedIndex()
+        self.bm25 = BM25Index()
+        self.category_rank: Dict[str, int] = {}
+        self.index_seq = 0
+        self.version = 0
+        self._term_matrix: Optional[SparseTermMatrix] = None
+        self._dense_index: Optional[DenseIndex] = None
+        self._build_lock = threading.Lock()
+        # Data sections already copied for this snapshot
+        self._owned: Set[Tuple[str, ...]] = set()
+    
+    def copy(self) -> "_Snapshot":
+        """Start the next version, sharing everything not yet changed with this one."""
+        other = _Snapshot(dict(self.data), self.lexicon)
+        other.search_entries = dict(self.search_entries)
+        other.index = self.index.copy()
+        other.bm25 = self.bm25.copy()
+        other.category_rank = dict(self.category_rank)
+        other.index_seq = self.index_seq
+        other.version = self.version
+        other._term_matrix = self._term_matrix
+        other._dense_index = self._dense_index
+        return other
+    
+    def writable(self, *path: str) -> Dict[str, Any]:
+        """Return the data section at path, copied first so older snapshots keep theirs."""
+        node = self.data
+        for depth, name in enumerate(path):
+            if path[:depth + 1] not in self._owned:
+                node[name] = dict(node.get(name, {}))
+                self._owned.add(path[:depth + 1])
+            node = node[name]
+        return node
+    
+    @property
+    def last_updated(self) -> Optional[str]:
+        """When the data was last saved; older files keep the stamp at the top level."""
+        return self.data.get('metadata', {}).get('last_updated') or self.data.get('last_updated')
+    
+    def entry(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Look up the raw knowledge base entry for an index key."""
+        kind = key[0]
+        if kind == 'document':
+            return self.data['documents'].get(key[1])
+        elif kind == 'faq':
+            faqs = self.data['faqs'].get(key[1])
+            faq = faqs.get(key[2]) if isinstance(faqs, dict) else None
+            if isinstance(faq, dict) and 'question' in faq and 'answer' in faq:
+                return faq
+            return None
+        elif kind == 'location':
+            return self.data['locations'].get(key[1])
+        elif kind == 'schedule':
+            return self.data['schedules'].get(key[1])
+        return None
+    
+    def clear_derived(self) -> None:
+        """Drop the lazily built indexes after the entries change."""
+        self._term_matrix = None
+        self._dense_index = None
+    
+    def term_matrix(self) -> SparseTermMatrix:
+        """Return the term-entry matrix, building it on first use."""
+        if self._term_matrix is None:
+            with self._build_lock:
+                if self._term_matrix is None:
+                    self._term_matrix = SparseTermMatrix([
+                        (key, self.search_entries[key].terms)
+                        for key in self.index.ordered(self.search_entries)
+                    ])
+                    logger.info(f"Built term-entry matrix with shape {self._term_matrix.shape}")
+        return self._term_matrix
+    
+    def dense_index(self) -> DenseIndex:
+        """Return the dense retrieval index, building it on first use."""
+        if self._dense_index is None:
+            with self._build_lock:
+                if self._dense_index is None:
+                    self._dense_index = DenseIndex([
+                        (key, self.search_entries[key].title + '\n' + self.search_entries[key].text)
+                        for key in self.index.ordered(self.search_entries)
+                    ])
+                    logger.info(f"Built dense retrieval index with shape {self._dense_index.shape}")
+        return self._dense_index
+
 class KnowledgeBase:
     """
     Enhanced knowledge base with improved search capabilities for Chinese text.
+    
+    The data and indexes are held in copy-on-write snapshots: searches run
+    against the snapshot current when they start and never wait for an
+    update, while updates are serialized and publish a new snapshot when
+    complete.
+    
+    Several processes can serve the same knowledge base file: each update
+    holds a lock file while it reloads the file if another process has
+    saved it since, applies the change and saves, and with a
+    reload_interval a background thread picks up other processes'
+    updates within that many seconds.
     """
     
-    def __init__(self, knowledge_base_path: str = "data/knowledge_base.json"):
+    # Ranking modes accepted by search()
+    RANKING_MODES = ('heuristic', 'bm25', 'vector', 'dense')
+    
+    def __init__(self, knowledge_base_path: str = "data/knowledge_base.json",
+                 semantic_mappings_path: Optional[str] = None,
+                 ranking_mode: Optional[str] = None,
+                 cache_size: int = 256,
+                 cache_ttl: Optional[float] = None,
+                 reload_interval: Optional[float] = None):
         self.knowledge_base_path = Path(knowledge_base_path)
-        self.knowledge_base = self._load_knowledge_base()
+        # Identifies the file version last read or written by this process
+        self._file_stamp = self._stat_file()
+        self.reload_interval = reload_interval
+        self._next_reload_check = 0.0
+        # Held by the background reload thread, so that only one runs
+        self._reloading = threading.Lock()
+        self.ranking_mode = ranking_mode or 'heuristic'
+        if self.ranking_mode not in self.RANKING_MODES:
+            raise ValueError(f"Unknown ranking mode: {self.ranking_mode}")
+        data = self._load_knowledge_base()
         
         # Enhanced keyword mappings for better Chinese search
         self.semantic_mappings = {
@@ -51,6 +245,19 @@ class KnowledgeBase:
             'mailing': ['邮寄', '快递', '寄送', '邮递', '运送', '物流'],
             'shipping': ['邮寄', '快递', '寄送', '邮递', '运送', '物流']
         }
+        if semantic_mappings_path:
+            self.semantic_mappings.update(self._load_semantic_mappings(semantic_mappings_path))
+        
+        # Semantic mapping added to the expansion of each question intent
+        self.intent_expansions = {
+            'location_question': 'location',
+            'address_question': 'location',
+            'time_question': 'time',
+            'behavior_question': 'behavior',
+            'accommodation_question': 'accommodation',
+            'activity_question': 'activity',
+            'mailing_question': 'mailing'
+        }
         
         # Question pattern matching for better intent recognition
         self.question_patterns = {
@@ -79,6 +286,101 @@ class KnowledgeBase:
                 r'.*怎么寄.*', r'.*如何.*寄.*'
             ]
         }
+        self.question_classifier = QuestionClassifier(self.question_patterns)
+
+        # Intent-specific vocabulary used for scoring and candidate lookup
+        self.intent_keywords = {
+            'location_question': ['地址', '地点', '位置', '校园', '学校', '举办', '浦东', '上海', '申启路'],
+            'time_question': ['时间', '日期', '7月', '8月', '开始', '结束', '报到', '签到', '13:30', '18:00'],
+            'behavior_question': ['行为', '不当', '守则', '规则', '违规', '性骚扰', '歧视', '威胁'],
+            'accommodation_question': ['床垫', '住宿', '床上用品', '枕头', '被子', '105', '198'],
+            'activity_question': ['晚间活动', '参与', '参加', '出席', '21:40', '22:00'],
+            'mailing_question': ['邮寄', '快递', '寄送', '7月25', '门卫', '唯理']
+        }
+
+        # Chinese question indicators and the answer patterns they reward
+        self.question_indicators = ['什么', '哪里', '怎么', '如何', '可以', '需要', '应该']
+        self.answer_patterns = ['是', '在', '于', '需要', '可以', '应该', '建议']
+
+        # The data, lexicon (see refresh_lexicon()) and indexes searched;
+        # replaced as a whole by every update, and only under _write_lock
+        self._snapshot = _Snapshot(data, _Lexicon({}, {}, {}, []))
+        self._write_lock = threading.RLock()
+        
+        # Search results are cached per version; every change to the
+        # indexed content or the lexicon bumps it, orphaning older entries
+        self.search_cache = LRUCache(max_size=cache_size, ttl=cache_ttl)
+        self.refresh_lexicon()
+        self._build_index()
+
+    @property
+    def knowledge_base(self) -> Dict[str, Any]:
+        """The current knowledge base data; treat it as read-only."""
+        return self._snapshot.data
+
+    @property
+    def version(self) -> int:
+        return self._snapshot.version
+
+    @property
+    def last_updated(self) -> Optional[str]:
+        return self._snapshot.last_updated
+
+    @property
+    def index(self) -> InvertedIndex:
+        return self._snapshot.index
+
+    @property
+    def bm25(self) -> BM25Index:
+        return self._snapshot.bm25
+
+    @property
+    def lexicon(self) -> FrozenSet[str]:
+        return self._snapshot.lexicon.terms
+
+    @property
+    def lexicon_matcher(self) -> AhoCorasick:
+        return self._snapshot.lexicon.matcher
+
+    @contextmanager
+    def _writing(self, save: bool = True) -> Iterator[_Snapshot]:
+        """
+        Build the next snapshot and publish it when the block completes.
+        
+        Writers are serialized, across processes too when saving;
+        searches keep using the previous snapshot until the new one is
+        published by a single assignment. Nothing is published if the
+        block raises.
+        
+        Args:
+            save: Stamp last_updated and write the knowledge base file
+        """
+        with self._write_lock, (self._file_lock() if save else nullcontext()):
+            if save:
+                # Build on what another process may have saved meanwhile
+                self.reload()
+            snapshot = self._snapshot.copy()
+            yield snapshot
+            if save:
+                snapshot.writable('metadata')['last_updated'] = datetime.now().isoformat()
+            self._snapshot = snapshot
+            if save:
+                self._save_knowledge_base(snapshot.data)
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Hold an exclusive lock on the knowledge base's lock file, which other processes' updates also take."""
+        if fcntl is None:
+            yield
+            return
+        lock_path = self.knowledge_base_path.with_name(self.knowledge_base_path.name + '.lock')
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
 
     def _load_knowledge_base(self) -> Dict[str, Any]:
         """Load knowledge base from file."""
@@ -103,18 +405,263 @@ class KnowledgeBase:
             }
         }
 
-    def _save_knowledge_base(self) -> None:
+    def _save_knowledge_base(self, data: Dict[str, Any]) -> None:
         """Save knowledge base to file."""
         try:
             self.knowledge_base_path.parent.mkdir(parents=True, exist_ok=True)
-            self.knowledge_base['metadata']['last_updated'] = datetime.now().isoformat()
             
-            with open(self.knowledge_base_path, 'w', encoding='utf-8') as f:
-                json.dump(self.knowledge_base, f, ensure_ascii=False, indent=2)
+            # Written aside and renamed into place, so that other processes
+            # never read a partly written file
+            fd, temp_path = tempfile.mkstemp(
+                dir=self.knowledge_base_path.parent, prefix=self.knowledge_base_path.name, suffix='.tmp'
+            )
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                stamp = self._stat_file(temp_path)
+                os.replace(temp_path, self.knowledge_base_path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            self._file_stamp = stamp
             logger.info(f"Saved knowledge base to {self.knowledge_base_path}")
         except Exception as e:
             logger.error(f"Error saving knowledge base: {e}")
 
+    def _stat_file(self, path: Optional[str] = None) -> Optional[Tuple[int, int, int]]:
+        """Identify the current version of the knowledge base file, or None if it is missing."""
+        try:
+            stat = os.stat(path or self.knowledge_base_path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def reload(self) -> bool:
+        """
+        Reload the knowledge base file if it changed since this process
+        last read or wrote it, e.g. when another worker process saved an
+        update.
+        
+        The file is parsed before taking the write lock, so updates in
+        this process wait only for the index build.
+        
+        Returns:
+            True if a new version was loaded
+        """
+        stamp = self._stat_file()
+        if stamp is None or stamp == self._file_stamp:
+            return False
+        try:
+            with open(self.knowledge_base_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Error reloading knowledge base: {e}")
+            return False
+        with self._write_lock:
+            # Saved again meanwhile, by this process or another: the next
+            # check loads that version instead
+            if self._stat_file() != stamp or stamp == self._file_stamp:
+                return False
+            self._file_stamp = stamp
+            self._build_index(data)
+        
+        logger.info(f"Reloaded knowledge base from {self.knowledge_base_path}")
+        return True
+
+    def _reload_if_due(self) -> None:
+        """
+        Check for another process's update at most every reload_interval
+        seconds, in a background thread; searches go on with the current
+        snapshot until the reloaded one is published.
+        """
+        if self.reload_interval is None:
+            return
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return
+        self._next_reload_check = now + self.reload_interval
+        if not self._reloading.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(target=self._reload_in_background, name='kb-reload', daemon=True).start()
+        except BaseException:
+            self._reloading.release()
+            raise
+
+    def _reload_in_background(self) -> None:
+        try:
+            self.reload()
+        finally:
+            self._reloading.release()
+
+    def _build_index(self, data: Optional[Dict[str, Any]] = None) -> None:
+        """Build the inverted index over all knowledge base entries, of data if given as a new version."""
+        with self._write_lock:
+            current = self._snapshot
+            snapshot = _Snapshot(current.data if data is None else data, current.lexicon)
+            snapshot.version = current.version if data is None else current.version + 1
+            
+            for doc_id in snapshot.data['documents']:
+                self._index_entry(snapshot, ('document', doc_id))
+            
+            for category, faqs in snapshot.data['faqs'].items():
+                if isinstance(faqs, dict):
+                    for faq_id in faqs:
+                        self._index_entry(snapshot, ('faq', category, faq_id))
+            
+            for name in snapshot.data['locations']:
+                self._index_entry(snapshot, ('location', name))
+            
+            for schedule_id in snapshot.data['schedules']:
+                self._index_entry(snapshot, ('schedule', schedule_id))
+            
+            self._snapshot = snapshot
+        
+        logger.info(f"Indexed {len(snapshot.index)} knowledge base entries")
+
+    def _load_semantic_mappings(self, path: str) -> Dict[str, List[str]]:
+        """Load additional semantic mappings from a JSON file."""
+        mappings_path = Path(path)
+        if not mappings_path.exists():
+            logger.warning(f"Semantic mappings file not found: {mappings_path}")
+            return {}
+        
+        try:
+            with open(mappings_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            logger.info(f"Loaded {len(data)} semantic mappings from {mappings_path}")
+            return {concept: list(words) for concept, words in data.items()}
+        except Exception as e:
+            logger.error(f"Error loading semantic mappings: {e}")
+            return {}
+
+    def refresh_lexicon(self) -> None:
+        """
+        Rebuild the lexicon automaton and expansion tables after the
+        semantic mappings, intent keywords or answer patterns change.
+        
+        Every entry's text is scanned once by the automaton and the lexicon
+        terms it contains are stored with the entry, so scoring lexicon
+        keywords becomes a set lookup instead of a substring search.
+        """
+        with self._writing(save=False) as snapshot:
+            lexicon = _Lexicon(self.semantic_mappings, self.intent_expansions,
+                               self.intent_keywords, self.answer_patterns)
+            snapshot.lexicon = lexicon
+            
+            # Re-scan entries that were built against the previous automaton
+            for key in list(snapshot.search_entries):
+                snapshot.search_entries[key] = self._make_search_entry(lexicon, key, snapshot.entry(key))
+            snapshot.clear_derived()
+            snapshot.version += 1
+        
+        logger.info(f"Compiled lexicon automaton with {len(lexicon.terms)} terms")
+
+    def update_semantic_mappings(self, mappings: Dict[str, List[str]]) -> None:
+        """
+        Add or replace semantic keyword mappings.
+        
+        Args:
+            mappings: Mapping of concept name to related words
+        """
+        with self._write_lock:
+            self.semantic_mappings.update(mappings)
+            self.refresh_lexicon()
+
+    def _make_search_entry(self, lexicon: _Lexicon, key: Tuple, entry: Dict[str, Any]) -> SearchEntry:
+        """Build the precomputed searchable form of a knowledge base entry."""
+        kind = key[0]
+        if kind == 'document':
+            text, title, keywords = entry['content'], entry['name'], entry['keywords']
+        elif kind == 'faq':
+            text = entry['question'] + ' ' + entry['answer']
+            title, keywords = entry['question'], entry.get('keywords', [])
+        elif kind == 'location':
+            text, title = key[1] + ' ' + entry['address'], key[1]
+            keywords = ['location', 'address', 'where']
+        else:
+            text = entry['name'] + ' ' + entry['date'] + ' ' + entry['time']
+            title, keywords = entry['name'], ['schedule', 'time', 'date']
+        
+        text, title = text.lower(), title.lower()
+        return SearchEntry(
+            key=key,
+            text=text,
+            title=title,
+            keywords=tuple(keyword.lower() for keyword in keywords),
+            text_terms=lexicon.matcher.matches(text),
+            title_terms=lexicon.matcher.matches(title),
+            passages=self._split_passages(lexicon, entry['content']) if kind == 'document' else ()
+        )
+
+    def _split_passages(self, lexicon: _Lexicon, content: str) -> Tuple[Passage, ...]:
+        """Split document content into sentence passages with their offsets."""
+        passages = []
+        for match in PASSAGE_RE.finditer(content):
+            sentence = match.group()
+            stripped = sentence.strip()
+            if not stripped:
+                continue
+            start = match.start() + len(sentence) - len(sentence.lstrip())
+            text = stripped.lower()
+            passages.append(Passage(
+                start=start,
+                end=start + len(stripped),
+                text=text,
+                terms=lexicon.matcher.matches(text)
+            ))
+        return tuple(passages)
+
+    def _index_entry(self, snapshot: _Snapshot, key: Tuple) -> None:
+        """Add or refresh a single entry in the indexes of an unpublished snapshot."""
+        entry = snapshot.entry(key)
+        snapshot.clear_derived()
+        snapshot.version += 1
+        if entry is None:
+            snapshot.index.remove(key)
+            snapshot.bm25.remove(key)
+            snapshot.search_entries.pop(key, None)
+            return
+        
+        kind = key[0]
+        snapshot.index_seq += 1
+        if kind == 'document':
+            rank = (0, snapshot.index_seq)
+        elif kind == 'faq':
+            category_rank = snapshot.category_rank.setdefault(key[1], len(snapshot.category_rank))
+            rank = (1, category_rank, snapshot.index_seq)
+        elif kind == 'location':
+            rank = (2, snapshot.index_seq)
+        else:
+            rank = (3, snapshot.index_seq)
+        
+        search_entry = self._make_search_entry(snapshot.lexicon, key, entry)
+        snapshot.search_entries[key] = search_entry
+        snapshot.index.add(key, search_entry.index_text, rank)
+        snapshot.bm25.add(key, search_entry.index_text)
+
+    def _find_candidates(self, snapshot: _Snapshot, plan: QueryPlan) -> Dict[Tuple, int]:
+        """
+        Find the entries sharing at least one term with the query.
+        
+        Candidate terms are the semantically expanded query keywords plus
+        the vocabulary of the detected intent. A query without any terms
+        falls back to scoring every entry.
+        
+        Returns:
+            Mapping of candidate key to the number of non-lexicon expanded
+            keywords the entry may contain (an upper bound on its matches)
+        """
+        terms = plan.expanded_keywords + plan.intent_keywords
+        if not terms:
+            return dict.fromkeys(snapshot.index.all_keys(), 0)
+        
+        candidates = dict.fromkeys(snapshot.index.candidates(terms), 0)
+        for keyword in plan.other_keywords:
+            for key in snapshot.index.lookup(keyword):
+                candidates[key] += 1
+        return candidates
+
     def add_document(self, name: str, content: str, metadata: Dict = None) -> None:
         """
         Add a document to the knowledge base.
@@ -124,18 +671,37 @@ class KnowledgeBase:
             content: Document content
             metadata: Additional metadata
         """
+        with self._writing() as snapshot:
+            self._put_document(snapshot, name, content, metadata)
+        
+        logger.info(f"Added document: {name}")
+
+    def update_from_drive_documents(self, documents: Dict[str, str]) -> None:
+        """
+        Add or refresh documents retrieved from Google Drive.
+        
+        Args:
+            documents: Dictionary mapping document names to their content
+        """
+        # All documents are published together, as one new version
+        with self._writing() as snapshot:
+            for name, content in documents.items():
+                self._put_document(snapshot, name, content, {'source': 'google_drive'})
+        
+        logger.info(f"Updated {len(documents)} documents from Google Drive")
+
+    def _put_document(self, snapshot: _Snapshot, name: str, content: str, metadata: Dict = None) -> None:
+        """Store and index a document, splitting it into passages."""
         doc_id = hashlib.md5(name.encode()).hexdigest()
         
-        self.knowledge_base['documents'][doc_id] = {
+        snapshot.writable('documents')[doc_id] = {
             'name': name,
             'content': content,
             'metadata': metadata or {},
             'added': datetime.now().isoformat(),
             'keywords': self._extract_keywords(content)
         }
-        
-        self._save_knowledge_base()
-        logger.info(f"Added document: {name}")
+        self._index_entry(snapshot, ('document', doc_id))
 
     def add_faq(self, category: str, question: str, answer: str, keywords: List[str] = None) -> None:
         """
@@ -147,19 +713,17 @@ class KnowledgeBase:
             answer: The answer
             keywords: Search keywords
         """
-        if category not in self.knowledge_base['faqs']:
-            self.knowledge_base['faqs'][category] = {}
-        
         faq_id = hashlib.md5(question.encode()).hexdigest()
         
-        self.knowledge_base['faqs'][category][faq_id] = {
-            'question': question,
-            'answer': answer,
-            'keywords': keywords or self._extract_keywords(question + ' ' + answer),
-            'added': datetime.now().isoformat()
-        }
+        with self._writing() as snapshot:
+            snapshot.writable('faqs', category)[faq_id] = {
+                'question': question,
+                'answer': answer,
+                'keywords': keywords or self._extract_keywords(question + ' ' + answer),
+                'added': datetime.now().isoformat()
+            }
+            self._index_entry(snapshot, ('faq', category, faq_id))
         
-        self._save_knowledge_base()
         logger.info(f"Added FAQ: {question}")
 
     def add_location(self, name: str, address: str, details: Dict = None) -> None:
@@ -171,13 +735,14 @@ class KnowledgeBase:
             address: Location address
             details: Additional location details
         """
-        self.knowledge_base['locations'][name] = {
-            'address': address,
-            'details': details or {},
-            'added': datetime.now().isoformat()
-        }
+        with self._writing() as snapshot:
+            snapshot.writable('locations')[name] = {
+                'address': address,
+                'details': details or {},
+                'added': datetime.now().isoformat()
+            }
+            self._index_entry(snapshot, ('location', name))
         
-        self._save_knowledge_base()
         logger.info(f"Added location: {name}")
 
     def add_schedule(self, name: str, date: str, time: str, description: str = "") -> None:
@@ -192,124 +757,354 @@ class KnowledgeBase:
         """
         schedule_id = hashlib.md5((name + date + time).encode()).hexdigest()
         
-        self.knowledge_base['schedules'][schedule_id] = {
-            'name': name,
-            'date': date,
-            'time': time,
-            'description': description,
-            'added': datetime.now().isoformat()
-        }
+        with self._writing() as snapshot:
+            snapshot.writable('schedules')[schedule_id] = {
+                'name': name,
+                'date': date,
+                'time': time,
+                'description': description,
+                'added': datetime.now().isoformat()
+            }
+            self._index_entry(snapshot, ('schedule', schedule_id))
         
-        self._save_knowledge_base()
         logger.info(f"Added schedule: {name} on {date}")
 
-    def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query: str, max_results: int = 5, mode: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Enhanced search with better Chinese text processing and semantic matching.
         
         Args:
             query: Search query
             max_results: Maximum number of results to return
+            mode: Ranking mode ('heuristic', 'bm25', 'vector' or 'dense');
+                defaults to the knowledge base's ranking_mode
             
         Returns:
             List of relevant results with scores
         """
+        self._reload_if_due()
+        results = self._search(self._snapshot, query, max_results, mode or self.ranking_mode)
+        
+        # Copies, so callers cannot alter what later lookups return
+        return [dict(result) for result in results]
+
+    def _search(self, snapshot: _Snapshot, query: str, max_results: int, mode: str) -> List[Dict[str, Any]]:
+        """Search one snapshot, through the search cache; the results are shared, not copied."""
+        cache_key = (self._normalize_query(query), max_results, mode, snapshot.version)
+        results = self.search_cache.get(cache_key)
+        if results is None:
+            plan = self._plan_query(snapshot, query)
+            hits = self._rank(snapshot, plan, query, max_results, mode)
+            
+            # Result dicts (and document excerpts) are only built for the hits returned
+            results = [self._build_result(snapshot, key, score, plan) for key, score in hits]
+            self.search_cache.set(cache_key, results)
+        return results
+
+    def search_many(self, queries: List[str], max_results: int = 5,
+                    mode: Optional[str] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Search for many queries at once.
+        
+        Each distinct query is planned and ranked on its own, as search()
+        does; queries that differ only in case or outer whitespace are
+        searched once and share their results. The whole batch searches one
+        snapshot, so every query sees the same version of the knowledge base.
+        
+        Args:
+            queries: Search queries
+            max_results: Maximum number of results per query
+            mode: Ranking mode, as for search()
+            
+        Returns:
+            The results of each query, in input order
+        """
+        self._reload_if_due()
+        snapshot = self._snapshot
+        mode = mode or self.ranking_mode
+        unique: Dict[str, List[Dict[str, Any]]] = {}
+        for query in queries:
+            normalized = self._normalize_query(query)
+            if normalized not in unique:
+                unique[normalized] = self._search(snapshot, query, max_results, mode)
+        return [[dict(result) for result in unique[self._normalize_query(query)]] for query in queries]
+
+    @staticmethod
+    def _normalize_query(query: str) -> str:
+        """Normalize a query for caching; results do not depend on case or outer whitespace."""
+        return query.strip().lower()
+
+    def search_hits(self, query: str, max_results: int = 5,
+                    mode: Optional[str] = None) -> List[Tuple[Tuple, float]]:
+        """
+        Rank entries without building result dicts.
+        
+        Args:
+            query: Search query
+            max_results: Maximum number of hits to return
+            mode: Ranking mode, as for search()
+            
+        Returns:
+            List of (entry key, score) pairs, best first; pass them to
+            build_results() to materialize the ones actually needed
+        """
+        self._reload_if_due()
+        snapshot = self._snapshot
+        plan = self._plan_query(snapshot, query)
+        return self._rank(snapshot, plan, query, max_results, mode or self.ranking_mode)
+
+    def build_results(self, query: str, hits: List[Tuple[Tuple, float]]) -> List[Dict[str, Any]]:
+        """
+        Build search result dicts for hits returned by search_hits().
+        
+        Args:
+            query: The query the hits were ranked for
+            hits: (entry key, score) pairs
+            
+        Returns:
+            List of results in the same format as search()
+        """
+        snapshot = self._snapshot
+        plan = self._plan_query(snapshot, query)
+        return [self._build_result(snapshot, key, score, plan) for key, score in hits
+                if key in snapshot.search_entries]
+
+    def _rank(self, snapshot: _Snapshot, plan: QueryPlan, query: str, k: int,
+              mode: str) -> List[Tuple[Tuple, float]]:
+        """Return the top k (entry key, score) hits for a query, best first."""
+        if mode == 'heuristic':
+            return self._heuristic_top_k(snapshot, plan, k)
+        
+        elif mode == 'bm25':
+            scores = snapshot.bm25.score(query)
+            keys = [key for key in snapshot.index.ordered(scores) if scores[key] > 0]
+            # nlargest is stable, so equal scores keep result order
+            return [(key, scores[key]) for key in heapq.nlargest(k, keys, key=scores.__getitem__)]
+        
+        elif mode == 'vector':
+            return self._vector_top_k(snapshot, plan, k)
+        
+        elif mode == 'dense':
+            return self._dense_top_k(snapshot, query, k)
+        
+        raise ValueError(f"Unknown ranking mode: {mode}")
+
+    def _heuristic_top_k(self, snapshot: _Snapshot, plan: QueryPlan, k: int) -> List[Tuple[Tuple, float]]:
+        """
+        Select the k best entries with the heuristic scorer.
+        
+        Candidates from the inverted index are visited in result order and
+        kept in a bounded min-heap. A candidate whose score upper bound
+        cannot beat the current k-th best is skipped without scoring, and
+        the scan stops once k entries sit at the 3.0 cap, since later
+        entries can at most tie and ties keep the earlier entry.
+        """
+        if k <= 0:
+            return []
+        
+        candidates = self._find_candidates(snapshot, plan)
+        phrase_candidates = snapshot.index.lookup(plan.query) if plan.query else None
+        heap: List[Tuple[float, int, Tuple]] = []
+        
+        for position, key in enumerate(snapshot.index.ordered(candidates)):
+            entry = snapshot.search_entries[key]
+            if len(heap) == k:
+                kth_score = heap[0][0]
+                if kth_score >= 3.0:
+                    break
+                bound = self._score_upper_bound(plan, entry, candidates[key], phrase_candidates)
+                if bound <= kth_score:
+                    continue
+            
+            score = self._calculate_enhanced_relevance_score(plan, entry)
+            if score <= 0:
+                continue
+            # The heap's smallest item is the worst hit: lowest score, and
+            # the later position among equal scores
+            item = (score, -position, key)
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item[:2] > heap[0][:2]:
+                heapq.heapreplace(heap, item)
+        
+        heap.sort(key=lambda item: (-item[0], -item[1]))
+        return [(key, score) for score, _, key in heap]
+
+    def _score_upper_bound(self, plan: QueryPlan, entry: SearchEntry, keyword_hits: int,
+                           phrase_candidates: Optional[Set[Tuple]]) -> float:
+        """
+        Cheap upper bound of _calculate_enhanced_relevance_score.
+        
+        Components are added in the scorer's order so floating-point
+        rounding cannot make the bound smaller than the score.
+        
+        Args:
+            keyword_hits: Upper bound on matching non-lexicon expanded keywords
+            phrase_candidates: Entries that may contain the whole query, or
+                None if every entry may
+        """
+        bound = 0.0
+        
+        if phrase_candidates is None or entry.key in phrase_candidates:
+            bound += 2.0
+        
+        if any(keyword in entry.title for keyword in plan.keywords):
+            bound += 1.5
+        
+        if plan.expanded_keywords:
+            matches = len(entry.text_terms.intersection(plan.expanded_keywords)) + keyword_hits
+            bound += (matches / len(plan.expanded_keywords)) * 1.2
+        
+        bound += self._calculate_intent_score(plan, entry)
+        
+        if entry.keywords:
+            bound += 0.8
+        
+        bound += self._calculate_pattern_score(plan, entry)
+        
+        return min(bound, 3.0)
+
+    def _vector_top_k(self, snapshot: _Snapshot, plan: QueryPlan, k: int) -> List[Tuple[Tuple, float]]:
+        """
+        Score all entries with one sparse matrix product and select the top k.
+        
+        Entries are columns of a term-entry matrix over their keywords and
+        lexicon terms, built lazily after the knowledge base changes. The
+        query vector weights expanded keywords and intent keywords like the
+        heuristic scorer's keyword and intent components; substring-only
+        matches are not considered.
+        """
+        term_matrix = snapshot.term_matrix()
+        
+        # Whole-phrase query keywords rarely equal an entry term, so the
+        # lexicon terms they contain are added to the query as well
+        keywords = set(plan.expanded_keywords) | snapshot.lexicon.matcher.matches(plan.query)
+        
+        query_vector: Dict[str, float] = {}
+        if keywords:
+            weight = 1.2 / len(keywords)
+            for keyword in keywords:
+                query_vector[keyword] = weight
+        if plan.intent_keywords:
+            weight = 0.8 / len(plan.intent_keywords)
+            for keyword in plan.intent_keywords:
+                query_vector[keyword] = query_vector.get(keyword, 0.0) + weight
+        
+        # Rounded so that scores equal but for float32 summation order
+        # (which follows the query terms' set order) tie, and ties keep
+        # result order in every process
+        scores = term_matrix.dot(query_vector).round(5).clip(max=3.0)  # Cap at 3.0
+        return term_matrix.top_k(scores, k)
+
+    def _dense_top_k(self, snapshot: _Snapshot, query: str, k: int) -> List[Tuple[Tuple, float]]:
+        """
+        Find the k entries most similar to the query by embedding.
+        
+        Entries are embedded by title and text with hashed character
+        n-gram TF-IDF; scores are cosine similarities in [0, 1]. The index
+        is built lazily after the knowledge base changes.
+        """
+        return snapshot.dense_index().search(query, k)
+
+    def warm_up(self, modes: Optional[List[str]] = None) -> None:
+        """
+        Build the lazily built indexes of the given ranking modes now.
+        
+        Used before forking server workers, so the indexes are built once
+        and shared by the workers instead of built again in each.
+        
+        Args:
+            modes: Ranking modes to prepare; defaults to ranking_mode
+        """
+        snapshot = self._snapshot
+        for mode in modes or [self.ranking_mode]:
+            if mode == 'vector':
+                snapshot.term_matrix()
+            elif mode == 'dense':
+                snapshot.dense_index()
+
+    def _plan_query(self, snapshot: _Snapshot, query: str) -> QueryPlan:
+        """Compute everything about a query that does not depend on the entry."""
         query_lower = query.lower().strip()
         query_keywords = self._extract_keywords_enhanced(query)
         
         # Detect question intent
         question_intent = self._detect_question_intent(query)
+        expanded_keywords = self._expand_keywords_semantically(snapshot, query_keywords, question_intent)
         
-        results = []
+        return QueryPlan(
+            query=query_lower,
+            keywords=tuple(query_keywords),
+            intent=question_intent,
+            expanded_keywords=tuple(expanded_keywords),
+            intent_keywords=tuple(self.intent_keywords.get(question_intent, [])),
+            is_question=any(indicator in query_lower for indicator in self.question_indicators),
+            other_keywords=tuple(k for k in expanded_keywords if k not in snapshot.lexicon.terms)
+        )
+
+    def _build_result(self, snapshot: _Snapshot, key: Tuple, score: float, plan: QueryPlan) -> Dict[str, Any]:
+        """Build the search result dict for a scored entry."""
+        kind = key[0]
+        entry = snapshot.entry(key)
         
-        # Search documents with enhanced scoring
-        for doc_id, doc in self.knowledge_base['documents'].items():
-            score = self._calculate_enhanced_relevance_score(
-                query_lower, query_keywords, doc['content'], 
-                doc['keywords'], question_intent, doc['name']
+        if kind == 'document':
+            # Get more relevant excerpt
+            excerpt = self._extract_relevant_excerpt(
+                snapshot.lexicon, snapshot.search_entries[key], entry['content'], plan
             )
-            if score > 0:
-                # Get more relevant excerpt
-                excerpt = self._extract_relevant_excerpt(doc['content'], query_keywords, query_lower)
-                results.append({
-                    'type': 'document',
-                    'id': doc_id,
-                    'name': doc['name'],
-                    'content': excerpt,
-                    'score': score,
-                    'source': 'document'
-                })
-
-        # Search FAQs with enhanced matching
-        for category, faqs in self.knowledge_base['faqs'].items():
-            if isinstance(faqs, dict):
-                for faq_id, faq in faqs.items():
-                    if isinstance(faq, dict) and 'question' in faq and 'answer' in faq:
-                        score = self._calculate_enhanced_relevance_score(
-                            query_lower, query_keywords, 
-                            faq['question'] + ' ' + faq['answer'], 
-                            faq.get('keywords', []), question_intent, faq['question']
-                        )
-                        if score > 0:
-                            results.append({
-                                'type': 'faq',
-                                'id': faq_id,
-                                'category': category,
-                                'question': faq['question'],
-                                'answer': faq['answer'],
-                                'score': score,
-                                'source': 'faq'
-                            })
-
-        # Search locations with context awareness
-        for name, location in self.knowledge_base['locations'].items():
-            score = self._calculate_enhanced_relevance_score(
-                query_lower, query_keywords, 
-                name + ' ' + location['address'], 
-                ['location', 'address', 'where'], question_intent, name
-            )
-            if score > 0:
-                results.append({
-                    'type': 'location',
-                    'id': name,
-                    'name': name,
-                    'address': location['address'],
-                    'score': score,
-                    'source': 'location'
-                })
-
-        # Search schedules
-        for schedule_id, schedule in self.knowledge_base['schedules'].items():
-            score = self._calculate_enhanced_relevance_score(
-                query_lower, query_keywords, 
-                schedule['name'] + ' ' + schedule['date'] + ' ' + schedule['time'], 
-                ['schedule', 'time', 'date'], question_intent, schedule['name']
-            )
-            if score > 0:
-                results.append({
-                    'type': 'schedule',
-                    'id': schedule_id,
-                    'name': schedule['name'],
-                    'date': schedule['date'],
-                    'time': schedule['time'],
-                    'score': score,
-                    'source': 'schedule'
-                })
-
-        # Sort by relevance score
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results[:max_results]
+            return {
+                'type': 'document',
+                'id': key[1],
+                'name': entry['name'],
+                'content': excerpt,
+                'score': score,
+                'source': 'document'
+            }
+        elif kind == 'faq':
+            return {
+                'type': 'faq',
+                'id': key[2],
+                'category': key[1],
+                'question': entry['question'],
+                'answer': entry['answer'],
+                'score': score,
+                'source': 'faq'
+            }
+        elif kind == 'location':
+            return {
+                'type': 'location',
+                'id': key[1],
+                'name': key[1],
+                'address': entry['address'],
+                'score': score,
+                'source': 'location'
+            }
+        else:
+            return {
+                'type': 'schedule',
+                'id': key[1],
+                'name': entry['name'],
+                'date': entry['date'],
+                'time': entry['time'],
+                'score': score,
+                'source': 'schedule'
+            }
 
     def _detect_question_intent(self, query: str) -> str:
         """Detect the intent of the question for better matching."""
-        query_lower = query.lower()
-        
-        for intent, patterns in self.question_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, query_lower):
-                    return intent
+        return self.question_classifier.classify(query.lower())
+
+    def detect_question_intents(self, queries: List[str]) -> List[str]:
+        """
+        Detect the intent of many questions at once.
         
-        return 'general'
+        Args:
+            queries: Questions to classify
+            
+        Returns:
+            Intent of each question, in input order
+        """
+        return self.question_classifier.classify_many(query.lower() for query in queries)
 
     def _extract_keywords_enhanced(self, text: str) -> List[str]:
         """Enhanced keyword extraction for Chinese text."""
@@ -335,17 +1130,16 @@ class KnowledgeBase:
         
         return list(set(keywords))
 
-    def _calculate_enhanced_relevance_score(self, query: str, query_keywords: List[str], 
-                                         content: str, content_keywords: List[str], 
-                                         question_intent: str, title: str = "") -> float:
+    def _calculate_enhanced_relevance_score(self, plan: QueryPlan, entry: SearchEntry) -> float:
         """Enhanced relevance scoring with semantic understanding."""
-        content_lower = content.lower()
-        title_lower = title.lower()
+        content_lower = entry.text
+        title_lower = entry.title
+        query_keywords = plan.keywords
         
         total_score = 0.0
         
         # 1. Exact phrase match (highest priority)
-        if query in content_lower:
+        if plan.query in content_lower:
             total_score += 2.0
         
         # 2. Title relevance
@@ -353,112 +1147,89 @@ class KnowledgeBase:
             total_score += 1.5
         
         # 3. Keyword matching with semantic expansion
-        expanded_keywords = self._expand_keywords_semantically(query_keywords, question_intent)
-        keyword_matches = sum(1 for keyword in expanded_keywords if keyword in content_lower)
+        expanded_keywords = plan.expanded_keywords
         if expanded_keywords:
+            # Lexicon terms were found by the automaton at index time
+            keyword_matches = len(entry.text_terms.intersection(expanded_keywords))
+            keyword_matches += sum(1 for keyword in plan.other_keywords if keyword in content_lower)
             total_score += (keyword_matches / len(expanded_keywords)) * 1.2
         
         # 4. Intent-based scoring
-        intent_score = self._calculate_intent_score(question_intent, content_lower, title_lower)
+        intent_score = self._calculate_intent_score(plan, entry)
         total_score += intent_score
         
         # 5. Content keyword overlap
+        content_keywords = entry.keywords
         if content_keywords:
-            content_matches = sum(1 for keyword in content_keywords if any(qk in keyword.lower() for qk in query_keywords))
+            content_matches = sum(1 for keyword in content_keywords if any(qk in keyword for qk in query_keywords))
             total_score += (content_matches / len(content_keywords)) * 0.8
         
         # 6. Question pattern matching
-        pattern_score = self._calculate_pattern_score(query, content_lower)
+        pattern_score = self._calculate_pattern_score(plan, entry)
         total_score += pattern_score
         
         return min(total_score, 3.0)  # Cap at 3.0
 
-    def _expand_keywords_semantically(self, keywords: List[str], intent: str) -> List[str]:
+    def _expand_keywords_semantically(self, snapshot: _Snapshot, keywords: List[str], intent: str) -> List[str]:
         """Expand keywords based on semantic mappings."""
-        expanded = set(keywords)
-        
-        for keyword in keywords:
-            for semantic_key, related_words in self.semantic_mappings.items():
-                if keyword in related_words:
-                    expanded.update(related_words)
-        
-        # Add intent-specific keywords
-        if intent in ['location_question', 'address_question']:
-            expanded.update(self.semantic_mappings.get('location', []))
-        elif intent in ['time_question']:
-            expanded.update(self.semantic_mappings.get('time', []))
-        elif intent in ['behavior_question']:
-            expanded.update(self.semantic_mappings.get('behavior', []))
-        elif intent in ['accommodation_question']:
-            expanded.update(self.semantic_mappings.get('accommodation', []))
-        elif intent in ['activity_question']:
-            expanded.update(self.semantic_mappings.get('activity', []))
-        elif intent in ['mailing_question']:
-            expanded.update(self.semantic_mappings.get('mailing', []))
-        
-        return list(expanded)
-
-    def _calculate_intent_score(self, intent: str, content: str, title: str) -> float:
+        return list(snapshot.lexicon.expand(frozenset(keywords), intent))
+
+    def _calculate_intent_score(self, plan: QueryPlan, entry: SearchEntry) -> float:
         """Calculate score based on question intent."""
-        intent_keywords = {
-            'location_question': ['地址', '地点', '位置', '校园', '学校', '举办', '浦东', '上海', '申启路'],
-            'time_question': ['时间', '日期', '7月', '8月', '开始', '结束', '报到', '签到', '13:30', '18:00'],
-            'behavior_question': ['行为', '不当', '守则', '规则', '违规', '性骚扰', '歧视', '威胁'],
-            'accommodation_question': ['床垫', '住宿', '床上用品', '枕头', '被子', '105', '198'],
-            'activity_question': ['晚间活动', '参与', '参加', '出席', '21:40', '22:00'],
-            'mailing_question': ['邮寄', '快递', '寄送', '7月25', '门卫', '唯理']
-        }
-        
-        if intent in intent_keywords:
-            keywords = intent_keywords[intent]
-            matches = sum(1 for keyword in keywords if keyword in content or keyword in title)
+        keywords = plan.intent_keywords
+        if keywords:
+            matches = sum(1 for keyword in keywords
+                          if keyword in entry.text_terms or keyword in entry.title_terms)
             return (matches / len(keywords)) * 0.8
         
         return 0.0
 
-    def _calculate_pattern_score(self, query: str, content: str) -> float:
+    def _calculate_pattern_score(self, plan: QueryPlan, entry: SearchEntry) -> float:
         """Calculate score based on question patterns."""
-        # Chinese question patterns
-        question_indicators = ['什么', '哪里', '怎么', '如何', '可以', '需要', '应该']
-        query_has_question = any(indicator in query for indicator in question_indicators)
-        
-        if query_has_question:
+        if plan.is_question:
             # Look for answer patterns in content
-            answer_patterns = ['是', '在', '于', '需要', '可以', '应该', '建议']
-            answer_matches = sum(1 for pattern in answer_patterns if pattern in content)
+            answer_matches = sum(1 for pattern in self.answer_patterns if pattern in entry.text_terms)
             return min(answer_matches * 0.1, 0.3)
         
         return 0.0
 
-    def _extract_relevant_excerpt(self, content: str, keywords: List[str], query: str) -> str:
-        """Extract the most relevant excerpt from content."""
-        sentences = re.split(r'[。！？\n]', content)
+    def _extract_relevant_excerpt(self, lexicon: _Lexicon, entry: SearchEntry, content: str,
+                                  plan: QueryPlan) -> str:
+        """
+        Extract the most relevant excerpt from a document.
         
-        best_sentence = ""
+        Ranks the passages split at ingest and returns the best one
+        together with its neighbouring passages as context.
+        """
+        passages = entry.passages
+        
+        best_index = -1
         best_score = 0
         
-        for sentence in sentences:
-            if len(sentence.strip()) < 10:
+        for i, passage in enumerate(passages):
+            if len(passage.text) <= 20:
                 continue
-                
-            sentence_lower = sentence.lower()
+            
             score = 0
             
             # Direct query match
-            if query in sentence_lower:
+            if plan.query in passage.text:
                 score += 10
             
             # Keyword matches
-            keyword_matches = sum(1 for keyword in keywords if keyword in sentence_lower)
-            score += keyword_matches
+            score += sum(1 for keyword in plan.keywords
+                         if keyword in passage.terms
+                         or (keyword not in lexicon.terms and keyword in passage.text))
             
-            if score > best_score and len(sentence.strip()) > 20:
+            if score > best_score:
                 best_score = score
-                best_sentence = sentence.strip()
+                best_index = i
         
-        if best_sentence:
-            # Return the best sentence plus some context
-            return best_sentence + (content[content.find(best_sentence):content.find(best_sentence)+300] if len(content) > content.find(best_sentence)+300 else "")
+        if best_index >= 0:
+            # Return the best passage plus its neighbours
+            start = passages[max(best_index - 1, 0)].start
+            end = passages[min(best_index + 1, len(passages) - 1)].end
+            return content[start:end]
         
         # Fallback to beginning of content
         return content[:300] + '...' if len(content) > 300 else content
@@ -481,10 +1252,13 @@ class KnowledgeBase:
 
     def get_statistics(self) -> Dict[str, Any]:
         """Get knowledge base statistics."""
+        snapshot = self._snapshot
         return {
-            'documents': len(self.knowledge_base['documents']),
-            'faqs': sum(len(faqs) for faqs in self.knowledge_base['faqs'].values()),
-            'locations': len(self.knowledge_base['locations']),
-            'schedules': len(self.knowledge_base['schedules']),
-            'last_updated': self.knowledge_base['metadata'].get('last_updated', 'Unknown')
+            'documents': len(snapshot.data['documents']),
+            'faqs': sum(len(faqs) for faqs in snapshot.data['faqs'].values()),
+            'locations': len(snapshot.data['locations']),
+            'schedules': len(snapshot.data['schedules']),
+            'last_updated': snapshot.last_updated or 'Unknown',
+            'version': snapshot.version,
+            'search_cache': self.search_cache.stats()
         } 
\ No newline at end of file
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+LLM Client Management for Summer School Chatbot
+
+This module calls the LLM providers through their SDKs, blocking or with
+their async clients, keeps one long-lived client per provider, so their
+HTTP keep-alive connections are reused across requests, and provides the
+circuit breaker that stops calling a provider while it is failing.
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Provider SDKs are optional; a provider can be used once its SDK is installed
+try:
+    import openai
+except ImportError:
+    openai = None
+
+try:
+    import anthropic
+except ImportError:
+    anthropic = None
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
+
+logger = logging.getLogger(__name__)
+
+# Model used per provider unless <PROVIDER>_MODEL is set, e.g. OPENAI_MODEL
+DEFAULT_MODELS = {
+    'openai': 'gpt-4o',
+    'anthropic': 'claude-3-5-sonnet-latest',
+    'google_ai': 'gemini-1.5-flash'
+}
+
+API_KEY_VARIABLES = {
+    'openai': 'OPENAI_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+    'google_ai': 'GOOGLE_AI_API_KEY'
+}
+
+
+def provider_supported(provider: str) -> bool:
+    """Check whether LLMClient can call a provider, i.e. its SDK is installed."""
+    sdks = {'openai': openai, 'anthropic': anthropic, 'google_ai': genai}
+    return sdks.get(provider) is not None
+
+
+class LLMClient:
+    """
+    One provider's SDK clients and the requests the chatbot makes.
+
+    The blocking client is shared by all threads. Async clients hold
+    connections bound to an event loop, so one is kept per loop. Both are
+    created with the client's timeout and without SDK retries; the router
+    decides when to try another provider.
+    """
+
+    def __init__(self, provider: str, timeout: Optional[float] = None,
+                 model: Optional[str] = None, max_tokens: int = 1000):
+        """
+        Initialize the client.
+
+        Args:
+            provider: Provider name (openai, anthropic, google_ai)
+            timeout: Seconds before a request is abandoned
+            model: Model name; defaults to <PROVIDER>_MODEL or DEFAULT_MODELS
+            max_tokens: Longest response, for providers that require a limit
+        """
+        if provider not in DEFAULT_MODELS:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        if not provider_supported(provider):
+            raise ImportError(f"The SDK for LLM provider {provider} is not installed")
+        self.provider = provider
+        self.timeout = timeout
+        self.model = model or os.getenv(f'{provider.upper()}_MODEL', DEFAULT_MODELS[provider])
+        self.max_tokens = max_tokens
+        self.api_key = os.getenv(API_KEY_VARIABLES[provider])
+        self._client = None
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _sdk_options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {'api_key': self.api_key, 'max_retries': 0}
+        if self.timeout:
+            options['timeout'] = self.timeout
+        return options
+
+    def _create(self, async_client: bool) -> Any:
+        if self.provider == 'openai':
+            return (openai.AsyncOpenAI if async_client else openai.OpenAI)(**self._sdk_options())
+        if self.provider == 'anthropic':
+            return (anthropic.AsyncAnthropic if async_client else anthropic.Anthropic)(**self._sdk_options())
+        # The Gemini model object serves both blocking and async requests
+        genai.configure(api_key=self.api_key)
+        return genai.GenerativeModel(self.model)
+
+    @property
+    def client(self) -> Any:
+        """The blocking SDK client, created on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._create(async_client=False)
+        return self._client
+
+    @property
+    def async_client(self) -> Any:
+        """The async SDK client of the running event loop, created on first use."""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._async_clients[loop] = self._create(async_client=True)
+        return client
+
+    def close(self) -> None:
+        """
+        Close the SDK clients' connection pools.
+
+        Async clients are closed on their own event loop, once it runs
+        again; clients of a closed loop are just dropped.
+        """
+        with self._lock:
+            client, self._client = self._client, None
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+        if client is not None and hasattr(client, 'close'):
+            client.close()
+        for loop, async_client in async_clients:
+            if not hasattr(async_client, 'close') or loop.is_closed():
+                continue
+            closing = async_client.close()
+            try:
+                asyncio.run_coroutine_threadsafe(closing, loop)
+            except RuntimeError:
+                # The loop closed meanwhile
+                closing.close()
+
+    def _request_options(self, timeout: Optional[float]) -> Dict[str, Any]:
+        timeout = timeout or self.timeout
+        if not timeout:
+            return {}
+        if self.provider == 'google_ai':
+            return {'request_options': {'timeout': timeout}}
+        return {'timeout': timeout}
+
+    def _messages(self, prompt: str) -> Dict[str, Any]:
+        messages = {'model': self.model, 'messages': [{'role': 'user', 'content': prompt}]}
+        if self.provider == 'anthropic':
+            messages['max_tokens'] = self.max_tokens
+        return messages
+
+    def _text(self, response: Any) -> Optional[str]:
+        """Extract the answer text of a provider response."""
+        if self.provider == 'openai':
+            return response.choices[0].message.content
+        if self.provider == 'anthropic':
+            return ''.join(block.text for block in response.content if block.type == 'text')
+        return response.text
+
+    def complete(self, prompt: str, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Get the response to a prompt, blocking until it arrives.
+
+        Args:
+            prompt: Prompt text
+            timeout: Seconds before the request is abandoned; defaults to
+                the client's timeout
+
+        Returns:
+            The response text
+        """
+        options = self._request_options(timeout)
+        if self.provider == 'openai':
+            response = self.client.chat.completions.create(**self._messages(prompt), **options)
+        elif self.provider == 'anthropic':
+            response = self.client.messages.create(**self._messages(prompt), **options)
+        else:
+            response = self.client.generate_content(prompt, **options)
+        return self._text(response)
+
+    async def acomplete(self, prompt: str, timeout: Optional[float] = None) -> Optional[str]:
+        """Asynchronous version of complete(); no thread is held while waiting."""
+        options = self._request_options(timeout)
+        if self.provider == 'openai':
+            response = await self.async_client.chat.completions.create(**self._messages(prompt), **options)
+        elif self.provider == 'anthropic':
+            response = await self.async_client.messages.create(**self._messages(prompt), **options)
+        else:
+            response = await self.async_client.generate_content_async(prompt, **options)
+        return self._text(response)
+
+    def stream(self, prompt: str, timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Get the response to a prompt piece by piece, as the provider writes it.
+
+        Args:
+            prompt: Prompt text
+            timeout: Seconds to wait for each piece; defaults to the
+                client's timeout
+
+        Yields:
+            Response text fragments
+        """
+        options = self._request_options(timeout)
+        if self.provider == 'openai':
+            with self.client.chat.completions.create(**self._messages(prompt), stream=True, **options) as chunks:
+                for chunk in chunks:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        elif self.provider == 'anthropic':
+            with self.client.messages.stream(**self._messages(prompt), **options) as chunks:
+                yield from chunks.text_stream
+        else:
+            for chunk in self.client.generate_content(prompt, stream=True, **options):
+                if chunk.text:
+                    yield chunk.text
+
+
+class ClientPool:
+    """
+    Lazily created, shared clients keyed by provider.
+
+    Provider SDK clients (OpenAI, Anthropic, ...) hold an HTTP connection
+    pool; creating one per request throws the connections away. Clients
+    are created with the pool's timeout, applied at the HTTP layer, so a
+    hung request is abandoned rather than left running.
+    """
+
+    def __init__(self, factory: Callable[[str, Optional[float]], Any], timeout: Optional[float] = None):
+        """
+        Initialize the pool.
+
+        Args:
+            factory: Creates the client for a provider name and timeout,
+                e.g. LLMClient
+            timeout: Per-request timeout in seconds of new clients
+        """
+        self.factory = factory
+        self.timeout = timeout
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+
+    def get(self, provider: str) -> Any:
+        """Return the client for a provider, creating it on first use."""
+        client = self._clients.get(provider)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None:
+                client = self._clients[provider] = self.factory(provider, self.timeout)
+                self.created += 1
+                logger.info(f"Created LLM client for {provider}")
+            return client
+
+    def reset(self, provider: str) -> None:
+        """Drop a provider's client so the next request creates a fresh one, and close the old one."""
+        with self._lock:
+            client = self._clients.pop(provider, None)
+        if client is not None and hasattr(client, 'close'):
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning(f"Error closing LLM client for {provider}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'providers': sorted(self._clients),
+            'clients_created': self.created
+        }
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed: requests flow. After failure_threshold consecutive failures (or
+    timeouts) it opens and rejects requests for reset_timeout seconds; then
+    it is half-open and lets a single trial request through, closing again
+    if it succeeds and reopening if it fails.
+
+    allow_request() returns a permit, which release() takes back: only the
+    trial request's permit ends the trial.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 on_open: Optional[Callable[[], None]] = None):
+        """
+        Initialize the breaker.
+
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds to stay open before a trial request
+            on_open: Called whenever the circuit opens
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_open = on_open
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        # Permit of the running half-open trial request, if any
+        self._trial: Optional[object] = None
+        self._lock = threading.Lock()
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def available(self) -> bool:
+        """Check whether a request could be let through now, without claiming it."""
+        with self._lock:
+            state = self._current_state()
+            return state == self.CLOSED or (state == self.HALF_OPEN and self._trial is None)
+
+    def allow_request(self) -> Optional[object]:
+        """
+        Claim permission for a request; in half-open state only one is allowed.
+
+        Returns:
+            A permit to hand back to release() if the request is abandoned,
+            or None if the request is not allowed
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return object()
+            if state == self.HALF_OPEN and self._trial is None:
+                self._trial = object()
+                return self._trial
+            return None
+
+    def release(self, permit: Optional[object]) -> None:
+        """Give back a claimed request that was abandoned without an outcome."""
+        with self._lock:
+            if permit is not None and permit is self._trial:
+                self._trial = None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._trial = None
+            if self._state != self.CLOSED:
+                logger.info("Circuit closed after a successful trial request")
+            self._state = self.CLOSED
+
+    def record_failure(self) -> None:
+        opened = False
+        with self._lock:
+            self._failures += 1
+            state = self._current_state()
+            if state == self.HALF_OPEN or (state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.trips += 1
+                opened = True
+            self._trial = None
+        if opened and self.on_open:
+            self.on_open()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            state = self._current_state()
+            retry_in = None
+            if state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'trips': self.trips,
+                'retry_in': retry_in
+            }
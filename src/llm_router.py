@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+LLM Provider Router for Summer School Chatbot
+
+This module routes LLM requests across the configured providers: the
+provider with the best recent latency is tried first, and when it has not
+answered within its usual (p95) latency a hedge request is sent to the next
+provider, taking whichever answer arrives first.
+"""
+
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, Iterator, List, Optional
+
+from llm_client import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# A provider takes a prompt and a timeout keyword (seconds) and returns the
+# response text (or None); it should give up on the request by the timeout
+Provider = Callable[..., Optional[str]]
+AsyncProvider = Callable[..., Awaitable[Optional[str]]]
+StreamProvider = Callable[..., Iterable[str]]
+
+
+class LatencyTracker:
+    """Rolling window of one provider's request latencies and outcomes."""
+
+    def __init__(self, window: int = 100):
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, latency: float, ok: bool) -> None:
+        """Record a finished request; only successful ones count toward latency."""
+        with self._lock:
+            self.requests += 1
+            self._outcomes.append(ok)
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-th percentile latency (0-100), or None without samples."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        rank = max(0, math.ceil(q / 100 * len(latencies)) - 1)
+        return latencies[rank]
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            outcomes = list(self._outcomes)
+        return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': self.error_rate,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95)
+        }
+
+
+class _Attempt:
+    """One provider request of a routed query."""
+
+    __slots__ = ('name', 'permit', 'submitted', 'started')
+
+    def __init__(self, name: str, permit: object):
+        self.name = name
+        # The circuit breaker's permit, given back if the request is abandoned
+        self.permit = permit
+        self.submitted = time.monotonic()
+        # Set once the request leaves the local executor's queue
+        self.started: Optional[float] = None
+
+    def deadline(self, timeout: float) -> float:
+        """Time by which the request must be answered, or must have started."""
+        return (self.started or self.submitted) + timeout
+
+
+class ProviderRouter:
+    """
+    Hedged, latency-ranked LLM requests over several providers.
+
+    Providers are ranked by their rolling p95 latency once each has
+    min_samples successful requests (until then, in configured order), and
+    providers failing more than half their recent requests go last. A
+    request goes to the first provider; if it has not answered after its
+    p95 latency (clamped to [min_hedge_delay, timeout]) or fails, the next
+    provider is asked too, and the first non-empty answer wins.
+
+    Each provider has a circuit breaker: after failure_threshold consecutive
+    failures or timeouts it is skipped until reset_timeout has passed, and
+    when every breaker is open requests fail immediately.
+
+    Providers are called with their timeout, so a hung request ends by
+    itself and frees its thread; the router stops waiting at the same
+    deadline either way.
+
+    stream() is not hedged: a provider that fails before its first chunk
+    is replaced by the next one, but once text has been delivered it
+    cannot be taken back.
+
+    A provider's timeout runs from when its request starts. Requests to
+    providers without an async call wait for a thread of the router's
+    executor; one still waiting when its timeout has passed is dropped
+    without counting against the provider, which was never asked.
+    """
+
+    def __init__(self, providers: Dict[str, Provider],
+                 async_providers: Optional[Dict[str, AsyncProvider]] = None,
+                 stream_providers: Optional[Dict[str, StreamProvider]] = None,
+                 timeout: float = 30.0,
+                 timeouts: Optional[Dict[str, float]] = None,
+                 hedge_percentile: float = 95,
+                 default_hedge_delay: float = 2.0,
+                 min_hedge_delay: float = 0.5,
+                 min_samples: int = 5,
+                 max_workers: int = 32,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 on_open: Optional[Callable[[str], None]] = None):
+        """
+        Initialize the router.
+
+        Args:
+            providers: Provider name to blocking call, in preference order
+            async_providers: Optional provider name to coroutine function,
+                used by aquery() instead of running providers in threads
+            stream_providers: Optional provider name to function yielding
+                the response in fragments, used by stream()
+            timeout: Seconds to wait for a provider before giving up on it
+            timeouts: Per-provider overrides of timeout
+            hedge_percentile: Latency percentile after which to hedge
+            default_hedge_delay: Hedge delay for providers without samples
+            min_hedge_delay: Lower bound of the hedge delay
+            min_samples: Successful requests before latency ranking applies
+            max_workers: Threads for concurrent provider calls
+            failure_threshold: Consecutive failures that open a provider's
+                circuit breaker
+            reset_timeout: Seconds before an open breaker allows a trial
+            on_open: Called with the provider name when its breaker opens
+        """
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = dict(providers)
+        self.async_providers = dict(async_providers or {})
+        self.stream_providers = dict(stream_providers or {})
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.latency = {name: LatencyTracker() for name in self.providers}
+        self.breakers = {
+            name: CircuitBreaker(
+                failure_threshold, reset_timeout,
+                on_open=(lambda name=name: on_open(name)) if on_open else None
+            )
+            for name in self.providers
+        }
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+
+    def ranked(self) -> List[str]:
+        """Return the names of providers whose breaker lets requests through, the one to try first first."""
+        order = list(self.providers)
+        measured = all(self.latency[name].samples >= self.min_samples for name in order)
+        available = [name for name in order if self.breakers[name].available()]
+
+        def rank(name: str):
+            tracker = self.latency[name]
+            p95 = tracker.percentile(self.hedge_percentile) if measured else 0.0
+            return (tracker.error_rate > 0.5, p95, order.index(name))
+
+        return sorted(available, key=rank)
+
+    def available(self) -> bool:
+        """Check whether any provider's circuit breaker would let a request through."""
+        return any(breaker.available() for breaker in self.breakers.values())
+
+    def _record_outcome(self, name: str, ok: bool) -> None:
+        if ok:
+            self.breakers[name].record_success()
+        else:
+            self.breakers[name].record_failure()
+
+    def primary(self) -> Optional[str]:
+        """Return the provider currently tried first, or None while every circuit is open."""
+        ranked = self.ranked()
+        return ranked[0] if ranked else None
+
+    def hedge_delay(self, name: str) -> float:
+        """Seconds to wait for a provider before hedging."""
+        p95 = self.latency[name].percentile(self.hedge_percentile)
+        if p95 is None or self.latency[name].samples < self.min_samples:
+            p95 = self.default_hedge_delay
+        return min(max(p95, self.min_hedge_delay), self._timeout(name))
+
+    def _timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.timeout)
+
+    def _call(self, name: str, prompt: str, attempt: Optional[_Attempt] = None) -> Optional[str]:
+        """Call a provider, recording its latency and outcome."""
+        started = time.monotonic()
+        if attempt is not None:
+            attempt.started = started
+        try:
+            response = self.providers[name](prompt, timeout=self._timeout(name))
+        except Exception:
+            self.latency[name].record(time.monotonic() - started, False)
+            raise
+        self.latency[name].record(time.monotonic() - started, bool(response))
+        return response
+
+    def query(self, prompt: str) -> Optional[str]:
+        """
+        Get a response for a prompt, hedging across providers.
+
+        Returns:
+            The first non-empty response, or None if every provider tried
+            failed or timed out
+        """
+        candidates = self.ranked()
+        pending: Dict[Future, _Attempt] = {}
+        launched = 0
+
+        def launch() -> bool:
+            nonlocal launched
+            while candidates:
+                name = candidates.pop(0)
+                permit = self.breakers[name].allow_request()
+                if permit is None:
+                    continue
+                attempt = _Attempt(name, permit)
+                pending[self._executor.submit(self._call, name, prompt, attempt)] = attempt
+                launched += 1
+                if launched > 1:
+                    self.hedges += 1
+                    logger.info(f"Hedging LLM request to {name}")
+                return True
+            return False
+
+        if not launch():
+            logger.warning("All LLM providers are unavailable (circuit open)")
+            return None
+        primary = next(iter(pending))
+        hedge_at = time.monotonic() + self.hedge_delay(pending[primary].name)
+
+        try:
+            return self._wait_for_response(pending, candidates, launch, primary, hedge_at)
+        finally:
+            for future, attempt in pending.items():
+                if future.cancel():
+                    # Still queued; the provider was never asked
+                    self.breakers[attempt.name].release(attempt.permit)
+                else:
+                    # Requests still running report to their breaker when they finish
+                    future.add_done_callback(
+                        lambda f, name=attempt.name: self._record_outcome(name, not f.exception() and bool(f.result()))
+                    )
+
+    def _wait_for_response(self, pending: Dict[Future, _Attempt], candidates: List[str],
+                           launch: Callable[[], bool], primary: Future, hedge_at: float) -> Optional[str]:
+        """Wait for the first good response, hedging and enforcing deadlines."""
+        while pending:
+            now = time.monotonic()
+            next_deadline = min(attempt.deadline(self._timeout(attempt.name)) for attempt in pending.values())
+            wake = min(next_deadline, hedge_at) if candidates else next_deadline
+            done, _ = wait(list(pending), timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = pending.pop(future).name
+                try:
+                    response = future.result()
+                except Exception as e:
+                    logger.warning(f"LLM provider {name} failed: {e}")
+                    response = None
+                self._record_outcome(name, bool(response))
+                if response:
+                    if future is not primary:
+                        self.hedge_wins += 1
+                    return response
+                # A failed provider is replaced right away
+                if candidates and not pending:
+                    launch()
+
+            now = time.monotonic()
+            for future, attempt in list(pending.items()):
+                if attempt.deadline(self._timeout(attempt.name)) > now:
+                    continue
+                if attempt.started is None:
+                    # If it started just now, its deadline counts from then
+                    if future.cancel():
+                        del pending[future]
+                        logger.warning(f"LLM request to {attempt.name} dropped: no free worker thread")
+                        self.breakers[attempt.name].release(attempt.permit)
+                    continue
+                del pending[future]
+                logger.warning(f"LLM provider {attempt.name} timed out")
+                self._record_outcome(attempt.name, False)
+            if candidates and (now >= hedge_at or not pending):
+                launch()
+                hedge_at = float('inf')
+
+        return None
+
+    async def _acall(self, name: str, prompt: str, attempt: _Attempt) -> Optional[str]:
+        """Async counterpart of _call()."""
+        if name not in self.async_providers:
+            # Blocking providers run in the executor, where _call() records them
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, name, prompt, attempt)
+
+        started = attempt.started = time.monotonic()
+        try:
+            response = await self.async_providers[name](prompt, timeout=self._timeout(name))
+        except asyncio.CancelledError:
+            # Cancelled requests are recorded by aquery()
+            raise
+        except Exception:
+            self.latency[name].record(time.monotonic() - started, False)
+            raise
+        self.latency[name].record(time.monotonic() - started, bool(response))
+        return response
+
+    async def aquery(self, prompt: str) -> Optional[str]:
+        """Asynchronous version of query()."""
+        candidates = self.ranked()
+        pending: Dict[asyncio.Task, _Attempt] = {}
+        launched = 0
+        loop = asyncio.get_running_loop()
+
+        def launch() -> bool:
+            nonlocal launched
+            while candidates:
+                name = candidates.pop(0)
+                permit = self.breakers[name].allow_request()
+                if permit is None:
+                    continue
+                attempt = _Attempt(name, permit)
+                pending[loop.create_task(self._acall(name, prompt, attempt))] = attempt
+                launched += 1
+                if launched > 1:
+                    self.hedges += 1
+                    logger.info(f"Hedging LLM request to {name}")
+                return True
+            return False
+
+        if not launch():
+            logger.warning("All LLM providers are unavailable (circuit open)")
+            return None
+        primary = next(iter(pending))
+        hedge_at = time.monotonic() + self.hedge_delay(pending[primary].name)
+
+        try:
+            while pending:
+                next_deadline = min(attempt.deadline(self._timeout(attempt.name)) for attempt in pending.values())
+                wake = min(next_deadline, hedge_at) if candidates else next_deadline
+                done, _ = await asyncio.wait(
+                    list(pending), timeout=max(0.0, wake - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    name = pending.pop(task).name
+                    try:
+                        response = task.result()
+                    except Exception as e:
+                        logger.warning(f"LLM provider {name} failed: {e}")
+                        response = None
+                    self._record_outcome(name, bool(response))
+                    if response:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return response
+                    if candidates and not pending:
+                        launch()
+
+                now = time.monotonic()
+                for task, attempt in list(pending.items()):
+                    if attempt.deadline(self._timeout(attempt.name)) > now:
+                        continue
+                    del pending[task]
+                    task.cancel()
+                    if attempt.started is None:
+                        # Cancelling the task drops it from the executor's queue
+                        logger.warning(f"LLM request to {attempt.name} dropped: no free worker thread")
+                        self.breakers[attempt.name].release(attempt.permit)
+                        continue
+                    logger.warning(f"LLM provider {attempt.name} timed out")
+                    if attempt.name in self.async_providers:
+                        # Blocking calls are recorded by _call() when they end
+                        self.latency[attempt.name].record(self._timeout(attempt.name), False)
+                    self._record_outcome(attempt.name, False)
+                if candidates and (now >= hedge_at or not pending):
+                    launch()
+                    hedge_at = float('inf')
+
+            return None
+        finally:
+            # Losing requests are no longer needed; cancelled before they
+            # finished, they say nothing about the provider's latency or health
+            for task, attempt in pending.items():
+                task.cancel()
+                self.breakers[attempt.name].release(attempt.permit)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """
+        Stream a response for a prompt from the first available provider.
+
+        Providers without a stream call answer in one fragment. A provider
+        failing before its first fragment is replaced by the next one; a
+        failure after it is raised.
+
+        Yields:
+            Response text fragments; none if every provider tried failed
+        """
+        for name in self.ranked():
+            permit = self.breakers[name].allow_request()
+            if permit is None:
+                continue
+            started = time.monotonic()
+            chunks: Optional[Iterable[str]] = None
+            produced = False
+            ok: Optional[bool] = None
+            try:
+                if name in self.stream_providers:
+                    chunks = self.stream_providers[name](prompt, timeout=self._timeout(name))
+                else:
+                    chunks = [self.providers[name](prompt, timeout=self._timeout(name))]
+                for chunk in chunks:
+                    if chunk:
+                        produced = True
+                        yield chunk
+                ok = produced
+            except Exception as e:
+                ok = False
+                logger.warning(f"LLM provider {name} failed: {e}")
+                if produced:
+                    raise
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
+                if ok is None:
+                    # The reader stopped; that says nothing about the provider
+                    self.breakers[name].release(permit)
+                else:
+                    self.latency[name].record(time.monotonic() - started, ok)
+                    self._record_outcome(name, ok)
+            if ok:
+                return
+        logger.warning("No LLM provider could stream a response")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-provider latency stats and hedging counters."""
+        return {
+            'ranking': self.ranked(),
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'providers': {name: tracker.stats() for name, tracker in self.latency.items()},
+            'circuit_breakers': {name: breaker.stats() for name, breaker in self.breakers.items()}
+        }
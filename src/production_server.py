@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+唯理书院聊天机器人生产环境服务器
+
+Serves web_api.app with gunicorn: worker processes, each with a pool of
+threads. The chatbot and its search indexes are loaded once in the master
+process before the workers are forked, so the workers share that memory
+copy-on-write. Each worker then reloads the knowledge base file if it
+changed since, and picks up updates saved by the other workers.
+
+Conversations and background answers are kept per process unless
+SHARED_STATE_PATH names a SQLite file for them; without it one worker
+is started by default, as a request may reach any worker.
+
+Graceful restarts:
+    kill -HUP <master pid>    replace the workers, letting in-flight requests finish
+    kill -USR2 <master pid>   start a new master with new code, then
+    kill -QUIT <old pid>      stop the old one once the new one is up
+"""
+
+import gc
+import os
+import sys
+import logging
+from pathlib import Path
+from typing import Any, Dict
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    print("Warning: gunicorn not installed (not available on Windows).")
+    print("Run: pip install gunicorn")
+    raise
+
+# Add the parent directory to the path to import modules
+sys.path.append(str(Path(__file__).parent))
+
+import web_api
+
+logger = logging.getLogger(__name__)
+
+def get_server_options() -> Dict[str, Any]:
+    """从环境变量读取服务器配置"""
+    host = os.getenv('API_HOST', '0.0.0.0')
+    port = int(os.getenv('API_PORT', 5000))
+    
+    # Several workers need the state they all use kept in a shared file
+    default_workers = (os.cpu_count() or 1) if os.getenv('SHARED_STATE_PATH') else 1
+    workers = int(os.getenv('API_WORKERS', default_workers))
+    if workers > 1 and not os.getenv('SHARED_STATE_PATH'):
+        logger.warning("API_WORKERS > 1 without SHARED_STATE_PATH: conversation history and "
+                       "refine-mode answers are only found by the worker that created them")
+    
+    return {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        # Threads let a worker serve other requests while one waits for the LLM
+        'worker_class': 'gthread',
+        'threads': int(os.getenv('API_THREADS', 8)),
+        # Must exceed the longest LLM request (LLM_TIMEOUT, plus a hedge)
+        'timeout': int(os.getenv('API_WORKER_TIMEOUT', 120)),
+        'graceful_timeout': int(os.getenv('API_GRACEFUL_TIMEOUT', 30)),
+        'keepalive': 5,
+        # Recycle workers after this many requests (0 disables)
+        'max_requests': int(os.getenv('API_MAX_REQUESTS', 0)),
+        'max_requests_jitter': int(os.getenv('API_MAX_REQUESTS', 0)) // 10,
+        'pidfile': os.getenv('API_PID_FILE'),
+        'accesslog': '-',
+        'preload_app': True,
+        'post_fork': post_fork
+    }
+
+def post_fork(server, worker):
+    """在每个worker进程中重新打开继承的数据库连接，并重新加载已更新的知识库"""
+    if web_api.chatbot is not None:
+        web_api.chatbot.after_fork()
+
+class ChatbotApplication(BaseApplication):
+    """gunicorn application serving web_api.app."""
+    
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+    
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+    
+    def load(self):
+        # With preload_app this runs once, in the master before forking
+        if web_api.chatbot is None and not web_api.initialize_chatbot():
+            raise RuntimeError("聊天机器人初始化失败")
+        web_api.chatbot.warm_up()
+        
+        # Move everything loaded so far out of the garbage collector's view;
+        # collections in the workers would otherwise write to (and so copy)
+        # every page holding a preloaded object
+        gc.freeze()
+        return web_api.app
+
+def main():
+    """主函数"""
+    options = get_server_options()
+    
+    print("🚀 启动唯理书院智能助手 Web API (生产模式)")
+    print("=" * 50)
+    print(f"🌐 服务器地址: http://{options['bind']}")
+    print(f"⚙️  工作进程: {options['workers']} × {options['threads']} 线程")
+    print("🔄 平滑重启: kill -HUP <master pid>")
+    print("=" * 50)
+    
+    ChatbotApplication(options).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Ranking Models for Summer School Chatbot
+
+This module provides a CJK-aware tokenizer and a BM25 index used as an
+alternative to the knowledge base's heuristic relevance scorer.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+_TOKEN_RE = re.compile(r'[\u4e00-\u9fff]+|[a-z0-9]+')
+
+STOP_WORDS = frozenset({'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'})
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenize text into CJK unigrams and bigrams plus lowercased words.
+
+    Chinese is not whitespace-delimited, so every run of Han characters is
+    emitted as its single characters and overlapping character pairs.
+    Words in other scripts are kept whole, minus common stop words.
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall(text.lower()):
+        if '\u4e00' <= run[0] <= '\u9fff':
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        elif run not in STOP_WORDS:
+            tokens.append(run)
+    return tokens
+
+
+class BM25Index:
+    """
+    Okapi BM25 over precomputed term frequencies and document lengths.
+
+    Scores are reported normalized to [0, max_score] by dividing by the
+    query's upper bound (every term's idf times k1 + 1), so they can be
+    compared against the same thresholds as the heuristic scorer.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, max_score: float = 3.0):
+        self.k1 = k1
+        self.b = b
+        self.max_score = max_score
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._lengths: Dict[Hashable, int] = {}
+        self._terms: Dict[Hashable, Counter] = {}
+        self._total_length = 0
+        # Terms whose postings this index may modify, or None for all; the
+        # others are shared with the index this one was copied from
+        self._owned: Optional[Set[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def copy(self) -> "BM25Index":
+        """
+        Return a copy that can be modified without affecting this index.
+
+        Postings are shared and only copied when the copy first changes
+        them. This index must not be modified afterwards.
+        """
+        other = BM25Index(self.k1, self.b, self.max_score)
+        other._postings = dict(self._postings)
+        other._lengths = dict(self._lengths)
+        other._terms = dict(self._terms)
+        other._total_length = self._total_length
+        other._owned = set()
+        return other
+
+    def _writable_posting(self, term: str) -> Dict[Hashable, int]:
+        """Return the posting of a term, created or copied first if needed."""
+        posting = self._postings.get(term)
+        if posting is None:
+            posting = self._postings[term] = {}
+        elif self._owned is not None and term not in self._owned:
+            posting = self._postings[term] = dict(posting)
+        else:
+            return posting
+        if self._owned is not None:
+            self._owned.add(term)
+        return posting
+
+    def add(self, key: Hashable, text: str) -> None:
+        """Index (or re-index) an entry's text."""
+        self.remove(key)
+        terms = Counter(tokenize(text))
+        for term, tf in terms.items():
+            self._writable_posting(term)[key] = tf
+        length = sum(terms.values())
+        self._terms[key] = terms
+        self._lengths[key] = length
+        self._total_length += length
+
+    def remove(self, key: Hashable) -> None:
+        """Remove an entry if present."""
+        terms = self._terms.pop(key, None)
+        if terms is None:
+            return
+        for term in terms:
+            if term in self._postings:
+                posting = self._writable_posting(term)
+                posting.pop(key, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_length -= self._lengths.pop(key)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._postings.clear()
+        self._lengths.clear()
+        self._terms.clear()
+        self._total_length = 0
+        self._owned = None
+
+    def idf(self, term: str) -> float:
+        """Inverse document frequency of a term."""
+        df = len(self._postings.get(term, ()))
+        n = len(self._lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def score(self, query: str) -> Dict[Hashable, float]:
+        """
+        Score every entry containing at least one query term.
+
+        Args:
+            query: Query text, tokenized with the same tokenizer as entries
+
+        Returns:
+            Mapping of entry key to normalized BM25 score
+        """
+        return self.score_terms(tokenize(query))
+
+    def score_terms(self, terms: Iterable[str]) -> Dict[Hashable, float]:
+        """Score every entry containing at least one of the given terms."""
+        if not self._lengths:
+            return {}
+
+        k1, b = self.k1, self.b
+        avg_length = self._total_length / len(self._lengths) or 1.0
+        scores: Dict[Hashable, float] = {}
+        upper_bound = 0.0
+
+        for term, qtf in Counter(terms).items():
+            idf = self.idf(term)
+            upper_bound += qtf * idf * (k1 + 1)
+            for key, tf in self._postings.get(term, {}).items():
+                norm = k1 * (1 - b + b * self._lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + qtf * idf * tf * (k1 + 1) / (tf + norm)
+
+        if upper_bound <= 0:
+            return {}
+        factor = self.max_score / upper_bound
+        return {key: value * factor for key, value in scores.items()}
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Search Index for Summer School Chatbot
+
+This module provides the precomputed searchable form of knowledge base
+entries, the per-query search plan, and the inverted index used to narrow
+a query down to the entries worth scoring.
+"""
+
+from collections import defaultdict
+from typing import Dict, FrozenSet, Hashable, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+
+class Passage(NamedTuple):
+    """
+    Sentence-level chunk of a document, built once at ingest.
+
+    Attributes:
+        start: Offset of the first character in the document content
+        end: Offset just past the last character
+        text: Lowercased, stripped passage text
+        terms: Lexicon terms occurring in text
+    """
+    start: int
+    end: int
+    text: str
+    terms: FrozenSet[str]
+
+
+class SearchEntry(NamedTuple):
+    """
+    Searchable form of a knowledge base entry, built once on load or insert.
+
+    Attributes:
+        key: Index key of the entry
+        text: Lowercased text the scorer matches against
+        title: Lowercased title
+        keywords: Lowercased entry keywords, in their stored order
+        text_terms: Lexicon terms occurring in text
+        title_terms: Lexicon terms occurring in title
+        passages: Sentence chunks of a document's content, in order
+    """
+    key: Tuple
+    text: str
+    title: str
+    keywords: Tuple[str, ...]
+    text_terms: FrozenSet[str]
+    title_terms: FrozenSet[str]
+    passages: Tuple[Passage, ...] = ()
+
+    @property
+    def index_text(self) -> str:
+        """Text covering everything the scorer matches keywords against."""
+        return '\n'.join((self.title, self.text) + self.keywords)
+
+    @property
+    def terms(self) -> FrozenSet[str]:
+        """Entry keywords plus the lexicon terms found in text and title."""
+        return frozenset(self.keywords) | self.text_terms | self.title_terms
+
+
+class QueryPlan(NamedTuple):
+    """
+    Query-dependent search state, computed once per search.
+
+    Attributes:
+        query: Normalized (lowercased, stripped) query
+        keywords: Keywords extracted from the query
+        intent: Detected question intent
+        expanded_keywords: Keywords after semantic and intent expansion
+        intent_keywords: Vocabulary associated with the detected intent
+        is_question: Whether the query contains a question indicator
+        other_keywords: Expanded keywords outside the lexicon, which must
+            still be matched by substring search
+    """
+    query: str
+    keywords: Tuple[str, ...]
+    intent: str
+    expanded_keywords: Tuple[str, ...]
+    intent_keywords: Tuple[str, ...]
+    is_question: bool
+    other_keywords: Tuple[str, ...]
+
+
+class InvertedIndex:
+    """
+    Character n-gram inverted index.
+
+    The relevance scorer matches keywords as substrings, which matters for
+    Chinese text where words are not separated by spaces. Every entry is
+    therefore indexed by its character unigrams and bigrams; looking up a
+    term intersects the posting lists of its bigrams, which yields every
+    entry that may contain the term (a superset, verified by the scorer).
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._entry_grams: Dict[Hashable, Set[str]] = {}
+        self._rank: Dict[Hashable, Tuple] = {}
+        # Grams whose posting sets this index may modify, or None for all;
+        # the others are shared with the index this one was copied from
+        self._owned: Optional[Set[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._entry_grams)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entry_grams
+
+    def copy(self) -> "InvertedIndex":
+        """
+        Return a copy that can be modified without affecting this index.
+
+        Posting sets are shared and only copied when the copy first changes
+        them, so copying costs a dict copy rather than the whole index.
+        This index must not be modified afterwards.
+        """
+        other = InvertedIndex()
+        other._postings.update(self._postings)
+        other._entry_grams = dict(self._entry_grams)
+        other._rank = dict(self._rank)
+        other._owned = set()
+        return other
+
+    def _writable_posting(self, gram: str) -> Set[Hashable]:
+        """Return the posting set of a gram, created or copied first if needed."""
+        posting = self._postings.get(gram)
+        if posting is None:
+            posting = self._postings[gram] = set()
+        elif self._owned is not None and gram not in self._owned:
+            posting = self._postings[gram] = set(posting)
+        else:
+            return posting
+        if self._owned is not None:
+            self._owned.add(gram)
+        return posting
+
+    @staticmethod
+    def _grams(text: str) -> Set[str]:
+        """Return the character unigrams and bigrams of text."""
+        grams = set(text)
+        grams.update(text[i:i + 2] for i in range(len(text) - 1))
+        return grams
+
+    def add(self, key: Hashable, text: str, rank: Tuple) -> None:
+        """
+        Index (or re-index) an entry.
+
+        Args:
+            key: Entry key
+            text: Searchable text of the entry
+            rank: Sort key giving the entry's position in result order;
+                re-indexing an existing entry keeps its original position
+        """
+        self.remove(key)
+        grams = self._grams(text.lower())
+        for gram in grams:
+            self._writable_posting(gram).add(key)
+        self._entry_grams[key] = grams
+        self._rank.setdefault(key, rank)
+
+    def remove(self, key: Hashable) -> None:
+        """Remove an entry from the index if present."""
+        grams = self._entry_grams.pop(key, None)
+        if not grams:
+            return
+        for gram in grams:
+            if gram in self._postings:
+                posting = self._writable_posting(gram)
+                posting.discard(key)
+                if not posting:
+                    del self._postings[gram]
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        self._postings.clear()
+        self._entry_grams.clear()
+        self._rank.clear()
+        self._owned = None
+
+    def lookup(self, term: str) -> Set[Hashable]:
+        """Return the keys of entries whose text may contain term."""
+        term = term.lower()
+        if not term:
+            return set()
+        if len(term) == 1:
+            return set(self._postings.get(term, ()))
+
+        postings = []
+        for i in range(len(term) - 1):
+            posting = self._postings.get(term[i:i + 2])
+            if not posting:
+                return set()
+            postings.append(posting)
+
+        postings.sort(key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                break
+        return result
+
+    def candidates(self, terms: Iterable[str]) -> Set[Hashable]:
+        """Return the keys of entries that may contain any of the terms."""
+        result: Set[Hashable] = set()
+        for term in terms:
+            result |= self.lookup(term)
+        return result
+
+    def all_keys(self) -> Set[Hashable]:
+        """Return the keys of all indexed entries."""
+        return set(self._entry_grams)
+
+    def ordered(self, keys: Iterable[Hashable]) -> List[Hashable]:
+        """Sort keys into result order."""
+        return sorted(keys, key=self._rank.__getitem__)
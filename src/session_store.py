@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Conversation Session Store for Summer School Chatbot
+
+This module keeps each user's conversation history separately, bounded in
+length, lifetime and total memory, with optional spilling of evicted
+sessions to a compact SQLite file, or, for servers with several worker
+processes, entirely in a SQLite file they share.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+from cache import SharedCache
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message bookkeeping cost on top of the text itself
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+def _message_size(message: Dict[str, Any]) -> int:
+    """Approximate memory held by a message."""
+    return MESSAGE_OVERHEAD_BYTES + sum(
+        len(value.encode('utf-8')) for value in message.values() if isinstance(value, str)
+    )
+
+
+class _Session:
+    """One conversation: a ring buffer of messages and its memory estimate."""
+
+    def __init__(self, max_messages: int, messages: Optional[List[Dict[str, Any]]] = None):
+        self.messages: Deque[Dict[str, Any]] = deque(messages or (), maxlen=max_messages)
+        self.size = sum(_message_size(message) for message in self.messages)
+        self.last_access = time.time()
+
+    def append(self, message: Dict[str, Any]) -> int:
+        """Append a message, dropping the oldest when full; return the size change."""
+        before = self.size
+        if len(self.messages) == self.messages.maxlen:
+            self.size -= _message_size(self.messages[0])
+        self.messages.append(message)
+        self.size += _message_size(message)
+        return self.size - before
+
+    def replace(self, index: int, message: Dict[str, Any]) -> int:
+        """Replace the message at index; return the size change."""
+        change = _message_size(message) - _message_size(self.messages[index])
+        self.messages[index] = message
+        self.size += change
+        return change
+
+
+class SessionStore:
+    """
+    Per-session conversation history.
+
+    Each session keeps at most max_messages messages (oldest dropped
+    first). Sessions idle for longer than ttl seconds expire; when the
+    estimated memory of all sessions exceeds max_bytes, the least recently
+    used sessions are evicted, or written to spill_path when one is set and
+    read back on their next access.
+    """
+
+    def __init__(self, max_messages: int = 50, ttl: Optional[float] = 86400,
+                 max_bytes: int = 16 * 1024 * 1024, spill_path: Optional[str] = None):
+        """
+        Initialize the store.
+
+        Args:
+            max_messages: Messages kept per session
+            ttl: Seconds of inactivity before a session expires, or None
+            max_bytes: Memory cap for all in-memory sessions
+            spill_path: Optional SQLite file for sessions evicted by the cap
+        """
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+        self.spilled = 0
+
+        self.spill_path = spill_path
+        self._db = None
+        if spill_path:
+            path = Path(spill_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'session_id TEXT PRIMARY KEY, messages BLOB NOT NULL, last_access REAL NOT NULL)'
+            )
+            if ttl:
+                with self._db:
+                    self._db.execute('DELETE FROM sessions WHERE last_access <= ?', (time.time() - ttl,))
+
+    def append(self, session_id: str, message: Dict[str, Any]) -> None:
+        """Append a message to a session, creating the session if needed."""
+        with self._lock:
+            self._expire()
+            session = self._session(session_id, create=True)
+            self._size += session.append(message)
+            self._enforce_cap()
+
+    def replace(self, session_id: str, response_id: str, message: Dict[str, Any]) -> bool:
+        """
+        Replace the message of a session carrying response_id.
+
+        Returns:
+            Whether the message was found; it is gone once dropped for
+            length or the session was cleared or expired
+        """
+        with self._lock:
+            self._expire()
+            session = self._session(session_id, create=False)
+            if session is None:
+                return False
+            for index in range(len(session.messages) - 1, -1, -1):
+                if session.messages[index].get('response_id') == response_id:
+                    self._size += session.replace(index, message)
+                    self._enforce_cap()
+                    return True
+            return False
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        """Return a copy of a session's messages, oldest first."""
+        with self._lock:
+            self._expire()
+            session = self._session(session_id, create=False)
+            if session is None:
+                return []
+            self._enforce_cap()
+            return list(session.messages)
+
+    def clear(self, session_id: str) -> None:
+        """Delete a session's history."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._size -= session.size
+            if self._db is not None:
+                with self._db:
+                    self._db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+
+    def reopen(self) -> None:
+        """Open a new spill file connection, e.g. in a process forked after start-up."""
+        if self._db is None:
+            return
+        with self._lock:
+            # SQLite connections must not be used, nor closed, across fork()
+            self._inherited_db = self._db
+            self._db = sqlite3.connect(str(self.spill_path), check_same_thread=False)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _session(self, session_id: str, create: bool) -> Optional[_Session]:
+        """Find a session in memory or the spill file; called with the lock held."""
+        session = self._sessions.get(session_id)
+        if session is None:
+            messages = self._unspill(session_id)
+            if messages is None and not create:
+                return None
+            session = _Session(self.max_messages, messages)
+            self._sessions[session_id] = session
+            self._size += session.size
+        session.last_access = time.time()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _expire(self) -> None:
+        """Drop sessions idle for longer than the TTL."""
+        if not self.ttl:
+            return
+        cutoff = time.time() - self.ttl
+        # Sessions are in access order, so the expired ones come first
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_access > cutoff:
+                break
+            del self._sessions[session_id]
+            self._size -= session.size
+            self.expired += 1
+
+    def _enforce_cap(self) -> None:
+        """Evict least recently used sessions while over the memory cap."""
+        # The most recently used session always stays in memory
+        while self._size > self.max_bytes and len(self._sessions) > 1:
+            session_id, session = self._sessions.popitem(last=False)
+            self._size -= session.size
+            self.evicted += 1
+            self._spill(session_id, session)
+
+    def _spill(self, session_id: str, session: _Session) -> None:
+        """Write an evicted session to the spill file, compressed."""
+        if self._db is None:
+            return
+        blob = zlib.compress(json.dumps(list(session.messages), ensure_ascii=False).encode('utf-8'))
+        try:
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO sessions (session_id, messages, last_access) VALUES (?, ?, ?)',
+                    (session_id, blob, session.last_access)
+                )
+            self.spilled += 1
+        except sqlite3.Error as e:
+            logger.warning(f"Error spilling session {session_id}: {e}")
+
+    def _unspill(self, session_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Read a spilled session back, removing it from the file."""
+        if self._db is None:
+            return None
+        try:
+            with self._db:
+                row = self._db.execute(
+                    'SELECT messages, last_access FROM sessions WHERE session_id = ?', (session_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+                self._db.execute('DELETE FROM sessions WHERE session_id = ?', (session_id,))
+        except sqlite3.Error as e:
+            logger.warning(f"Error reading spilled session {session_id}: {e}")
+            return None
+
+        blob, last_access = row
+        if self.ttl and last_access <= time.time() - self.ttl:
+            self.expired += 1
+            return None
+        return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+    def stats(self) -> Dict[str, Any]:
+        """Return session counts and memory use."""
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'messages': sum(len(session.messages) for session in self._sessions.values()),
+                'memory_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'spilled': self.spilled
+            }
+
+
+class SharedSessionStore:
+    """
+    Per-session conversation history in a SQLite file shared by processes.
+
+    Every worker process of a server reads and writes the same file, so a
+    conversation continues whichever worker serves its next request. As in
+    SessionStore, each session keeps at most max_messages messages and
+    expires after ttl seconds of inactivity; nothing is held in memory.
+    """
+
+    def __init__(self, path: str, max_messages: int = 50, ttl: Optional[float] = 86400):
+        """
+        Initialize the store.
+
+        Args:
+            path: SQLite file, created if missing
+            max_messages: Messages kept per session
+            ttl: Seconds of inactivity before a session expires, or None
+        """
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._store = SharedCache(path, table='conversation_sessions', ttl=ttl)
+
+    def append(self, session_id: str, message: Dict[str, Any]) -> None:
+        """Append a message to a session, creating the session if needed."""
+        self._store.update(session_id, lambda messages: ((messages or []) + [message])[-self.max_messages:])
+
+    def replace(self, session_id: str, response_id: str, message: Dict[str, Any]) -> bool:
+        """Replace the message of a session carrying response_id; see SessionStore.replace()."""
+        def swap(messages: Optional[List[Dict[str, Any]]]) -> Optional[List[Dict[str, Any]]]:
+            for index in range(len(messages or ()) - 1, -1, -1):
+                if messages[index].get('response_id') == response_id:
+                    messages[index] = message
+                    return messages
+            return None
+
+        return self._store.update(session_id, swap) is not None
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        """Return a session's messages, oldest first."""
+        # Rewritten as it is, to count the read as activity
+        return self._store.update(session_id, lambda messages: messages) or []
+
+    def clear(self, session_id: str) -> None:
+        """Delete a session's history."""
+        self._store.delete(session_id)
+
+    def reopen(self) -> None:
+        """Open a new database connection, e.g. in a process forked after start-up."""
+        self._store.reopen()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the session count and where the sessions are kept."""
+        return {
+            'sessions': len(self),
+            'path': str(self._store.path),
+            'max_messages': self.max_messages,
+            'ttl': self.ttl
+        }
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern Text Matcher for Summer School Chatbot
+
+This module provides an Aho-Corasick automaton that finds every occurrence
+of a fixed set of patterns in a single pass over the text, and a question
+classifier built on top of it.
+"""
+
+import re
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+# Characters that make a pattern fragment something other than a literal
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a fixed set of patterns.
+
+    Scanning a text costs O(len(text) + hits) regardless of how many
+    patterns were compiled, instead of one substring search per pattern.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: Tuple[str, ...] = tuple(sorted({p for p in patterns if p}))
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[str, ...]] = [()]
+        self._build()
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def _build(self) -> None:
+        """Build the trie, failure links and merged output sets."""
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._output[state] = (pattern,)
+
+        # Breadth-first pass: a state's failure link points at the longest
+        # proper suffix that is also a trie path, and it inherits that
+        # state's outputs so shorter patterns are reported too.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] = self._output[next_state] + self._output[fail]
+
+    def _scan(self, text: str) -> Iterable[str]:
+        """Yield every pattern occurrence in text, overlaps included."""
+        for _, pattern in self.finditer(text):
+            yield pattern
+
+    def finditer(self, text: str) -> Iterable[Tuple[int, str]]:
+        """Yield (start index, pattern) for every pattern occurrence in text."""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern in output[state]:
+                yield index - len(pattern) + 1, pattern
+
+    def count(self, text: str) -> Counter:
+        """Return the number of occurrences of each pattern found in text."""
+        return Counter(self._scan(text))
+
+    def matches(self, text: str) -> FrozenSet[str]:
+        """Return the set of patterns that occur in text."""
+        return frozenset(self._scan(text))
+
+
+class QuestionClassifier:
+    """
+    Classifies text by the first intent whose patterns match.
+
+    Patterns use the ``.*A.*B.*`` form of the knowledge base's
+    question_patterns: literal fragments that must appear in order on one
+    line. All literal fragments are compiled into a single Aho-Corasick
+    automaton, so a query is scanned once no matter how many patterns
+    exist. Patterns containing other regex syntax fall back to a
+    precompiled regex. Intents keep their declaration order as priority.
+    """
+
+    def __init__(self, patterns: Dict[str, List[str]], default: str = 'general'):
+        self.default = default
+        self._intents: List[Tuple[str, List[Tuple[str, ...]], List[re.Pattern]]] = []
+        fragments = set()
+
+        for intent, intent_patterns in patterns.items():
+            literal, fallback = [], []
+            for pattern in intent_patterns:
+                parts = self._split_literal(pattern)
+                if parts is None:
+                    fallback.append(re.compile(pattern))
+                else:
+                    literal.append(parts)
+                    fragments.update(parts)
+            self._intents.append((intent, literal, fallback))
+
+        self._matcher = AhoCorasick(fragments)
+
+    @staticmethod
+    def _split_literal(pattern: str) -> Optional[Tuple[str, ...]]:
+        """Split a ``.*``-separated pattern into literals, or None if it is not one."""
+        parts = tuple(part for part in pattern.split('.*') if part)
+        if any(char in _REGEX_METACHARS for part in parts for char in part):
+            return None
+        return parts
+
+    @staticmethod
+    def _in_order(parts: Tuple[str, ...], positions: Dict[str, List[int]]) -> bool:
+        """Check that the fragments occur one after another without overlap."""
+        offset = 0
+        for part in parts:
+            starts = positions.get(part)
+            if not starts:
+                return False
+            i = bisect_left(starts, offset)
+            if i == len(starts):
+                return False
+            offset = starts[i] + len(part)
+        return True
+
+    def classify(self, text: str) -> str:
+        """Return the first intent with a matching pattern, or the default."""
+        # '.' does not cross newlines, so every line is matched on its own
+        lines = [defaultdict(list) for _ in range(text.count('\n') + 1)]
+        for line, positions in zip(text.split('\n'), lines):
+            for start, part in self._matcher.finditer(line):
+                positions[part].append(start)
+
+        for intent, literal, fallback in self._intents:
+            for parts in literal:
+                if any(self._in_order(parts, positions) for positions in lines):
+                    return intent
+            for regex in fallback:
+                if regex.search(text):
+                    return intent
+
+        return self.default
+
+    def classify_many(self, texts: Iterable[str]) -> List[str]:
+        """Classify many texts, classifying repeated texts only once."""
+        cache: Dict[str, str] = {}
+        results = []
+        for text in texts:
+            if text not in cache:
+                cache[text] = self.classify(text)
+            results.append(cache[text])
+        return results
@@ -7,9 +7,10 @@
 
 import os
 import sys
+import json
 import logging
 from pathlib import Path
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, request, jsonify, render_template_string, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
 
@@ -18,6 +19,7 @@ sys.path.append(str(Path(__file__).parent))
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
 from chatbot_engine import SummerSchoolChatbot
+from api_common import MAX_RESULT_WAIT, TEST_PAGE_HTML, parse_batch_messages, parse_session_id
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -41,251 +43,16 @@ def initialize_chatbot():
         logger.error(f"❌ 聊天机器人初始化失败: {e}")
         return False
 
-# HTML template for testing the API
-TEST_PAGE_HTML = """
-<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>唯理书院智能助手 - 测试页面</title>
-    <style>
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f5f5f5;
-        }
-        .container {
-            background: white;
-            border-radius: 10px;
-            padding: 30px;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-        }
-        .header {
-            text-align: center;
-            margin-bottom: 30px;
-            color: #333;
-        }
-        .chat-container {
-            border: 1px solid #ddd;
-            border-radius: 8px;
-            height: 400px;
-            overflow-y: auto;
-            padding: 15px;
-            margin-bottom: 20px;
-            background-color: #fafafa;
-        }
-        .message {
-            margin-bottom: 15px;
-            padding: 10px;
-            border-radius: 8px;
-        }
-        .user-message {
-            background-color: #007bff;
-            color: white;
-            text-align: right;
-            margin-left: 20%;
-        }
-        .bot-message {
-            background-color: #e9ecef;
-            color: #333;
-            margin-right: 20%;
-        }
-        .input-group {
-            display: flex;
-            gap: 10px;
-        }
-        .input-field {
-            flex: 1;
-            padding: 12px;
-            border: 1px solid #ddd;
-            border-radius: 6px;
-            font-size: 14px;
-        }
-        .send-button {
-            padding: 12px 20px;
-            background-color: #007bff;
-            color: white;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            font-size: 14px;
-        }
-        .send-button:hover {
-            background-color: #0056b3;
-        }
-        .send-button:disabled {
-            background-color: #6c757d;
-            cursor: not-allowed;
-        }
-        .status {
-            text-align: center;
-            padding: 10px;
-            margin-bottom: 20px;
-            border-radius: 6px;
-        }
-        .status.online {
-            background-color: #d4edda;
-            color: #155724;
-            border: 1px solid #c3e6cb;
-        }
-        .status.offline {
-            background-color: #f8d7da;
-            color: #721c24;
-            border: 1px solid #f5c6cb;
-        }
-        .api-info {
-            background-color: #e3f2fd;
-            padding: 15px;
-            border-radius: 6px;
-            margin-top: 20px;
-            font-size: 12px;
-            color: #1565c0;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🎓 唯理书院智能助手</h1>
-            <p>测试页面 - Web API接口演示</p>
-        </div>
-        
-        <div id="status" class="status offline">
-            🔄 正在连接聊天机器人...
-        </div>
-        
-        <div id="chatContainer" class="chat-container">
-            <div class="message bot-message">
-                <strong>🤖 助手:</strong> 你好！我是唯理书院智能助手。有什么可以帮助你的吗？
-            </div>
-        </div>
-        
-        <div class="input-group">
-            <input type="text" id="messageInput" class="input-field" 
-                   placeholder="请输入你的问题..." 
-                   onkeypress="handleKeyPress(event)">
-            <button id="sendButton" class="send-button" onclick="sendMessage()">
-                发送
-            </button>
-        </div>
-        
-        <div class="api-info">
-            <strong>📡 API接口信息:</strong><br>
-            • POST /api/chat - 发送消息到聊天机器人<br>
-            • GET /api/status - 检查聊天机器人状态<br>
-            • GET /api/stats - 获取统计信息<br>
-            • GET / - 此测试页面
-        </div>
-    </div>
-
-    <script>
-        let isOnline = false;
-        
-        // Check chatbot status on page load
-        window.onload = function() {
-            checkStatus();
-        };
-        
-        function checkStatus() {
-            fetch('/api/status')
-                .then(response => response.json())
-                .then(data => {
-                    const statusDiv = document.getElementById('status');
-                    if (data.status === 'online') {
-                        statusDiv.className = 'status online';
-                        statusDiv.innerHTML = '✅ 聊天机器人在线';
-                        isOnline = true;
-                    } else {
-                        statusDiv.className = 'status offline';
-                        statusDiv.innerHTML = '❌ 聊天机器人离线';
-                        isOnline = false;
-                    }
-                })
-                .catch(error => {
-                    console.error('Error:', error);
-                    const statusDiv = document.getElementById('status');
-                    statusDiv.className = 'status offline';
-                    statusDiv.innerHTML = '❌ 连接失败';
-                });
-        }
-        
-        function handleKeyPress(event) {
-            if (event.key === 'Enter') {
-                sendMessage();
-            }
-        }
-        
-        function sendMessage() {
-            if (!isOnline) {
-                alert('聊天机器人当前离线，请稍后再试。');
-                return;
-            }
-            
-            const input = document.getElementById('messageInput');
-            const message = input.value.trim();
-            
-            if (!message) return;
-            
-            // Add user message to chat
-            addMessage(message, 'user');
-            
-            // Clear input and disable button
-            input.value = '';
-            const sendButton = document.getElementById('sendButton');
-            sendButton.disabled = true;
-            sendButton.textContent = '发送中...';
-            
-            // Send to API
-            fetch('/api/chat', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    message: message,
-                    use_llm: false  // Set to true if you want LLM responses
-                })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    addMessage(data.response, 'bot');
-                } else {
-                    addMessage('抱歉，处理您的消息时出现错误。', 'bot');
-                }
-            })
-            .catch(error => {
-                console.error('Error:', error);
-                addMessage('抱歉，网络连接出现问题。', 'bot');
-            })
-            .finally(() => {
-                sendButton.disabled = false;
-                sendButton.textContent = '发送';
-            });
-        }
-        
-        function addMessage(message, sender) {
-            const chatContainer = document.getElementById('chatContainer');
-            const messageDiv = document.createElement('div');
-            
-            if (sender === 'user') {
-                messageDiv.className = 'message user-message';
-                messageDiv.innerHTML = `<strong>👤 你:</strong> ${message}`;
-            } else {
-                messageDiv.className = 'message bot-message';
-                messageDiv.innerHTML = `<strong>🤖 助手:</strong> ${message}`;
-            }
-            
-            chatContainer.appendChild(messageDiv);
-            chatContainer.scrollTop = chatContainer.scrollHeight;
-        }
-    </script>
-</body>
-</html>
-"""
+def get_session_id(data=None):
+    """从请求体或X-Session-ID请求头获取会话ID，返回 (会话ID, 错误响应)"""
+    session_id, error = parse_session_id((data or {}).get('session_id') or request.headers.get('X-Session-ID'))
+    if error:
+        return None, (jsonify({
+            'success': False,
+            'error': error[0],
+            'message': error[1]
+        }), 400)
+    return session_id, None
 
 @app.route('/')
 def test_page():
@@ -320,14 +87,14 @@ def chat():
     try:
         data = request.get_json()
         
-        if not data or 'message' not in data:
+        if not isinstance(data, dict) or 'message' not in data:
             return jsonify({
                 'success': False,
                 'error': '无效的请求格式',
                 'message': 'Invalid request format'
             }), 400
         
-        user_message = data['message'].strip()
+        user_message = str(data['message']).strip()
         use_llm = data.get('use_llm', False)
         
         if not user_message:
@@ -337,8 +104,25 @@ def chat():
                 'message': 'Message cannot be empty'
             }), 400
         
+        session_id, error = get_session_id(data)
+        if error:
+            return error
+        
         # Generate response
-        response = chatbot.ask(user_message, use_llm=use_llm)
+        if data.get('refine', False):
+            # Answer now; the LLM answer is fetched from /api/chat/result/<response_id>
+            result = chatbot.ask_fast(user_message, use_llm=use_llm, session_id=session_id)
+            return jsonify({
+                'success': True,
+                'response': result['response'],
+                'response_id': result['response_id'],
+                'refining': result['refining'],
+                'timestamp': datetime.now().isoformat(),
+                'user_message': user_message,
+                'used_llm': use_llm
+            })
+        
+        response = chatbot.ask(user_message, use_llm=use_llm, session_id=session_id)
         
         return jsonify({
             'success': True,
@@ -356,6 +140,190 @@ def chat():
             'message': str(e)
         }), 500
 
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """批量聊天接口"""
+    global chatbot
+    
+    if not chatbot:
+        return jsonify({
+            'success': False,
+            'error': '聊天机器人未初始化',
+            'message': 'Chatbot not initialized'
+        }), 500
+    
+    data = request.get_json(silent=True)
+    messages, error = parse_batch_messages(data)
+    if error:
+        return jsonify({
+            'success': False,
+            'error': error[0],
+            'message': error[1]
+        }), 400
+    
+    session_id, error = get_session_id(data)
+    if error:
+        return error
+    
+    use_llm = data.get('use_llm', False)
+    
+    try:
+        results = chatbot.ask_many(messages, use_llm=use_llm, session_id=session_id)
+        return jsonify({
+            'success': True,
+            'results': results,
+            'count': len(results),
+            'timestamp': datetime.now().isoformat(),
+            'used_llm': use_llm
+        })
+    except Exception as e:
+        logger.error(f"Chat batch API error: {e}")
+        return jsonify({
+            'success': False,
+            'error': '处理消息时出现错误',
+            'message': str(e)
+        }), 500
+
+def get_result_wait():
+    """从wait查询参数获取长轮询等待秒数"""
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = 0.0
+    return min(max(wait, 0.0), MAX_RESULT_WAIT)
+
+@app.route('/api/chat/result/<response_id>', methods=['GET'])
+def chat_result(response_id):
+    """获取后台生成的LLM回答（可用wait参数长轮询）"""
+    global chatbot
+    
+    if not chatbot:
+        return jsonify({
+            'success': False,
+            'error': '聊天机器人未初始化',
+            'message': 'Chatbot not initialized'
+        }), 500
+    
+    result = chatbot.get_refined_response(response_id, wait=get_result_wait())
+    if result is None:
+        return jsonify({
+            'success': False,
+            'error': '回答不存在或已过期',
+            'message': 'Unknown or expired response_id'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        **result,
+        'timestamp': datetime.now().isoformat()
+    })
+
+def _sse_event(event: str, data: dict) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """流式聊天接口（Server-Sent Events）"""
+    global chatbot
+    
+    if not chatbot:
+        return jsonify({
+            'success': False,
+            'error': '聊天机器人未初始化',
+            'message': 'Chatbot not initialized'
+        }), 500
+    
+    data = request.get_json(silent=True)
+    
+    if not isinstance(data, dict) or 'message' not in data:
+        return jsonify({
+            'success': False,
+            'error': '无效的请求格式',
+            'message': 'Invalid request format'
+        }), 400
+    
+    user_message = str(data['message']).strip()
+    use_llm = data.get('use_llm', False)
+    
+    if not user_message:
+        return jsonify({
+            'success': False,
+            'error': '消息不能为空',
+            'message': 'Message cannot be empty'
+        }), 400
+    
+    session_id, error = get_session_id(data)
+    if error:
+        return error
+    
+    def generate():
+        chunks = []
+        try:
+            for chunk in chatbot.ask_stream(user_message, use_llm=use_llm, session_id=session_id):
+                chunks.append(chunk)
+                yield _sse_event('delta', {'delta': chunk})
+            
+            yield _sse_event('done', {
+                'success': True,
+                'response': ''.join(chunks),
+                'timestamp': datetime.now().isoformat(),
+                'user_message': user_message,
+                'used_llm': use_llm
+            })
+        except Exception as e:
+            logger.error(f"Chat stream API error: {e}")
+            yield _sse_event('error', {
+                'success': False,
+                'error': '处理消息时出现错误',
+                'message': str(e)
+            })
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Disable proxy buffering (nginx)
+        }
+    )
+
+@app.route('/api/history', methods=['GET', 'DELETE'])
+def conversation_history():
+    """获取或清除当前会话的对话记录"""
+    global chatbot
+    
+    if not chatbot:
+        return jsonify({
+            'success': False,
+            'error': '聊天机器人未初始化'
+        }), 500
+    
+    # Only from the header: query strings end up in access logs
+    session_id, error = get_session_id()
+    if error:
+        return error
+    if not session_id:
+        return jsonify({
+            'success': False,
+            'error': '缺少会话ID',
+            'message': 'session_id is required'
+        }), 400
+    
+    if request.method == 'DELETE':
+        chatbot.clear_conversation_history(session_id)
+        return jsonify({
+            'success': True,
+            'message': '对话记录已清除',
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    return jsonify({
+        'success': True,
+        'history': chatbot.get_conversation_history(session_id),
+        'timestamp': datetime.now().isoformat()
+    })
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """获取统计信息"""
@@ -455,6 +423,7 @@ def main():
     print(f"📱 测试页面: http://{host}:{port}/")
     print(f"📡 API文档:")
     print(f"   POST http://{host}:{port}/api/chat")
+    print(f"   POST http://{host}:{port}/api/chat/stream")
     print(f"   GET  http://{host}:{port}/api/status")
     print(f"   GET  http://{host}:{port}/api/stats")
     print("=" * 50)
@@ -0,0 +1,6 @@
+"""Shared test setup: modules under src/ are imported by their top-level name."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
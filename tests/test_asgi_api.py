@@ -0,0 +1,17 @@
+"""Tests for the ASGI web API."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('starlette')
+
+SRC = Path(__file__).resolve().parent.parent / 'src'
+
+
+def test_asgi_api_does_not_import_flask():
+    code = f"import sys; sys.path.insert(0, {str(SRC)!r}); import asgi_api; print('flask' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.splitlines()[-1] == 'False'
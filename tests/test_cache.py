@@ -0,0 +1,258 @@
+"""Tests for the LRU and disk caches and SingleFlight coalescing of calls and streams."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from cache import DiskCache, LRUCache, SingleFlight
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+    assert len(cache) == 2
+
+
+def test_lru_entries_expire_after_the_ttl():
+    cache = LRUCache(max_size=10, ttl=0.05)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.1)
+
+    assert cache.get('a', 'missing') == 'missing'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations'], stats['size']) == (1, 1, 1, 0)
+
+
+def test_lru_of_size_zero_stores_nothing():
+    cache = LRUCache(max_size=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_disk_cache_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = DiskCache(path, max_size=10)
+    cache.set(('question', True, '2025-07-23'), 'answer')
+    cache.set('other', {'nested': [1, 2]})
+
+    restarted = DiskCache(path, max_size=10)
+    assert restarted.get(('question', True, '2025-07-23')) == 'answer'
+    assert restarted.get('other') == {'nested': [1, 2]}
+
+
+def test_disk_cache_evictions_reach_the_file(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = DiskCache(path, max_size=2)
+    for key in 'abc':
+        cache.set(key, key.upper())
+    assert cache.get('a') is None
+
+    restarted = DiskCache(path, max_size=2)
+    assert [restarted.get(key) for key in 'abc'] == [None, 'B', 'C']
+
+
+def test_disk_cache_keeps_the_newest_entries_of_a_smaller_size(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = DiskCache(path, max_size=10)
+    for key in 'abcd':
+        cache.set(key, key.upper())
+
+    restarted = DiskCache(path, max_size=2)
+    assert len(restarted) == 2
+    assert [restarted.get(key) for key in 'abcd'] == [None, None, 'C', 'D']
+
+
+def test_disk_cache_entries_expire_across_a_restart(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    DiskCache(path, max_size=10, ttl=0.05).set('a', 1)
+    assert DiskCache(path, max_size=10, ttl=0.05).get('a') == 1
+    time.sleep(0.1)
+
+    assert DiskCache(path, max_size=10, ttl=0.05).get('a') is None
+    assert len(DiskCache(path, max_size=10, ttl=0.05)) == 0
+
+
+def test_disk_cache_clear_empties_the_file(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    cache = DiskCache(path)
+    cache.set('a', 1)
+    cache.clear()
+    assert DiskCache(path).get('a') is None
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    runs = []
+
+    async def fetch():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        return await asyncio.gather(*(flights.ado('key', fetch) for _ in range(5)))
+
+    assert asyncio.run(main()) == ['answer'] * 5
+    assert len(runs) == 1
+    assert flights.stats() == {'calls': 1, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_cancelled_first_caller_does_not_cancel_the_others():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return 'answer'
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado('key', fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flights.ado('key', fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == 'answer'
+    assert flights.stats()['calls'] == 1
+
+
+def test_call_is_cancelled_once_every_caller_is():
+    flights = SingleFlight()
+
+    async def main():
+        state = {'cancelled': False}
+
+        async def fetch():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                state['cancelled'] = True
+                raise
+
+        callers = [asyncio.ensure_future(flights.ado('key', fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        # A new call is not joined to the cancelled one
+        async def fetch_again():
+            return 'fresh'
+        return state['cancelled'], await flights.ado('key', fetch_again)
+
+    assert asyncio.run(main()) == (True, 'fresh')
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_errors_reach_every_caller():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('provider down')
+
+    async def main():
+        return await asyncio.gather(*(flights.ado('key', fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def chunked(chunks, delay=0.0, runs=None):
+    """A stream yielding chunks, delay seconds apart; appends to runs when started and 'closed' when closed."""
+    def fn():
+        if runs is not None:
+            runs.append('started')
+        try:
+            for chunk in chunks:
+                time.sleep(delay)
+                yield chunk
+        finally:
+            if runs is not None:
+                runs.append('closed')
+    return fn
+
+
+def test_concurrent_streams_share_one_run():
+    flights = SingleFlight()
+    runs = []
+    results = []
+
+    def read():
+        results.append(list(flights.stream('key', chunked(['a', 'b', 'c'], delay=0.02, runs=runs))))
+
+    readers = [threading.Thread(target=read) for _ in range(5)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+
+    assert results == [['a', 'b', 'c']] * 5
+    assert runs == ['started', 'closed']
+    assert flights.stats() == {'calls': 1, 'coalesced': 4, 'in_flight': 0}
+
+
+def test_late_stream_reader_replays_earlier_chunks():
+    flights = SingleFlight()
+    first = flights.stream('key', chunked(['a', 'b', 'c']))
+    assert next(first) == 'a'
+
+    second = flights.stream('key', chunked(['x']))
+    assert list(second) == ['a', 'b', 'c']
+    assert list(first) == ['b', 'c']
+
+
+def test_stream_goes_on_when_the_first_reader_leaves():
+    flights = SingleFlight()
+    runs = []
+    first = flights.stream('key', chunked(['a', 'b', 'c'], runs=runs))
+    second = flights.stream('key', chunked(['x']))
+    assert next(first) == 'a'
+    assert next(second) == 'a'
+    first.close()
+
+    assert list(second) == ['b', 'c']
+    assert runs == ['started', 'closed']
+
+
+def test_stream_is_closed_once_every_reader_leaves():
+    flights = SingleFlight()
+    runs = []
+    reader = flights.stream('key', chunked(['a', 'b', 'c'], runs=runs))
+    assert next(reader) == 'a'
+    reader.close()
+
+    assert runs == ['started', 'closed']
+    assert flights.stats()['in_flight'] == 0
+    assert list(flights.stream('key', chunked(['x']))) == ['x']
+
+
+def test_stream_error_reaches_every_reader_after_its_chunks():
+    flights = SingleFlight()
+
+    def broken():
+        yield 'a'
+        raise ConnectionError('lost')
+
+    first = flights.stream('key', broken)
+    second = flights.stream('key', broken)
+    assert next(first) == 'a'
+    with pytest.raises(ConnectionError):
+        next(first)
+    assert next(second) == 'a'
+    with pytest.raises(ConnectionError):
+        next(second)
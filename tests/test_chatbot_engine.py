@@ -0,0 +1,233 @@
+"""Tests for SummerSchoolChatbot without an LLM provider, and the context of its prompts."""
+
+import asyncio
+import random
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from chatbot_engine import SummerSchoolChatbot
+from context_builder import ContextBuilder, estimate_tokens
+from llm_router import ProviderRouter
+
+SHIPPED_KNOWLEDGE_BASE = Path(__file__).resolve().parent.parent / 'data' / 'knowledge_base.json'
+
+
+@pytest.fixture
+def chatbot(tmp_path):
+    # The shipped file keeps last_updated at the top level, without 'metadata'
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+    return SummerSchoolChatbot(knowledge_base_path=str(path))
+
+
+def test_shipped_knowledge_base_answers_every_entry_point(chatbot):
+    question = '地址在哪里'
+    answer = chatbot.ask(question, use_llm=False)
+    assert answer
+
+    assert chatbot.ask_fast(question, use_llm=False)['response']
+    assert asyncio.run(chatbot.aask(question, use_llm=False))
+    assert ''.join(chatbot.ask_stream(question, use_llm=False))
+    assert chatbot.ask_many([question, 'where is the school?'], use_llm=False)[0]['response']
+
+
+def test_response_cache_is_keyed_on_shipped_last_updated(chatbot):
+    kb = chatbot.knowledge_base
+    assert kb.last_updated == '2025-07-23T08:29:49.835952'
+    assert chatbot._response_cache_key('Q', False)[-1] == kb.last_updated
+
+    # Saving adds a metadata stamp, which takes precedence
+    kb.add_faq('general', '可以带电脑吗？', '可以。')
+    assert kb.last_updated != '2025-07-23T08:29:49.835952'
+    assert kb.knowledge_base['metadata']['last_updated'] == kb.last_updated
+
+
+def test_statistics_with_shipped_knowledge_base(chatbot):
+    stats = chatbot.get_statistics()
+    assert stats['knowledge_base']['last_updated'] == '2025-07-23T08:29:49.835952'
+
+
+def test_requests_without_a_session_keep_no_history(chatbot):
+    chatbot.ask('地址在哪里', use_llm=False)
+    chatbot.ask_fast('地址在哪里', use_llm=False)
+
+    assert chatbot.get_conversation_history() == []
+    assert chatbot.sessions.stats()['sessions'] == 0
+
+
+def test_batch_answers_in_order_and_keeps_going_past_a_failure(tmp_path, monkeypatch):
+    monkeypatch.setenv('BATCH_MAX_WORKERS', '2')
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+    lock = threading.Lock()
+    calls = []
+    running = [0, 0]
+
+    def provider(prompt, timeout=None):
+        with lock:
+            calls.append(prompt)
+            running[0] += 1
+            running[1] = max(running)
+        try:
+            time.sleep(0.05)
+            if '火星' in prompt:
+                raise RuntimeError('provider error')
+            return f'answer {len(prompt)}'
+        finally:
+            with lock:
+                running[0] -= 1
+
+    chatbot = SummerSchoolChatbot(knowledge_base_path=str(path), llm_router=ProviderRouter({'stub': provider}))
+    questions = ['量子计算的未来如何？', '你好', '火星上能种土豆吗？', '人工智能会取代老师吗？',
+                 ' 量子计算的未来如何？ ', '宇宙有多大？']
+    results = chatbot.ask_many(questions, session_id='s')
+
+    assert [result['question'] for result in results] == questions
+    # Repeated questions are answered once
+    assert results[0]['response'] == results[4]['response']
+    assert len(calls) == 4
+    assert running[1] <= 2
+    assert results[1]['response'] in chatbot.default_responses['greeting']
+    # A failed question gets the fallback answer; the others are unaffected
+    assert results[2]['response'] in chatbot.default_responses['unknown']
+    assert all(results[i]['response'].startswith('answer') for i in (0, 3, 4, 5))
+
+    history = chatbot.get_conversation_history('s')
+    assert [message['content'] for message in history[::2]] == questions
+
+
+def document(name, content, score):
+    return {'type': 'document', 'name': name, 'content': content, 'score': score}
+
+
+def test_tokens_are_estimated_per_cjk_character():
+    assert estimate_tokens('晚间活动') == 4
+    assert estimate_tokens('abcdefgh') == 2
+    assert estimate_tokens('地址: abcd') == 4
+
+
+@pytest.mark.parametrize('budget', [50, 100, 200, 1000])
+def test_context_stays_within_the_token_budget(budget):
+    rnd = random.Random(1)
+    vocabulary = '唯理书院暑期项目上海浦东校园报到时间住宿床垫活动邮寄快递规则行为参与讨论分享学生老师课程'
+    results = [
+        document(name, ''.join(''.join(rnd.choice(vocabulary) for _ in range(12)) + '。' for _ in range(40)), score)
+        for name, score in [('须知', 2.0), ('守则', 1.0)]
+    ]
+    report = ContextBuilder(token_budget=budget).build('晚间活动', results)
+
+    assert 0 < report.tokens <= budget
+    assert report.tokens == estimate_tokens(report.text)
+    assert report.pieces_used < report.pieces_total
+    assert report.text.startswith("Document '须知': ")
+
+
+def test_best_results_fill_the_budget_first():
+    results = [
+        {'type': 'faq', 'question': '可以带电脑吗？', 'answer': '可以。', 'score': 1.0},
+        document('须知', '报到时间为7月20日。' * 3, 3.0),
+    ]
+    report = ContextBuilder(token_budget=25, min_piece_tokens=100).build('报到', results)
+
+    assert report.text.startswith("Document '须知': ")
+    assert 'FAQ' not in report.text
+
+
+def test_near_duplicate_passages_are_dropped():
+    results = [
+        document('须知', '晚间活动从21:40到22:00，所有同学必须参与。', 2.0),
+        document('通知', '晚间活动从21:40到22:00，所有同学必须参与！', 1.0),
+        {'type': 'location', 'name': '礼堂', 'address': '申启路100号', 'score': 0.5},
+    ]
+    report = ContextBuilder().build('晚间活动', results)
+
+    assert report.duplicates == 1
+    assert '通知' not in report.text
+    assert report.text.splitlines() == [
+        "Document '须知': 晚间活动从21:40到22:00，所有同学必须参与。",
+        'Location: 礼堂 at 申启路100号'
+    ]
+
+
+def test_long_passage_is_truncated_to_the_remaining_budget():
+    results = [document('须知', '晚间活动' * 100 + '。', 1.0)]
+    report = ContextBuilder(token_budget=50, min_piece_tokens=10).build('晚间活动', results)
+
+    assert report.text.endswith('…')
+    assert report.pieces_used == 1
+    assert report.tokens <= 50
+
+
+def test_skipped_passages_are_marked_in_the_excerpt():
+    content = '报到在上午。午饭在食堂。' + '晚上没有安排。' * 5 + '报到地点在门卫处。'
+    results = [document('须知', content, 1.0)]
+    report = ContextBuilder(token_budget=22, min_piece_tokens=100).build('报到', results)
+
+    assert report.text == "Document '须知': 报到在上午。 … 报到地点在门卫处。"
+
+
+def test_stream_goes_through_the_router(tmp_path):
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+
+    def stream(prompt, timeout=None):
+        yield 'streamed '
+        yield 'answer'
+
+    router = ProviderRouter({'stub': lambda prompt, timeout=None: 'whole answer'}, stream_providers={'stub': stream})
+    chatbot = SummerSchoolChatbot(knowledge_base_path=str(path), llm_router=router)
+
+    assert ''.join(chatbot.ask_stream('量子计算的未来如何？', session_id='s')) == 'streamed answer'
+    assert router.latency['stub'].samples == 1
+    assert chatbot.llm_flights.stats()['calls'] == 1
+    assert chatbot.get_conversation_history('s')[-1]['content'] == 'streamed answer'
+
+
+@pytest.mark.parametrize('llm_answer', ['refined answer', None])
+def test_refined_answer_replaces_the_fast_one(tmp_path, llm_answer):
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+    router = ProviderRouter({'stub': lambda prompt, timeout=None: llm_answer})
+    chatbot = SummerSchoolChatbot(knowledge_base_path=str(path), llm_router=router)
+
+    fast = chatbot.ask_fast('量子计算的未来如何？', session_id='s')
+    assert fast['refining']
+    refined = chatbot.get_refined_response(fast['response_id'], wait=5)
+
+    # A failed LLM call keeps the fast answer
+    expected = llm_answer or fast['response']
+    assert refined['response'] == expected
+    history = chatbot.get_conversation_history('s')
+    assert [message['role'] for message in history] == ['user', 'assistant']
+    assert history[-1]['content'] == expected
+
+
+def test_refinements_beyond_the_limit_keep_the_fast_answer(tmp_path, monkeypatch):
+    monkeypatch.setenv('REFINE_MAX_PENDING', '2')
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+    release = threading.Event()
+
+    def slow(prompt, timeout=None):
+        release.wait(5)
+        return 'refined answer'
+
+    chatbot = SummerSchoolChatbot(knowledge_base_path=str(path), llm_router=ProviderRouter({'stub': slow}))
+    question = '量子计算的未来如何？'
+    pending = [chatbot.ask_fast(question, session_id='s') for _ in range(2)]
+    declined = chatbot.ask_fast(question, session_id='s')
+
+    assert all(result['refining'] for result in pending)
+    assert declined == {'response': pending[0]['response'], 'response_id': None, 'refining': False}
+    assert 'response_id' not in chatbot.get_conversation_history('s')[-1]
+    assert chatbot.get_statistics()['refinements']['declined'] == 1
+
+    release.set()
+    for result in pending:
+        assert chatbot.get_refined_response(result['response_id'], wait=5)['response'] == 'refined answer'
+    # The finished refinements free their slots
+    assert chatbot.ask_fast('人工智能会取代老师吗？')['refining']
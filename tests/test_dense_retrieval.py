@@ -0,0 +1,29 @@
+"""Tests for the dense retrieval index."""
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from dense_retrieval import DenseIndex
+
+
+@pytest.mark.parametrize('brute_force_limit', [2000, 0])
+def test_ties_are_cut_in_build_order(brute_force_limit):
+    # Identical texts embed identically, so their similarities tie exactly
+    entries = [(f'other{i}', f'晚间活动必须参加吗{i}') if i % 3 == 0 else (f'same{i}', '晚间活动必须参加')
+               for i in range(300)]
+    index = DenseIndex(entries, brute_force_limit=brute_force_limit)
+    tied = [key for key, _ in entries if key.startswith('same')]
+
+    for k in (1, 3, 5, 10, 150):
+        hits = index.search('晚间活动必须参加', k)
+        assert [key for key, _ in hits] == tied[:k]
+
+
+def test_results_are_best_first():
+    entries = [('a', '报到时间'), ('b', '报到时间是下午'), ('c', '床上用品'), ('d', '报到')]
+    hits = DenseIndex(entries).search('报到时间', 3)
+    scores = [score for _, score in hits]
+    assert hits[0][0] == 'a'
+    assert scores == sorted(scores, reverse=True)
+    assert all(score > 0 for score in scores)
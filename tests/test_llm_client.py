@@ -0,0 +1,142 @@
+"""Tests for LLMClient requests through the provider SDKs."""
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+openai = pytest.importorskip('openai')
+httpx = pytest.importorskip('httpx')
+
+from llm_client import ClientPool, LLMClient
+
+
+def completion(text):
+    return {
+        'id': 'chatcmpl-1', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4o',
+        'choices': [{'index': 0, 'finish_reason': 'stop',
+                     'message': {'role': 'assistant', 'content': text}}]
+    }
+
+
+class MockedOpenAI(LLMClient):
+    """LLMClient whose SDK clients send requests to a mock transport."""
+
+    def __init__(self, timeout=None, delay=0.0):
+        super().__init__('openai', timeout=timeout)
+        self.api_key = 'test-key'
+        self.delay = delay
+        self.requests = []
+
+    def _respond(self, request):
+        self.requests.append(request)
+        prompt = json.loads(request.content)['messages'][0]['content']
+        return httpx.Response(200, json=completion(f'answer to {prompt}'))
+
+    def _delayed_respond(self, request):
+        time.sleep(self.delay)
+        return self._respond(request)
+
+    async def _arespond(self, request):
+        await asyncio.sleep(self.delay)
+        return self._respond(request)
+
+    def _create(self, async_client):
+        if async_client:
+            http_client = httpx.AsyncClient(transport=httpx.MockTransport(self._arespond))
+            return openai.AsyncOpenAI(**self._sdk_options(), http_client=http_client)
+        http_client = httpx.Client(transport=httpx.MockTransport(self._delayed_respond))
+        return openai.OpenAI(**self._sdk_options(), http_client=http_client)
+
+
+def test_complete_returns_the_response_text():
+    client = MockedOpenAI(timeout=5)
+
+    assert client.complete('hello') == 'answer to hello'
+    assert client.requests[0].extensions['timeout']['read'] == 5
+
+
+def test_request_timeout_overrides_the_client_timeout():
+    client = MockedOpenAI(timeout=5)
+
+    client.complete('hello', timeout=1.5)
+
+    assert client.requests[0].extensions['timeout']['read'] == 1.5
+
+
+def test_concurrent_async_requests_hold_no_threads():
+    client = MockedOpenAI(timeout=5, delay=0.2)
+
+    async def main():
+        # Requests that each held a thread would take 200 times the delay
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        return await asyncio.gather(*(client.acomplete(f'q{i}') for i in range(200)))
+
+    start = time.monotonic()
+    answers = asyncio.run(main())
+
+    assert answers == [f'answer to q{i}' for i in range(200)]
+    assert time.monotonic() - start < 2
+
+
+def test_async_clients_are_kept_per_event_loop():
+    client = MockedOpenAI()
+
+    async def sdk_client():
+        await client.acomplete('hello')
+        return client.async_client
+
+    first = asyncio.run(sdk_client())
+    second = asyncio.run(sdk_client())
+
+    assert first is not second
+
+
+def test_pool_creates_clients_with_its_timeout():
+    pool = ClientPool(lambda provider, timeout: (provider, timeout), timeout=12)
+
+    assert pool.get('openai') == ('openai', 12)
+    assert pool.get('openai') is pool.get('openai')
+    assert pool.stats() == {'providers': ['openai'], 'clients_created': 1}
+
+
+def test_reset_closes_the_old_client():
+    closed = []
+
+    class Client:
+        def close(self):
+            closed.append(self)
+
+    pool = ClientPool(lambda provider, timeout: Client())
+    old = pool.get('openai')
+    pool.reset('openai')
+
+    assert closed == [old]
+    assert pool.get('openai') is not old
+
+
+def test_close_closes_the_sdk_clients():
+    client = MockedOpenAI()
+    client.complete('hello')
+    sdk_client = client.client
+
+    async def main():
+        await client.acomplete('hello')
+        async_client = client.async_client
+        client.close()
+        # The async client closes on its loop
+        await asyncio.sleep(0.01)
+        return async_client
+
+    async_client = asyncio.run(main())
+
+    assert sdk_client.is_closed()
+    assert async_client.is_closed()
+    assert client.complete('again') == 'answer to again'
+
+
+def test_unknown_provider_is_rejected():
+    with pytest.raises(ValueError):
+        LLMClient('nonexistent')
@@ -0,0 +1,276 @@
+"""Tests for ProviderRouter hedging, failover, timeouts and circuit breakers, against stub providers."""
+
+import asyncio
+import time
+
+import pytest
+
+from llm_client import CircuitBreaker
+from llm_router import ProviderRouter
+
+
+def answer(text, delay=0.0):
+    """A stub provider answering text after delay seconds."""
+    calls = []
+
+    def provider(prompt, timeout=None):
+        calls.append(prompt)
+        provider.timeouts.append(timeout)
+        time.sleep(delay)
+        return text
+
+    provider.calls = calls
+    provider.timeouts = []
+    return provider
+
+
+def async_answer(text, delay=0.0):
+    calls = []
+
+    async def provider(prompt, timeout=None):
+        calls.append(prompt)
+        await asyncio.sleep(delay)
+        return text
+
+    provider.calls = calls
+    return provider
+
+
+def failing(calls=None):
+    def provider(prompt, timeout=None):
+        provider.calls.append(prompt)
+        raise ConnectionError('provider down')
+
+    provider.calls = []
+    return provider
+
+
+def make_router(providers, **kwargs):
+    options = {'default_hedge_delay': 0.05, 'min_hedge_delay': 0.05, 'timeout': 1.0}
+    options.update(kwargs)
+    return ProviderRouter(providers, **options)
+
+
+def test_fast_primary_is_not_hedged():
+    router = make_router({'a': answer('from a'), 'b': answer('from b')})
+    assert router.query('q') == 'from a'
+    assert router.hedges == 0
+    assert router.providers['b'].calls == []
+
+
+def test_slow_primary_is_hedged_to_the_next_provider():
+    router = make_router({'a': answer('from a', delay=0.5), 'b': answer('from b')})
+    assert router.query('q') == 'from b'
+    assert router.hedges == 1
+    assert router.hedge_wins == 1
+
+
+def test_failed_provider_is_replaced_at_once():
+    router = make_router({'a': failing(), 'b': answer('from b')}, default_hedge_delay=5.0)
+    started = time.monotonic()
+    assert router.query('q') == 'from b'
+    assert time.monotonic() - started < 1.0
+    assert router.latency['a'].errors == 1
+
+
+def test_timeout_gives_up_on_a_provider():
+    router = make_router({'a': answer('late', delay=0.5)}, timeout=0.1)
+    started = time.monotonic()
+    assert router.query('q') is None
+    assert time.monotonic() - started < 0.4
+    assert router.breakers['a'].stats()['consecutive_failures'] == 1
+
+
+def test_ranking_prefers_the_faster_provider():
+    router = make_router({'a': answer('from a', delay=0.03), 'b': answer('from b')},
+                         min_samples=2, default_hedge_delay=1.0)
+    for provider in ('a', 'b'):
+        for _ in range(2):
+            router._call(provider, 'warm up')
+    assert router.ranked() == ['b', 'a']
+    assert router.query('q') == 'from b'
+
+
+def test_breaker_opens_and_skips_the_provider():
+    # b is slow enough that a would be asked too, as a hedge, were its circuit closed
+    router = make_router({'a': failing(), 'b': answer('from b', delay=0.2)}, failure_threshold=1, reset_timeout=60)
+    assert router.query('q') == 'from b'
+    assert router.breakers['a'].state == 'open'
+
+    calls = len(router.providers['a'].calls)
+    for _ in range(2):
+        assert router.query('q') == 'from b'
+    assert len(router.providers['a'].calls) == calls
+
+
+def test_ranking_skips_providers_with_an_open_circuit():
+    router = make_router({'a': failing(), 'b': answer('from b')}, failure_threshold=1, reset_timeout=60)
+    assert router.primary() == 'a'
+    assert router.query('q') == 'from b'
+    assert router.ranked() == ['b']
+    assert router.primary() == 'b'
+
+    router.breakers['b'].record_failure()
+    assert router.ranked() == []
+    assert router.primary() is None
+
+
+def test_providers_are_called_with_their_timeout():
+    router = make_router({'a': answer('from a'), 'b': answer('from b', delay=0.2)},
+                         timeout=2.0, timeouts={'b': 0.5})
+    assert router.query('q') == 'from a'
+    router._call('b', 'q')
+    assert router.providers['a'].timeouts == [2.0]
+    assert router.providers['b'].timeouts == [0.5]
+
+
+def test_all_breakers_open_fails_fast():
+    router = make_router({'a': failing()}, failure_threshold=1, reset_timeout=60)
+    assert router.query('q') is None
+    assert not router.available()
+    started = time.monotonic()
+    assert router.query('q') is None
+    assert time.monotonic() - started < 0.05
+    assert len(router.providers['a'].calls) == 1
+
+
+def test_half_open_breaker_closes_after_a_successful_trial():
+    state = {'fail': True}
+
+    def flaky(prompt, timeout=None):
+        if state['fail']:
+            raise ConnectionError('down')
+        return 'recovered'
+
+    router = make_router({'a': flaky}, failure_threshold=1, reset_timeout=0.05)
+    assert router.query('q') is None
+    assert router.breakers['a'].state == 'open'
+    time.sleep(0.06)
+    assert router.breakers['a'].state == 'half_open'
+    state['fail'] = False
+    assert router.query('q') == 'recovered'
+    assert router.breakers['a'].state == 'closed'
+
+
+def test_async_slow_primary_is_hedged():
+    router = make_router({'a': answer('a'), 'b': answer('b')},
+                         async_providers={'a': async_answer('from a', delay=0.5), 'b': async_answer('from b')})
+    assert asyncio.run(router.aquery('q')) == 'from b'
+    assert router.hedge_wins == 1
+
+
+def test_async_cancelled_loser_records_nothing():
+    router = make_router({'a': answer('a'), 'b': answer('b')},
+                         async_providers={'a': async_answer('from a', delay=0.5), 'b': async_answer('from b')})
+    assert asyncio.run(router.aquery('q')) == 'from b'
+    assert router.latency['a'].requests == 0
+    assert router.latency['a'].error_rate == 0.0
+    assert router.breakers['a'].stats()['consecutive_failures'] == 0
+    assert router.latency['b'].requests == 1
+
+
+def test_async_timeout_counts_as_failure():
+    router = make_router({'a': answer('a')}, async_providers={'a': async_answer('late', delay=0.5)}, timeout=0.1)
+    assert asyncio.run(router.aquery('q')) is None
+    assert router.latency['a'].errors == 1
+    assert router.breakers['a'].stats()['consecutive_failures'] == 1
+
+
+def test_requests_queued_for_a_thread_do_not_count_as_failures():
+    from concurrent.futures import ThreadPoolExecutor
+
+    router = make_router({'a': answer('ok', delay=0.2)}, timeout=0.3, max_workers=2, failure_threshold=3)
+    with ThreadPoolExecutor(max_workers=12) as callers:
+        results = list(callers.map(router.query, ['q'] * 12))
+
+    assert results.count('ok') >= 2
+    assert set(results) <= {'ok', None}
+    assert router.latency['a'].errors == 0
+    assert router.breakers['a'].state == 'closed'
+    # Dropped requests never reached the provider
+    assert len(router.providers['a'].calls) == results.count('ok')
+
+
+def test_async_requests_queued_for_a_thread_do_not_count_as_failures():
+    router = make_router({'a': answer('ok', delay=0.2)}, timeout=0.3, max_workers=2, failure_threshold=3)
+
+    async def main():
+        return await asyncio.gather(*(router.aquery('q') for _ in range(12)))
+
+    results = asyncio.run(main())
+    assert results.count('ok') >= 2
+    assert set(results) <= {'ok', None}
+    assert router.latency['a'].errors == 0
+    assert router.breakers['a'].state == 'closed'
+
+
+def streaming(chunks, fail_after=None):
+    """A stub stream provider yielding chunks, failing after fail_after of them if set."""
+    def provider(prompt, timeout=None):
+        provider.calls.append(prompt)
+        for i, chunk in enumerate(chunks):
+            if i == fail_after:
+                raise ConnectionError('stream lost')
+            yield chunk
+
+    provider.calls = []
+    return provider
+
+
+def test_stream_fails_over_before_the_first_chunk():
+    router = make_router({'a': answer('a'), 'b': answer('b')},
+                         stream_providers={'a': streaming(['x'], fail_after=0), 'b': streaming(['from ', 'b'])})
+    assert list(router.stream('q')) == ['from ', 'b']
+    assert router.latency['a'].errors == 1
+    assert router.latency['b'].samples == 1
+    assert router.breakers['b'].stats()['consecutive_failures'] == 0
+
+
+def test_stream_failure_after_a_chunk_is_raised():
+    router = make_router({'a': answer('a'), 'b': answer('b')},
+                         stream_providers={'a': streaming(['x', 'y'], fail_after=1), 'b': streaming(['b'])})
+    chunks = router.stream('q')
+    assert next(chunks) == 'x'
+    with pytest.raises(ConnectionError):
+        next(chunks)
+    assert router.breakers['a'].stats()['consecutive_failures'] == 1
+    assert router.stream_providers['b'].calls == []
+
+
+def test_stream_skips_open_circuits_and_uses_blocking_providers():
+    router = make_router({'a': failing(), 'b': answer('from b')}, failure_threshold=1, reset_timeout=60,
+                         stream_providers={'a': streaming(['x'], fail_after=0)})
+    assert list(router.stream('q')) == ['from b']
+    assert router.breakers['a'].state == 'open'
+    assert list(router.stream('q')) == ['from b']
+    assert len(router.stream_providers['a'].calls) == 1
+
+
+def test_abandoned_stream_records_nothing():
+    router = make_router({'a': answer('a')}, failure_threshold=1, reset_timeout=0.01,
+                         stream_providers={'a': streaming(['x', 'y'])})
+    router.breakers['a'].record_failure()
+    time.sleep(0.02)
+    chunks = router.stream('q')
+    assert next(chunks) == 'x'
+    chunks.close()
+    assert router.latency['a'].requests == 0
+    # The half-open trial was given back
+    assert router.breakers['a'].available()
+
+
+def test_only_the_trial_request_ends_the_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    earlier = breaker.allow_request()
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    trial = breaker.allow_request()
+    assert trial is not None
+    assert breaker.allow_request() is None
+    # A request let through before the circuit opened cannot end the trial
+    breaker.release(earlier)
+    assert breaker.allow_request() is None
+
+    breaker.release(trial)
+    assert breaker.allow_request() is not None
@@ -0,0 +1,421 @@
+"""
+Regression tests for KnowledgeBase.search.
+
+The indexed search (inverted index candidates, bounded top-k heap and
+score upper bounds) must rank exactly like the original scorer that
+scanned every entry; reference_search() below is that scorer, with the
+original regex intent detection and keyword extraction. Searches running
+during an update must see one version of the knowledge base.
+
+The BM25 and vector ranking modes are checked against plain per-entry
+scorers in the same way.
+"""
+
+import math
+import random
+import re
+import threading
+from collections import Counter
+
+import pytest
+
+from knowledge_base import KnowledgeBase
+from ranking import BM25Index, tokenize
+
+DOCUMENTS = {
+    '书院须知': '唯理书院暑期项目将在上海浦东新区申启路的校园举办。报到时间为7月20日13:30开始，18:00结束。'
+                '请同学们准时签到。\n住宿方面，学校提供床垫，床上用品需要自己准备，也可以105元购买套装。',
+    '行为守则': '本守则定义了不当行为，包括性骚扰、歧视、威胁和恐吓。任何违规行为都会被严肃处理。所有参与者应该遵守规则和纪律。',
+    '晚间活动说明': '晚间活动从21:40到22:00，所有同学必须参与。如果因特殊原因不能出席，需要提前向助教请假。晚上的活动包括讨论和分享。',
+    '邮寄指南': '如需邮寄物品，请在7月25日之前寄送到学校门卫处，收件人写唯理书院。快递到达后我们会通知你。',
+    '课程介绍': '课程建议提前预习。每天上午是讲座，下午是小组讨论，可以自由选择感兴趣的主题。',
+    'English Notes': 'The summer school campus is located in Shanghai. Orientation starts at 9:00 AM. '
+                     'Bring comfortable clothes and a notebook for the program schedule.',
+}
+
+QUERIES = [
+    '书院的地址在哪里？', '书院的日程安排是什么？', '我需要准备什么床上用品？', '晚间活动是强制参加的吗？',
+    '如何邮寄物品到学校？', '什么是不当行为', 'Where is the campus?', 'What is the schedule for orientation',
+    '床垫', '时间', '可以不参加晚间活动吗', '报到几点开始', '门卫', '上海', '需要自己买被子吗', '违规会怎么样',
+    'program notebook', '浦东', '7月25', 'Orientation', '课程可以自由选择吗', '应该怎么做', 'a', '？', 'hello world',
+]
+
+
+@pytest.fixture
+def kb(tmp_path):
+    kb = KnowledgeBase(str(tmp_path / 'knowledge_base.json'), cache_size=0)
+    for name, content in DOCUMENTS.items():
+        kb.add_document(name, content)
+    kb.add_faq('general', 'What should I bring?', 'Bring comfortable clothes and a notebook.')
+    kb.add_faq('住宿', '需要自己准备床上用品吗？', '学校提供床垫，床上用品需要自己准备。', ['住宿', '床上用品'])
+    kb.add_faq('活动', '晚间活动必须参加吗？', '是的，晚间活动所有同学必须参与。')
+    kb.add_faq('general', '可以带电脑吗？', '可以，建议带上笔记本电脑。')
+    kb.add_location('唯理书院校园', '上海市浦东新区申启路100号')
+    kb.add_location('Main Campus', '123 University Ave, City')
+    kb.add_schedule('开营仪式', '2025-07-20', '13:30')
+    kb.add_schedule('Orientation', '2024-06-15', '9:00 AM')
+    return kb
+
+
+@pytest.fixture
+def large_kb(kb):
+    """The small fixture plus generated documents, so top-k pruning has work to do."""
+    rnd = random.Random(7)
+    vocabulary = list('唯理书院暑期项目上海浦东校园报到时间住宿床垫活动邮寄快递规则行为参与讨论分享学生老师课程是在可以') + [
+        '地址', '晚间活动', '床上用品', '门卫', '签到', '需要', '建议', '7月25', '21:40'
+    ]
+    documents = {}
+    for i in range(300):
+        sentences = [''.join(rnd.choice(vocabulary) for _ in range(rnd.randint(5, 30)))
+                     for _ in range(rnd.randint(1, 8))]
+        documents[f'文档{i}'] = '。'.join(sentences)
+    kb.update_from_drive_documents(documents)
+    return kb
+
+
+INTENT_QUERIES = QUERIES + [
+    '举办地是哪', '几点结束', '行为的定义', '需要自己买吗', '需要\n买', '必须全程参与吗', '活动要参加吗',
+    '怎么寄东西', '如何把包裹寄过来', '快递\n地址', 'SCHOOL 地址', '',
+]
+
+
+def reference_intent(kb, query):
+    """The original intent detection: the first intent with a matching regex."""
+    query_lower = query.lower()
+    for intent, patterns in kb.question_patterns.items():
+        for pattern in patterns:
+            if re.search(pattern, query_lower):
+                return intent
+    return 'general'
+
+
+def reference_keywords(text):
+    """The original keyword extraction."""
+    keywords = []
+    for phrase in re.findall(r'[\u4e00-\u9fff]+', text):
+        if len(phrase) >= 2:
+            keywords.append(phrase)
+            keywords.extend(char for char in phrase if char in '址点间始束住活为垫寄')
+    stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by'}
+    keywords.extend(word for word in re.findall(r'\b[a-zA-Z]+\b', text.lower())
+                    if word not in stop_words and len(word) > 2)
+    return list(set(keywords))
+
+
+def reference_score(kb, query, keywords, intent, content, content_keywords, title):
+    """The original relevance scorer, working on the raw entry text."""
+    query = query.lower().strip()
+    content = content.lower()
+    title = title.lower()
+    score = 0.0
+
+    if query in content:
+        score += 2.0
+    if any(keyword in title for keyword in keywords):
+        score += 1.5
+
+    expanded = set(keywords)
+    for keyword in keywords:
+        for related in kb.semantic_mappings.values():
+            if keyword in related:
+                expanded.update(related)
+    if intent in kb.intent_expansions:
+        expanded.update(kb.semantic_mappings.get(kb.intent_expansions[intent], []))
+    if expanded:
+        score += sum(1 for keyword in expanded if keyword in content) / len(expanded) * 1.2
+
+    intent_keywords = kb.intent_keywords.get(intent)
+    if intent_keywords:
+        score += sum(1 for keyword in intent_keywords if keyword in content or keyword in title) / len(intent_keywords) * 0.8
+
+    if content_keywords:
+        matches = sum(1 for keyword in content_keywords if any(qk in keyword.lower() for qk in keywords))
+        score += matches / len(content_keywords) * 0.8
+
+    if any(indicator in query for indicator in kb.question_indicators):
+        score += min(sum(1 for pattern in kb.answer_patterns if pattern in content) * 0.1, 0.3)
+
+    return min(score, 3.0)
+
+
+def reference_entries(kb):
+    """(key, content, content keywords, title) of every entry, in knowledge base order."""
+    data = kb.knowledge_base
+    entries = []
+    for doc_id, doc in data['documents'].items():
+        entries.append((('document', doc_id), doc['content'], doc['keywords'], doc['name']))
+    for category, faqs in data['faqs'].items():
+        for faq_id, faq in faqs.items():
+            entries.append((('faq', category, faq_id), faq['question'] + ' ' + faq['answer'],
+                            faq.get('keywords', []), faq['question']))
+    for name, location in data['locations'].items():
+        entries.append((('location', name), name + ' ' + location['address'],
+                        ['location', 'address', 'where'], name))
+    for schedule_id, schedule in data['schedules'].items():
+        entries.append((('schedule', schedule_id), schedule['name'] + ' ' + schedule['date'] + ' ' + schedule['time'],
+                        ['schedule', 'time', 'date'], schedule['name']))
+    return entries
+
+
+def top_hits(scores, max_results):
+    """Positive (key, score) pairs sorted by score, ties in knowledge base order."""
+    hits = [(key, score) for key, score in scores if score > 0]
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+    return hits[:max_results]
+
+
+def reference_search(kb, query, max_results):
+    """Score every entry, in knowledge base order, and sort by score."""
+    keywords = reference_keywords(query)
+    intent = reference_intent(kb, query)
+    entries = reference_entries(kb)
+
+    hits = []
+    for key, content, content_keywords, title in entries:
+        score = reference_score(kb, query, keywords, intent, content, content_keywords, title)
+        if score > 0:
+            hits.append((key, score))
+    hits.sort(key=lambda hit: hit[1], reverse=True)
+    return hits[:max_results]
+
+
+def reference_bm25(kb, query, max_results, k1=1.5, b=0.75):
+    """Okapi BM25 over each entry's title, text and keywords, normalized to [0, 3]."""
+    documents = [(key, Counter(tokenize('\n'.join([title, content] + list(content_keywords)))))
+                 for key, content, content_keywords, title in reference_entries(kb)]
+    avg_length = sum(sum(terms.values()) for _, terms in documents) / len(documents)
+    query_terms = Counter(tokenize(query))
+    idf = {}
+    for term in query_terms:
+        df = sum(1 for _, terms in documents if term in terms)
+        idf[term] = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+    upper_bound = sum(qtf * idf[term] * (k1 + 1) for term, qtf in query_terms.items())
+    if upper_bound <= 0:
+        return []
+
+    scores = []
+    for key, terms in documents:
+        norm = k1 * (1 - b + b * sum(terms.values()) / avg_length)
+        score = sum(qtf * idf[term] * terms[term] * (k1 + 1) / (terms[term] + norm)
+                    for term, qtf in query_terms.items() if terms[term])
+        scores.append((key, score * 3.0 / upper_bound))
+    return top_hits(scores, max_results)
+
+
+def reference_vector(kb, query, max_results):
+    """The vector mode's query weights summed entry by entry, without the matrix."""
+    snapshot = kb._snapshot
+    plan = kb._plan_query(snapshot, query)
+    keywords = set(plan.expanded_keywords) | snapshot.lexicon.matcher.matches(plan.query)
+    weights = Counter()
+    for keyword in keywords:
+        weights[keyword] += 1.2 / len(keywords)
+    for keyword in plan.intent_keywords:
+        weights[keyword] += 0.8 / len(plan.intent_keywords)
+
+    scores = []
+    for key, *_ in reference_entries(kb):
+        terms = set(snapshot.search_entries[key].terms)
+        # Rounded like the matrix scores, so exact ties are cut in knowledge base order
+        scores.append((key, min(round(sum(weight for term, weight in weights.items() if term in terms), 5), 3.0)))
+    return top_hits(scores, max_results)
+
+
+def in_result_order(kb, hits):
+    """Keys of hits by score rounded to 5 digits, ties in knowledge base order."""
+    position = {key: i for i, (key, *_) in enumerate(reference_entries(kb))}
+    return [key for key, _ in sorted(hits, key=lambda hit: (-round(hit[1], 5), position[hit[0]]))]
+
+
+def without_pattern_only_hits(kb, query, hits):
+    """
+    Drop hits the index does not find because they share no term with the
+    query and score only through generic answer-pattern words.
+    """
+    snapshot = kb._snapshot
+    candidates = kb._find_candidates(snapshot, kb._plan_query(snapshot, query))
+    kept = []
+    for key, score in hits:
+        if key in candidates:
+            kept.append((key, score))
+        else:
+            assert score <= 0.3, (query, key, score)
+    return kept
+
+
+def test_classifier_matches_regex_intents(kb):
+    expected = [reference_intent(kb, query) for query in INTENT_QUERIES]
+    assert [kb._detect_question_intent(query) for query in INTENT_QUERIES] == expected
+    assert kb.detect_question_intents(INTENT_QUERIES) == expected
+    assert set(expected) - {'general'} == set(kb.question_patterns)
+
+
+def test_keywords_match_regex_extraction(kb):
+    for query in INTENT_QUERIES:
+        assert sorted(kb._extract_keywords_enhanced(query)) == sorted(reference_keywords(query))
+
+
+@pytest.mark.parametrize('max_results', [1, 3, 5, 50])
+def test_indexed_search_matches_full_scan(kb, max_results):
+    for query in QUERIES:
+        expected = without_pattern_only_hits(kb, query, reference_search(kb, query, 1000))[:max_results]
+        hits = kb.search_hits(query, max_results=max_results, mode='heuristic')
+        assert [key for key, _ in hits] == [key for key, _ in expected], query
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected]), query
+
+
+@pytest.mark.parametrize('max_results', [1, 3, 5, 20])
+def test_top_k_matches_full_scan_on_large_knowledge_base(large_kb, max_results):
+    for query in QUERIES:
+        expected = without_pattern_only_hits(large_kb, query, reference_search(large_kb, query, 1000))[:max_results]
+        hits = large_kb.search_hits(query, max_results=max_results, mode='heuristic')
+        assert [key for key, _ in hits] == [key for key, _ in expected], query
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected]), query
+
+
+def test_search_results_match_hits(kb):
+    for query in QUERIES:
+        results = kb.search(query, max_results=5, mode='heuristic')
+        hits = kb.search_hits(query, max_results=5, mode='heuristic')
+        assert [(result['type'], result['id'], result['score']) for result in results] == [
+            (key[0], key[-1], score) for key, score in hits
+        ]
+
+
+def test_score_upper_bound_is_never_below_score(large_kb):
+    kb = large_kb
+    snapshot = kb._snapshot
+    for query in QUERIES:
+        plan = kb._plan_query(snapshot, query)
+        candidates = kb._find_candidates(snapshot, plan)
+        phrase_candidates = snapshot.index.lookup(plan.query) if plan.query else None
+        for key, keyword_hits in candidates.items():
+            entry = snapshot.search_entries[key]
+            score = kb._calculate_enhanced_relevance_score(plan, entry)
+            bound = kb._score_upper_bound(plan, entry, keyword_hits, phrase_candidates)
+            assert bound >= score, (query, key)
+
+
+def test_ties_keep_knowledge_base_order(kb):
+    kb.add_faq('general', '晚间活动在哪里？', '晚间活动在礼堂。')
+    kb.add_faq('general', '晚间活动在哪里举行？', '晚间活动在礼堂。')
+    for query in ['晚间活动', '礼堂']:
+        expected = without_pattern_only_hits(kb, query, reference_search(kb, query, 1000))
+        hits = kb.search_hits(query, max_results=50, mode='heuristic')
+        assert [key for key, _ in hits] == [key for key, _ in expected], query
+
+
+def test_tokenizer_splits_chinese_into_unigrams_and_bigrams():
+    assert tokenize('书院地址 The Campus, Room 101!') == ['书', '院', '地', '址', '书院', '院地', '地址',
+                                                        'campus', 'room', '101']
+    assert tokenize('上海 浦东') == ['上', '海', '上海', '浦', '东', '浦东']
+    assert tokenize('the a of') == []
+
+
+def test_bm25_prefers_rare_terms_and_shorter_entries():
+    index = BM25Index()
+    index.add('short', '晚间活动')
+    index.add('long', '晚间活动在礼堂举行，所有同学都要参加，讨论和分享')
+    index.add('other', '邮寄物品到门卫处')
+    scores = index.score('晚间活动')
+    assert scores['short'] > scores['long'] > 0
+    assert 'other' not in scores
+    assert scores['short'] <= index.max_score
+
+    # 门卫 appears in one entry, 活动 in two
+    scores = index.score('门卫活动')
+    assert scores['other'] > scores['short']
+
+
+def test_bm25_copy_is_independent():
+    index = BM25Index()
+    index.add('a', '晚间活动')
+    copy = index.copy()
+    copy.add('b', '晚间活动在礼堂')
+    copy.remove('a')
+    assert set(index.score('晚间活动')) == {'a'}
+    assert set(copy.score('晚间活动')) == {'b'}
+
+
+@pytest.mark.parametrize('max_results', [1, 3, 50])
+def test_bm25_ranking_matches_reference(large_kb, max_results):
+    for query in QUERIES:
+        expected = reference_bm25(large_kb, query, max_results)
+        hits = large_kb.search_hits(query, max_results=max_results, mode='bm25')
+        assert [key for key, _ in hits] == [key for key, _ in expected], query
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected]), query
+
+
+@pytest.mark.parametrize('max_results', [1, 3, 50])
+def test_vector_ranking_matches_reference(large_kb, max_results):
+    pytest.importorskip('numpy')
+    for query in QUERIES:
+        expected = reference_vector(large_kb, query, max_results)
+        hits = large_kb.search_hits(query, max_results=max_results, mode='vector')
+        # The matrix sums in float32, so scores equal in exact arithmetic
+        # may differ in the last digits; compare them rounded
+        assert [key for key, _ in hits] == in_result_order(large_kb, expected), query
+        assert [score for _, score in hits] == pytest.approx([score for _, score in expected], abs=1e-5), query
+
+
+def test_vector_ranking_follows_updates(kb):
+    pytest.importorskip('numpy')
+    query = '礼堂'
+    assert kb.search_hits(query, mode='vector') == []
+    kb.add_faq('活动', '晚间活动在哪里？', '晚间活动在礼堂。', ['礼堂'])
+    hits = kb.search_hits(query, mode='vector')
+    assert hits
+    assert [key for key, _ in hits] == [key for key, _ in reference_vector(kb, query, 5)]
+
+
+def test_search_cache_is_invalidated_by_updates(tmp_path):
+    kb = KnowledgeBase(str(tmp_path / 'knowledge_base.json'), cache_size=16)
+    kb.add_document('须知', '报到时间为7月20日。')
+    first = kb.search('礼堂')
+    assert kb.search('礼堂') == first
+    assert kb.search_cache.stats()['hits'] == 1
+
+    kb.add_document('晚间活动', '晚间活动在礼堂。')
+    assert any(result['name'] == '晚间活动' for result in kb.search('礼堂'))
+
+
+def test_search_during_updates_sees_one_version(tmp_path):
+    kb = KnowledgeBase(str(tmp_path / 'knowledge_base.json'), cache_size=0)
+    parts = 6
+    rounds = 60
+
+    def update(n):
+        # Round n rewrites every part and adds one extra document
+        documents = {f'part{i}': f'beacon signal round {n} part {i}' for i in range(parts)}
+        documents[f'extra{n}'] = f'beacon signal round {n} extra'
+        kb.update_from_drive_documents(documents)
+
+    update(0)
+    errors = []
+    done = threading.Event()
+
+    def search():
+        while not done.is_set():
+            results = kb.search('beacon signal', max_results=1000)
+            rounds_by_kind = {'part': set(), 'extra': set()}
+            for result in results:
+                kind = 'extra' if result['name'].startswith('extra') else 'part'
+                rounds_by_kind[kind].add(int(re.search(r'round (\d+)', result['content']).group(1)))
+            current = max(rounds_by_kind['part'], default=-1)
+            if (len(rounds_by_kind['part']) != 1 or rounds_by_kind['extra'] != set(range(current + 1))
+                    or len(results) != parts + current + 1):
+                errors.append(rounds_by_kind)
+
+    readers = [threading.Thread(target=search) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for n in range(1, rounds):
+            update(n)
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+
+    assert errors == []
+    assert len(kb.search('beacon signal', max_results=1000)) == parts + rounds
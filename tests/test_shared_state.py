@@ -0,0 +1,273 @@
+"""Tests for conversation sessions and state shared by the worker processes of a server."""
+
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from chatbot_engine import SummerSchoolChatbot
+from knowledge_base import KnowledgeBase
+from llm_router import ProviderRouter
+from session_store import MESSAGE_OVERHEAD_BYTES, SessionStore, SharedSessionStore
+
+SHIPPED_KNOWLEDGE_BASE = Path(__file__).resolve().parent.parent / 'data' / 'knowledge_base.json'
+
+
+def message(content, **fields):
+    return {'role': 'user', 'content': content, **fields}
+
+
+def append_messages(path, count):
+    store = SharedSessionStore(path)
+    for i in range(count):
+        store.append('s', message(f'child {i}'))
+
+
+def test_session_keeps_the_latest_messages():
+    store = SessionStore(max_messages=3)
+    for i in range(5):
+        store.append('s', message(str(i)))
+    assert [m['content'] for m in store.get('s')] == ['2', '3', '4']
+    assert store.get('other') == []
+    assert len(store) == 1
+
+
+def test_idle_sessions_expire():
+    store = SessionStore(ttl=0.05)
+    store.append('idle', message('hi'))
+    time.sleep(0.1)
+    store.append('active', message('hello'))
+
+    assert store.get('idle') == []
+    assert [m['content'] for m in store.get('active')] == ['hello']
+    assert store.stats()['expired'] == 1
+
+
+def test_memory_cap_evicts_the_least_recently_used_sessions():
+    # Room for about two sessions of one message
+    store = SessionStore(max_bytes=2 * (MESSAGE_OVERHEAD_BYTES + 100))
+    for session_id in ['a', 'b', 'c']:
+        store.append(session_id, message('x' * 60))
+    stats = store.stats()
+
+    assert store.get('a') == []
+    assert [m['content'] for m in store.get('c')] == ['x' * 60]
+    assert stats['evicted'] == 1
+    assert stats['memory_bytes'] <= stats['max_bytes']
+
+
+def test_evicted_sessions_are_spilled_and_read_back(tmp_path):
+    store = SessionStore(max_bytes=2 * (MESSAGE_OVERHEAD_BYTES + 100), spill_path=str(tmp_path / 'sessions.db'))
+    store.append('a', message('first', response_id='r1'))
+    for session_id in ['b', 'c']:
+        store.append(session_id, message('x' * 60))
+    assert len(store) == 2
+    assert store.stats()['spilled'] == 1
+
+    # Read back on access, and replaceable like any other session
+    assert store.replace('a', 'r1', message('refined', response_id='r1'))
+    assert [m['content'] for m in store.get('a')] == ['refined']
+
+
+def test_spilled_sessions_expire(tmp_path):
+    store = SessionStore(ttl=0.05, max_bytes=1, spill_path=str(tmp_path / 'sessions.db'))
+    store.append('a', message('first'))
+    store.append('b', message('second'))
+    time.sleep(0.1)
+
+    assert store.get('a') == []
+    assert store.stats()['expired'] >= 1
+
+
+def test_cleared_session_is_gone_from_the_spill_file(tmp_path):
+    store = SessionStore(max_bytes=1, spill_path=str(tmp_path / 'sessions.db'))
+    store.append('a', message('first'))
+    store.append('b', message('second'))
+    store.clear('a')
+    assert store.get('a') == []
+
+
+def test_sessions_are_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store = SharedSessionStore(path, max_messages=100)
+    store.append('s', message('parent'))
+
+    child = multiprocessing.get_context('fork').Process(target=append_messages, args=(path, 20))
+    child.start()
+    for i in range(20):
+        store.append('s', message(f'parent {i}'))
+    child.join()
+
+    contents = [m['content'] for m in store.get('s')]
+    assert len(contents) == 41
+    assert [c for c in contents if c.startswith('child')] == [f'child {i}' for i in range(20)]
+
+
+def test_shared_session_keeps_the_latest_messages(tmp_path):
+    store = SharedSessionStore(str(tmp_path / 'state.db'), max_messages=3)
+    for i in range(5):
+        store.append('s', message(str(i)))
+    assert [m['content'] for m in store.get('s')] == ['2', '3', '4']
+    assert store.get('other') == []
+
+
+def test_shared_session_replace_and_clear(tmp_path):
+    path = str(tmp_path / 'state.db')
+    first, second = SharedSessionStore(path), SharedSessionStore(path)
+    first.append('s', message('fast', response_id='r1'))
+
+    assert second.replace('s', 'r1', message('refined', response_id='r1'))
+    assert not second.replace('s', 'r2', message('other'))
+    assert [m['content'] for m in first.get('s')] == ['refined']
+
+    second.clear('s')
+    assert first.get('s') == []
+
+
+def test_shared_session_expires(tmp_path):
+    store = SharedSessionStore(str(tmp_path / 'state.db'), ttl=0.05)
+    store.append('s', message('hi'))
+    time.sleep(0.1)
+    assert store.get('s') == []
+    assert len(store) == 0
+
+
+def write_kb(tmp_path):
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+    return str(path)
+
+
+def test_update_saved_by_another_process_is_reloaded(tmp_path):
+    path = write_kb(tmp_path)
+    worker, other = KnowledgeBase(path, cache_size=0), KnowledgeBase(path, cache_size=0)
+    version = worker.version
+
+    other.add_document('新规定', '晚间活动改到二十点开始，地点在礼堂。')
+    assert worker.reload()
+    assert worker.version > version
+    assert '新规定' in [doc['name'] for doc in worker.knowledge_base['documents'].values()]
+    assert not worker.reload()
+
+
+def add_documents(path, prefix, count):
+    kb = KnowledgeBase(path, cache_size=0)
+    for i in range(count):
+        kb.add_document(f'{prefix} {i}', f'document {i} from {prefix}')
+
+
+def search_until(kb, query, name, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if any(r.get('name') == name for r in kb.search(query)):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_searches_pick_up_updates_after_the_reload_interval(tmp_path):
+    path = write_kb(tmp_path)
+    worker = KnowledgeBase(path, reload_interval=0)
+    other = KnowledgeBase(path)
+    assert all(r.get('name') != '新规定' for r in worker.search('礼堂晚间活动新规定'))
+
+    other.add_document('新规定', '晚间活动改到二十点开始，地点在礼堂。')
+    assert search_until(worker, '礼堂晚间活动新规定', '新规定')
+
+
+def test_searches_do_not_wait_for_the_reload(tmp_path):
+    path = write_kb(tmp_path)
+    worker = KnowledgeBase(path, cache_size=0, reload_interval=0)
+    KnowledgeBase(path).add_document('新规定', '晚间活动改到二十点开始，地点在礼堂。')
+
+    # An update in progress holds up the reload, but not the searches
+    held = threading.Event()
+    release = threading.Event()
+
+    def update():
+        with worker._writing(save=False):
+            held.set()
+            release.wait(5)
+
+    writer = threading.Thread(target=update)
+    writer.start()
+    held.wait(5)
+    start = time.monotonic()
+    results = worker.search('礼堂晚间活动新规定')
+    assert time.monotonic() - start < 1
+    assert all(r.get('name') != '新规定' for r in results)
+
+    release.set()
+    writer.join()
+    assert search_until(worker, '礼堂晚间活动新规定', '新规定')
+
+
+def test_concurrent_updates_from_two_processes_are_all_saved(tmp_path):
+    path = write_kb(tmp_path)
+    child = multiprocessing.get_context('fork').Process(target=add_documents, args=(path, 'child', 20))
+    child.start()
+    add_documents(path, 'parent', 20)
+    child.join()
+
+    with open(path, encoding='utf-8') as f:
+        names = {doc['name'] for doc in json.load(f)['documents'].values()}
+    assert {f'{prefix} {i}' for prefix in ('parent', 'child') for i in range(20)} <= names
+
+
+def test_concurrent_updates_from_two_instances_are_all_saved(tmp_path):
+    path = write_kb(tmp_path)
+    threads = [threading.Thread(target=add_documents, args=(path, prefix, 20)) for prefix in ('first', 'second')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    names = {doc['name'] for doc in KnowledgeBase(path).knowledge_base['documents'].values()}
+    assert {f'{prefix} {i}' for prefix in ('first', 'second') for i in range(20)} <= names
+
+
+def test_updates_build_on_other_processes_updates(tmp_path):
+    path = write_kb(tmp_path)
+    first, second = KnowledgeBase(path), KnowledgeBase(path)
+    first.add_document('first', 'from the first worker')
+    second.add_document('second', 'from the second worker')
+
+    with open(path, encoding='utf-8') as f:
+        names = {doc['name'] for doc in json.load(f)['documents'].values()}
+    assert {'first', 'second'} <= names
+    assert list(tmp_path.glob('*.tmp')) == []
+
+
+def test_refined_answer_is_found_by_another_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv('SHARED_STATE_PATH', str(tmp_path / 'state.db'))
+    path = write_kb(tmp_path)
+    router = ProviderRouter({'stub': lambda prompt, timeout=None: 'refined answer'})
+    worker = SummerSchoolChatbot(knowledge_base_path=path, llm_router=router)
+    other = SummerSchoolChatbot(knowledge_base_path=path, llm_router=router)
+
+    fast = worker.ask_fast('量子计算的未来如何？', session_id='s')
+    assert fast['refining']
+    refined = other.get_refined_response(fast['response_id'], wait=5)
+    assert refined == {'response_id': fast['response_id'], 'status': 'done', 'response': 'refined answer'}
+    assert other.get_refined_response('unknown') is None
+
+    history = other.get_conversation_history('s')
+    assert [(m['role'], m['content']) for m in history] == [
+        ('user', '量子计算的未来如何？'), ('assistant', 'refined answer')
+    ]
+
+
+def test_one_worker_by_default_without_shared_state(tmp_path, monkeypatch):
+    pytest.importorskip('gunicorn')
+    import production_server
+
+    monkeypatch.delenv('API_WORKERS', raising=False)
+    monkeypatch.delenv('SHARED_STATE_PATH', raising=False)
+    assert production_server.get_server_options()['workers'] == 1
+    monkeypatch.setenv('SHARED_STATE_PATH', str(tmp_path / 'state.db'))
+    assert production_server.get_server_options()['workers'] == (os.cpu_count() or 1)
@@ -0,0 +1,87 @@
+"""Tests for request validation and batch and history endpoints of the Flask web API."""
+
+import shutil
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('flask_cors')
+
+import api_common
+import web_api
+from chatbot_engine import SummerSchoolChatbot
+
+SHIPPED_KNOWLEDGE_BASE = Path(__file__).resolve().parent.parent / 'data' / 'knowledge_base.json'
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = tmp_path / 'knowledge_base.json'
+    shutil.copy(SHIPPED_KNOWLEDGE_BASE, path)
+    monkeypatch.setattr(web_api, 'chatbot', SummerSchoolChatbot(knowledge_base_path=str(path)))
+    return web_api.app.test_client()
+
+
+@pytest.mark.parametrize('url', ['/api/chat', '/api/chat/stream'])
+def test_non_string_message_is_answered(client, url):
+    response = client.post(url, json={'message': 12345})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('url', ['/api/chat', '/api/chat/stream'])
+@pytest.mark.parametrize('body', [['message'], {'text': 'hi'}, {'message': '   '}])
+def test_invalid_request_is_rejected(client, url, body):
+    response = client.post(url, json=body)
+    assert response.status_code == 400
+
+
+def test_history_is_kept_only_for_the_session_that_created_it(client):
+    session = {'X-Session-ID': '3f2b8c1e-0d4a-4e6b-9c1f-2a7d5e8b6c90'}
+    other = {'X-Session-ID': '9a8b7c6d-5e4f-4a3b-8c2d-1e0f9a8b7c6d'}
+    client.post('/api/chat', json={'message': '地址在哪里'}, headers=session)
+    client.post('/api/chat', json={'message': '地址在哪里'})
+
+    assert len(client.get('/api/history', headers=session).get_json()['history']) == 2
+    assert client.get('/api/history', headers=other).get_json()['history'] == []
+
+
+@pytest.mark.parametrize('headers', [{}, {'X-Session-ID': 'default'}, {'X-Session-ID': 'a b'}])
+def test_history_requires_a_valid_session_id(client, headers):
+    assert client.get('/api/history', headers=headers).status_code == 400
+    assert client.delete('/api/history', headers=headers).status_code == 400
+
+
+def test_guessable_session_id_is_rejected(client):
+    response = client.post('/api/chat', json={'message': '地址在哪里', 'session_id': 'default'})
+    assert response.status_code == 400
+
+
+def test_batch_answers_every_message_in_order(client):
+    messages = ['你好', '书院的地址在哪里？', '你好']
+    response = client.post('/api/chat/batch', json={'messages': messages})
+    data = response.get_json()
+
+    assert response.status_code == 200
+    assert data['count'] == 3
+    assert [result['question'] for result in data['results']] == messages
+    assert data['results'][0]['response'] == data['results'][2]['response']
+
+
+@pytest.mark.parametrize('body', [
+    {'messages': []},
+    {'messages': '书院在哪里'},
+    {'messages': ['书院在哪里', '']},
+    {'messages': ['书院在哪里', 5]},
+    {'message': '书院在哪里'},
+])
+def test_invalid_batch_is_rejected(client, body):
+    assert client.post('/api/chat/batch', json=body).status_code == 400
+
+
+def test_batch_size_is_limited(client, monkeypatch):
+    monkeypatch.setattr(api_common, 'MAX_BATCH_SIZE', 2)
+    assert client.post('/api/chat/batch', json={'messages': ['你好'] * 2}).status_code == 200
+    response = client.post('/api/chat/batch', json={'messages': ['你好'] * 3})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'At most 2 messages per request'